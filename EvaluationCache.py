@@ -0,0 +1,107 @@
+from functools import wraps
+
+"""
+A cache of the static scores returned by an evaluation function, separate from
+the transposition table, so that a leaf reached through different parents, or
+again on the next pass of iterative deepening, is only evaluated once.
+
+The cache is a fixed number of slots, and the slot of a state is given by the
+hash of its bytes. A new score simply overwrites the slot of its state,
+whatever the slot held before. The whole state is kept in the slot as its key,
+so a hit is always for the same state (the cache never returns the score of
+another state).
+"""
+
+
+class EvaluationCache:
+    """
+    A fixed-size, direct-mapped cache from states to their static scores.
+    """
+
+    def __init__(self, max_size):
+        """
+        Creates and initializes a new, empty EvaluationCache.
+
+        :param max_size: the number of slots in the cache
+        :type max_size: integral
+        """
+        self._max_size = max_size
+        self._keys = [None] * max_size
+        self._scores = [None] * max_size
+        self._number_hits = 0
+        self._number_misses = 0
+
+    def wrap(self, evaluate):
+        """
+        Returns an evaluation function that returns the same scores as the
+        given one, looking them up in this EvaluationCache first, and storing
+        the scores it had to compute. The returned function has the same name
+        and attributes as the given one. Every evaluation function should have
+        its own cache.
+
+        If the given function takes an (alpha, beta) window after the expanded
+        state (see lazy_split_weight_eval()), so does the returned one, and a
+        score computed with a window is only stored if it is strictly inside
+        the window, since a score outside may only be a bound.
+
+        :param evaluate: a function taking a state and an expanded state and
+            returning a heuristic estimate of the state's utility for the
+            current player
+        :type evaluate: (array of bytes, dict(byte, char)) => numeric
+        :return: the cached evaluation function
+        :rtype: (array of bytes, dict(byte, char)) => numeric
+        """
+        keys = self._keys
+        scores = self._scores
+        max_size = self._max_size
+
+        @wraps(evaluate)
+        def cached_evaluate(state, expanded_state, *window):
+            key = state.tobytes()
+            index = hash(key) % max_size
+            if keys[index] == key:
+                self._number_hits += 1
+                return scores[index]
+            self._number_misses += 1
+            score = evaluate(state, expanded_state, *window)
+            if window and not window[0] < score < window[1]:
+                return score
+            keys[index] = key
+            scores[index] = score
+            return score
+
+        return cached_evaluate
+
+    def clear(self):
+        """
+        Removes all the scores from this EvaluationCache, without resetting its
+        counters. Must be called if the evaluation function changes.
+        """
+        for index in range(self._max_size):
+            self._keys[index] = None
+            self._scores[index] = None
+
+    def reset_counters(self):
+        """
+        Resets the number of hits and misses of this EvaluationCache to 0.
+        """
+        self._number_hits = 0
+        self._number_misses = 0
+
+    def get_counters(self):
+        """
+        Returns the number of hits and misses of this EvaluationCache since its
+        counters were last reset, as a (<hits>, <misses>) pair.
+
+        :return: the number of hits and misses
+        :rtype: (int, int)
+        """
+        return self._number_hits, self._number_misses
+
+    def get_max_size(self):
+        """
+        Returns the number of slots of this EvaluationCache.
+
+        :return: the number of slots of this EvaluationCache
+        """
+        return self._max_size
@@ -2,24 +2,41 @@ import argparse
 from ui import *
 from minimax import *
 from time import sleep
-from evaluations import simple_eval, split_weight_eval
+from evaluations import simple_eval, split_weight_eval, \
+    incremental_split_weight_eval, IncrementalExpandedState, \
+    lazy_split_weight_eval
+from compiled_evaluations import COMPILED_EVALUATIONS
 from utils import record_move_data
 from search import iterative_deepening_search
 from TranspositionTable import TranspositionTable
+from proof_number_search import make_proof_number_search
+from batch_minimax import batch_minimax, alpha_beta_batch_ordered
 
 defaults = {
     'eval': {
         'simple': simple_eval,
-        'split': split_weight_eval
+        'split': split_weight_eval,
+        'incremental': incremental_split_weight_eval,
+        'lazy': lazy_split_weight_eval,
+        'compiled': COMPILED_EVALUATIONS['split'],
+        'compiled-material': COMPILED_EVALUATIONS['material']
     },
     'eval_name': 'split',
     'search': {
         'minimax': minimax,
-        'alpha-beta': alpha_beta
+        'alpha-beta': alpha_beta,
+        'proof-number': make_proof_number_search(alpha_beta),
+        'mcts': monte_carlo_tree_search,
+        'batch-minimax': batch_minimax,
+        'batch-ordered-alpha-beta': alpha_beta_batch_ordered
     },
     'ordered-search': {
         'minimax': minimax_ordered,
-        'alpha-beta': alpha_beta_ordered
+        'alpha-beta': alpha_beta_ordered,
+        'proof-number': make_proof_number_search(alpha_beta_ordered),
+        'mcts': monte_carlo_tree_search,
+        'batch-minimax': batch_minimax,
+        'batch-ordered-alpha-beta': alpha_beta_batch_ordered
     },
     'search_name': 'alpha-beta',
     'depth': DEFAULT_DEPTH_LIMIT,
@@ -35,9 +52,15 @@ defaults = {
             TranspositionTable.replace_shallower_value_or_else_overall_oldest,
         'shallower-else-new':
             TranspositionTable.replace_shallower_value_or_else_new_entry,
+        'clock': TranspositionTable.replace_clock,
+        '2q': TranspositionTable.replace_two_queue,
+        'depth-weighted-lru':
+            TranspositionTable.replace_depth_weighted_least_recently_used,
     },
     'replace_name': 'overall-oldest',
-    'table-size': 1000000
+    'table-size': 1000000,
+    'spill-slots': 2 ** 22,
+    'eval-cache-size': 2 ** 16
 }
 
 
@@ -340,30 +363,77 @@ if __name__ == "__main__":
     _parser.add_argument("-e", "--eval", default=defaults['eval_name'],
                          choices=defaults['eval'].keys(),
                          help="the evaluation function to use")
+    _parser.add_argument("-w", "--weights", default=None,
+                         help="evaluate with the feature weights in this JSON "
+                              "file (see tune_weights.py) instead of --eval")
     _parser.add_argument("-a", "--algorithm", default=defaults['search_name'],
                          choices=defaults['search'].keys(),
                          help="the search algorithm to use")
     _parser.add_argument("-d", "--depth", type=parse_positive_int,
                          default=defaults['depth'],
                          help="the depth limit of the search")
+    _parser.add_argument("--playouts", type=parse_positive_int,
+                         default=DEFAULT_PLAYOUTS,
+                         help="the number of playouts per move of Monte Carlo"
+                              " tree search (with -a mcts)")
+    _parser.add_argument("--seconds", type=float, default=None,
+                         help="the time budget per move of Monte Carlo tree"
+                              " search in seconds, instead of a number of"
+                              " playouts")
+    _parser.add_argument("--playout-policy", default='random',
+                         choices=PLAYOUT_POLICIES,
+                         help="the playout policy of Monte Carlo tree search")
     _parser.add_argument("-r", "--replace", default=defaults['replace_name'],
                          choices=defaults['replace'].keys(),
                          help="the replacement policy to use")
     _parser.add_argument("-s", "--table-size", type=parse_positive_int,
                          default=defaults['table-size'],
                          help="the size of the transposition table")
+    _parser.add_argument("-m", "--table-mb", type=parse_positive_int,
+                         default=None,
+                         help="the memory budget of the transposition table in"
+                              " megabytes; overrides the table size")
+    _parser.add_argument("--spill-file", default=None,
+                         help="spill the entries discarded by the "
+                              "transposition table to a memory-mapped table in"
+                              " this file, and look up misses there")
+    _parser.add_argument("--spill-slots", type=parse_positive_int,
+                         default=defaults['spill-slots'],
+                         help="the number of slots of the spill table")
+    _parser.add_argument("--tablebases", default=None,
+                         help="probe the endgame tablebases in this directory"
+                              " (see generate_tablebases.py)")
+    _parser.add_argument("-c", "--eval-cache-size", type=int,
+                         default=defaults['eval-cache-size'],
+                         help="the number of slots of the evaluation cache, or"
+                              " 0 to evaluate every leaf from scratch")
     _parser.add_argument("-t", "--run-quick-test", action='store_true',
                          help="run a quick minimax/alpha-beta test instead of"
                               "playing the actual game")
     _parser.add_argument("-o", "--move-ordering", action='store_true',
                          help="use the move-ordered version of the successor"
                               "function")
+    _parser.add_argument("-b", "--binary-dump", action='store_true',
+                         help="save the table of the quick test in the binary"
+                              " memory-mapped format instead of JSON")
+    _parser.add_argument("--trace", default=None,
+                         help="record the access trace of the transposition "
+                              "table to this file, for trace_replay.py")
+    _parser.add_argument("--analyze-table", action='store_true',
+                         help="record the depth, flag, hit-rate and collision"
+                              " analysis of the transposition table with the"
+                              " data of every move (slow on large tables)")
     _parser.add_argument("-g", "--gui-mode", action='store_true',
                          help="Start game in GUI mode")
 
     # Parse command line arguments.
     _args = _parser.parse_args()
     _evaluate = defaults['eval'][_args.eval]
+    if _args.weights is not None:
+        from tune_weights import load_evaluation
+        _evaluate = load_evaluation(_args.weights)
+    if _evaluate is incremental_split_weight_eval:
+        set_expanded_state_type(IncrementalExpandedState)
     _ordered = _args.move_ordering
     _gui_mode = _args.gui_mode
     search_alg = _args.algorithm
@@ -374,25 +444,55 @@ if __name__ == "__main__":
     _depth = _args.depth
     _replacement = defaults['replace'][_args.replace]
     _table_size = _args.table_size
+    _table_bytes = None
+    if _args.table_mb is not None:
+        _table_bytes = _args.table_mb * 2 ** 20
     _run_quick_test = _args.run_quick_test
 
     # Initialize the global transposition table.
-    init_table(_table_size, _replacement)
+    if _args.spill_file is None:
+        init_table(_table_size, _replacement, _table_bytes)
+    else:
+        init_two_level_table(_table_size, _replacement, _args.spill_file,
+                             _args.spill_slots, _table_bytes)
+    if _args.trace is not None:
+        start_table_trace(_args.trace)
+    set_table_analysis(_args.analyze_table)
+
+    if _args.tablebases is not None:
+        init_tablebases(_args.tablebases)
+    init_monte_carlo_tree_search(_args.playouts, _args.seconds,
+                                 playout_policy=_args.playout_policy)
+
+    # Initialize the global evaluation cache.
+    if _args.eval_cache_size > 0:
+        init_eval_cache(_args.eval_cache_size)
+    _evaluate = cached_evaluation(_evaluate)
 
     if _run_quick_test:  # Run a search, and print results to console and file.
+        if _table_bytes is None:
+            _table_description = "table_size" + str(_table_size)
+        else:
+            _table_description = "table_mb" + str(_args.table_mb)
         print("Running", _args.algorithm, "with a depth limit of", _depth,
-              "and a table of size", _table_size, "with policy", _args.replace,
-              "with move ordering", _ordered)
+              "and a", _table_description, "table with policy",
+              _args.replace, "with move ordering", _ordered)
         game_state = get_default_game_start()
         game_expanded_state = create_expanded_state_representation(game_state)
-        result = _search(game_state, game_expanded_state, simple_eval, _depth)
+        result = _search(game_state, game_expanded_state,
+                         cached_evaluation(simple_eval), _depth)
         is_ordered = ""
         if _ordered:
             is_ordered = ".ordered"
-        filename = _args.algorithm + ".depth" + str(_depth) + ".table_size" + \
-            str(_table_size) + "." + _args.replace + is_ordered + ".json"
-        dump_table(filename)
+        filename = _args.algorithm + ".depth" + str(_depth) + "." + \
+            _table_description + "." + _args.replace + is_ordered
+        if _args.binary_dump:
+            dump_table_binary(filename + ".tt")
+        else:
+            dump_table(filename + ".json")
         print_utility_move_and_global_counters(result)
+        if _args.trace is not None:
+            stop_table_trace()
     else:  # Play the game.
         print("Welcome to madking!")
         print("We hope you have fun playing 'The Mad King!' game!")
@@ -408,3 +508,5 @@ if __name__ == "__main__":
             play_two_player(_evaluate, _search, _depth, _gui_mode)
         else:
             play_ai_only(_evaluate, _search, _depth, _gui_mode)
+        if _args.trace is not None:
+            stop_table_trace()
@@ -0,0 +1,454 @@
+from TranspositionTable import *
+from state import hash_string_to_int, int_to_hash_string
+import mmap
+import struct
+
+"""
+A binary, memory-mapped representation of a transposition table.
+
+The file starts with a header of the form:
+    <magic> <version> <record-size> <number-of-slots> <current-size>
+    <counter> * 8 <replacement-policy-name>
+where the 8 counters are the first 8 values of
+TranspositionTable.get_counters() of the table that was saved, and the
+replacement policy name is encoded in UTF-8 and padded with null bytes.
+
+The header is followed by <number-of-slots> fixed-size records of the form:
+    <key> <depth> <exact-alpha-or-beta> <move-from> <move-to> <score>
+where <key> is the integer hash of the state (see state.hash_state_int()), or
+0 if the slot is empty, and <move-from> and <move-to> are both NO_MOVE if the
+entry has no move. A key is stored in the first slot, starting at the slot its
+hash points to, that is either empty or already holds that key, looking at no
+more than PROBE_LIMIT consecutive slots. So an entry can be found by reading
+at most PROBE_LIMIT records, without parsing the rest of the file.
+"""
+
+MAGIC = b'MKTT'
+VERSION = 1
+HEADER_FORMAT = '<4sHHQQ8Q64s'
+HEADER_SIZE = struct.calcsize(HEADER_FORMAT)
+RECORD_FORMAT = '<QBBBBq'
+RECORD_SIZE = struct.calcsize(RECORD_FORMAT)
+NO_MOVE = 0xFF
+PROBE_LIMIT = 8
+MAX_LOAD_FACTOR = 0.75
+EMPTY_SLOT = 0
+
+_SIZE_OFFSET = struct.calcsize('<4sHHQ')
+
+_HASH_MULTIPLIER = 0x9E3779B97F4A7C15
+_64_BITS = 0xFFFFFFFFFFFFFFFF
+
+
+def slot_index(key, number_of_slots):
+    """
+    Returns the index of the slot that the given integer key hashes to.
+
+    :param key: an integer hash returned by state.hash_state_int()
+    :type key: int
+    :param number_of_slots: the number of slots in the table
+    :type number_of_slots: int
+    :return: the index of the slot that the given key hashes to
+    :rtype: int
+    """
+    return (((key * _HASH_MULTIPLIER) & _64_BITS) * number_of_slots) >> 64
+
+
+def pack_value(key, value):
+    """
+    Returns the record for the given integer key and table value.
+
+    :param key: an integer hash returned by state.hash_state_int()
+    :type key: int
+    :param value: a (<depth>, <score>, <move>, <exact-alpha-or-beta>) tuple
+    :return: the record for the given key and value
+    :rtype: bytes
+    """
+    move = value[MOVE_INDEX]
+    if move is None:
+        move = (NO_MOVE, NO_MOVE)
+    return struct.pack(RECORD_FORMAT, key, value[DEPTH_INDEX],
+                       value[FLAGS_INDEX], move[0], move[1],
+                       value[SCORE_INDEX])
+
+
+def unpack_value(depth, flags, move_from, move_to, score):
+    """
+    Returns the table value stored in the given (unpacked) record fields.
+
+    :return: a (<depth>, <score>, <move>, <exact-alpha-or-beta>) tuple
+    """
+    if move_from == NO_MOVE:
+        return depth, score, None, flags
+    return depth, score, (move_from, move_to), flags
+
+
+class MappedTable:
+    """
+    A fixed-size transposition table whose slots live in a memory-mapped file.
+    Opening a saved table only reads its header, so it can be probed right
+    away. When the table is opened for writing, a new entry replaces an entry
+    with the same key iff it is at least as deep, or else goes into the first
+    empty slot, or else replaces the shallowest entry it is at least as deep as
+    in its probe window (otherwise, it is rejected).
+    """
+
+    def __init__(self, filename, writable=False):
+        """
+        Opens the MappedTable saved in the file with the given name.
+
+        :param filename: the name of the file containing the table
+        :type filename: string
+        :param writable: should the table be opened for writing? defaults to
+            False
+        :type writable: bool
+        """
+        self._filename = filename
+        self._file = open(filename, 'r+b' if writable else 'rb')
+        self._map = mmap.mmap(self._file.fileno(), 0, access=(
+            mmap.ACCESS_WRITE if writable else mmap.ACCESS_READ))
+        magic, version, record_size, self._max_size, self._current_size, \
+            *self._saved_counters, policy_name = \
+            struct.unpack_from(HEADER_FORMAT, self._map, 0)
+        if magic != MAGIC or version != VERSION or record_size != RECORD_SIZE:
+            self.close()
+            raise ValueError("not a binary transposition table: " + filename)
+        self._policy_name = policy_name.rstrip(b'\0').decode('utf-8')
+        self._writable = writable
+        self._number_attempted_mutations = 0
+        self._number_entries_replaced = 0
+        self._number_entries_rejected = 0
+        self._number_direct_accesses = 0
+        self._number_entries_swapped = 0
+        self._number_directly_added = 0
+        self._number_safe_accesses = 0
+        self._number_hits = 0
+
+    @staticmethod
+    def create(filename, max_size, policy_name='', counters=(0,) * 8):
+        """
+        Creates a file with the given name holding an empty MappedTable with
+        the given number of slots, and returns that table opened for writing.
+
+        :param filename: the name of the file to create
+        :type filename: string
+        :param max_size: the number of slots in the table
+        :type max_size: int
+        :param policy_name: the name of the replacement policy of the table
+            that will be saved in this file; defaults to the empty string
+        :type policy_name: string
+        :param counters: the 8 counters of the table that will be saved in
+            this file, in the same order as TranspositionTable.get_counters();
+            defaults to all 0
+        :return: the new table, opened for writing
+        :rtype: MappedTable
+        """
+        with open(filename, 'wb') as outfile:
+            outfile.write(struct.pack(HEADER_FORMAT, MAGIC, VERSION,
+                                      RECORD_SIZE, max_size, 0, *counters,
+                                      policy_name.encode('utf-8')))
+            outfile.truncate(HEADER_SIZE + max_size * RECORD_SIZE)
+        return MappedTable(filename, writable=True)
+
+    def _find(self, key):
+        """
+        Returns (<offset>, <record>) for the slot holding the given integer
+        key, or (None, None) if no slot in its probe window holds it.
+        """
+        index = slot_index(key, self._max_size)
+        for _ in range(min(PROBE_LIMIT, self._max_size)):
+            offset = HEADER_SIZE + index * RECORD_SIZE
+            record = struct.unpack_from(RECORD_FORMAT, self._map, offset)
+            if record[0] == key:
+                return offset, record
+            if record[0] == EMPTY_SLOT:
+                break
+            index += 1
+            if index == self._max_size:
+                index = 0
+        return None, None
+
+    def __getitem__(self, key):
+        """
+        Returns the value of the entry with the given key.
+
+        :param key: the key of the entry, either a hash string or an integer
+            hash of a state
+        :return: the value of the entry
+        """
+        self._number_direct_accesses += 1
+        if isinstance(key, str):
+            key = hash_string_to_int(key)
+        _, record = self._find(key)
+        if record is None:
+            raise KeyError(key)
+        return unpack_value(*record[1:])
+
+    def __setitem__(self, key, value):
+        """
+        Adds an entry to this MappedTable, as described in the class
+        documentation. The table must have been opened for writing.
+
+        :param key: the key of the new table entry, either a hash string or an
+            integer hash of a state
+        :param value: the value of the new table entry
+        """
+        self.put(key, value)
+
+    def __iter__(self):
+        """
+        Returns an iterator over the hash strings of the keys in this
+        MappedTable, in slot order.
+
+        :return: a key iterator for this MappedTable
+        :rtype: iterator
+        """
+        for index in range(self._max_size):
+            key = struct.unpack_from('<Q', self._map,
+                                     HEADER_SIZE + index * RECORD_SIZE)[0]
+            if key != EMPTY_SLOT:
+                yield int_to_hash_string(key)
+
+    def __len__(self):
+        """
+        Returns the number of entries in this MappedTable.
+
+        :return: the number of entries in this MappedTable
+        :rtype: integral
+        """
+        return self._current_size
+
+    def get(self, key, default=None, depth=None):
+        """
+        Returns the value of the entry with the given key, or the given default
+        value if this MappedTable does not contain an entry with the given key.
+
+        :param key: the key of the entry, either a hash string or an integer
+            hash of a state
+        :param default: the default to return if there is no entry with the key
+        :param depth: unused (see TranspositionTable.get()); defaults to None
+        :return: the value of the entry with the given key, or the default
+        """
+        self._number_safe_accesses += 1
+        if isinstance(key, str):
+            key = hash_string_to_int(key)
+        _, record = self._find(key)
+        if record is None:
+            return default
+        self._number_hits += 1
+        return unpack_value(*record[1:])
+
+    def put(self, key, value):
+        """
+        Adds an entry to this MappedTable, as described in the class
+        documentation, and returns True iff the entry was stored. The table
+        must have been opened for writing.
+
+        :param key: the key of the new table entry, either a hash string or an
+            integer hash of a state
+        :param value: the value of the new table entry
+        :return: True iff the entry was stored
+        :rtype: bool
+        """
+        self._number_attempted_mutations += 1
+        if isinstance(key, str):
+            key = hash_string_to_int(key)
+        depth = value[DEPTH_INDEX]
+        index = slot_index(key, self._max_size)
+        victim_offset = None
+        victim_depth = depth + 1
+        for _ in range(min(PROBE_LIMIT, self._max_size)):
+            offset = HEADER_SIZE + index * RECORD_SIZE
+            slot_key, slot_depth = struct.unpack_from('<QB', self._map, offset)
+            if slot_key == key:
+                if depth < slot_depth:
+                    self._number_entries_rejected += 1
+                    return False
+                self._number_entries_swapped += 1
+                self._map[offset:offset + RECORD_SIZE] = pack_value(key, value)
+                return True
+            if slot_key == EMPTY_SLOT:
+                self._current_size += 1
+                self._number_directly_added += 1
+                self._map[offset:offset + RECORD_SIZE] = pack_value(key, value)
+                return True
+            if slot_depth < victim_depth:
+                victim_offset = offset
+                victim_depth = slot_depth
+            index += 1
+            if index == self._max_size:
+                index = 0
+        if victim_offset is None:
+            self._number_entries_rejected += 1
+            return False
+        self._number_entries_replaced += 1
+        self._map[victim_offset:victim_offset + RECORD_SIZE] = \
+            pack_value(key, value)
+        return True
+
+    def reset_counters(self):
+        """
+        Resets the counters of this MappedTable to 0 (see
+        TranspositionTable.reset_counters()). The counters saved in the file
+        are not affected.
+        """
+        self._number_attempted_mutations = 0
+        self._number_entries_replaced = 0
+        self._number_entries_rejected = 0
+        self._number_direct_accesses = 0
+        self._number_entries_swapped = 0
+        self._number_directly_added = 0
+        self._number_safe_accesses = 0
+        self._number_hits = 0
+
+    def get_counters(self):
+        """
+        Returns a tuple containing the current value of all the counters of
+        this MappedTable, in the same order as
+        TranspositionTable.get_counters().
+        """
+        return (self._number_attempted_mutations,
+                self._number_entries_replaced, self._number_entries_rejected,
+                self._number_direct_accesses, self._number_entries_swapped,
+                self._number_directly_added, self._number_safe_accesses,
+                self._number_hits)
+
+    def get_saved_counters(self):
+        """
+        Returns the 8 counters of the table saved in this file, in the same
+        order as TranspositionTable.get_counters().
+        """
+        return tuple(self._saved_counters)
+
+    def get_footprint(self):
+        """
+        Returns the exact size of this MappedTable in bytes.
+
+        :return: the size of this MappedTable in bytes
+        :rtype: int
+        """
+        return HEADER_SIZE + self._max_size * RECORD_SIZE
+
+    def get_bytes_per_entry(self):
+        """
+        Returns the number of bytes used per entry of this MappedTable, or the
+        size of one record if the table is empty.
+
+        :return: the number of bytes used per entry
+        :rtype: float
+        """
+        if self._current_size == 0:
+            return RECORD_SIZE
+        return self.get_footprint() / self._current_size
+
+    def get_max_size(self):
+        """
+        Returns the number of slots of this MappedTable.
+
+        :return: the number of slots of this MappedTable
+        """
+        return self._max_size
+
+    def get_replacement_policy_name(self):
+        """
+        Returns the name of the replacement policy of the table saved in this
+        file.
+
+        :return: the name of the replacement policy
+        :rtype: string
+        """
+        return self._policy_name
+
+    def close(self):
+        """
+        Writes the current size of this MappedTable back to the header if it
+        was opened for writing, then closes the file.
+        """
+        if self._writable:
+            struct.pack_into('<Q', self._map, _SIZE_OFFSET,
+                             self._current_size)
+            self._map.flush()
+        self._map.close()
+        self._file.close()
+
+
+def write_binary_table(entries, counters, policy_name, filename):
+    """
+    Saves the given table entries to a binary file with the given name. The
+    table starts with enough slots to keep the load factor under
+    MAX_LOAD_FACTOR, and the number of slots is doubled until every entry fits
+    in the probe window of its key, so that no entry is lost.
+
+    :param entries: a dict mapping hash strings to sequences of the form
+        (<depth>, <score>, <move>, <exact-alpha-or-beta>)
+    :type entries: dict(string, sequence)
+    :param counters: the 8 counters of the table, in the same order as
+        TranspositionTable.get_counters()
+    :param policy_name: the name of the replacement policy of the table
+    :type policy_name: string
+    :param filename: the name of the file to which to save the table
+    :type filename: string
+    """
+    max_size = int(len(entries) / MAX_LOAD_FACTOR) + 1
+    while True:
+        table = MappedTable.create(filename, max_size, policy_name, counters)
+        for key, value in entries.items():
+            if not table.put(key, value) or table._number_entries_replaced:
+                break
+        else:
+            table.close()
+            return
+        table.close()
+        max_size *= 2
+
+
+def save_table(table, filename):
+    """
+    Saves the given TranspositionTable to a binary file with the given name.
+
+    :param table: the table to save
+    :type table: TranspositionTable
+    :param filename: the name of the file to which to save the table
+    :type filename: string
+    """
+    write_binary_table(table.to_json_serializable()['table'],
+                       table.get_counters(),
+                       table.get_replacement_policy().__name__, filename)
+
+
+def convert_json_dump(json_filename, binary_filename):
+    """
+    Converts a transposition table dumped in JSON format (see
+    minimax.dump_table()) to the binary format.
+
+    :param json_filename: the name of the JSON file to convert
+    :type json_filename: string
+    :param binary_filename: the name of the binary file to write
+    :type binary_filename: string
+    """
+    import json
+
+    with open(json_filename) as infile:
+        json_object = json.load(infile)
+    counters = [json_object['number-attempted-mutations'],
+                json_object['number-entries-replaced'],
+                json_object['number-entries-rejected'],
+                json_object['number-direct-accesses'],
+                json_object['number-entries-swapped'],
+                json_object['number-directly-added'],
+                json_object['number-safe-accesses'],
+                json_object['number-hits']]
+    write_binary_table(json_object['table'], counters,
+                       json_object['replacement-policy'], binary_filename)
+
+
+if __name__ == "__main__":
+    import argparse
+
+    _parser = argparse.ArgumentParser(
+        description="Convert a JSON transposition table dump to the binary "
+                    "memory-mapped format.")
+    _parser.add_argument("json_file", help="the JSON dump to convert")
+    _parser.add_argument("binary_file", help="the binary file to write")
+    _args = _parser.parse_args()
+    convert_json_dump(_args.json_file, _args.binary_file)
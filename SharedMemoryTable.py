@@ -0,0 +1,439 @@
+from TranspositionTable import *
+from MappedTable import slot_index, NO_MOVE
+from state import hash_string_to_int
+from multiprocessing import shared_memory
+import struct
+
+"""
+A transposition table whose slots live in a multiprocessing.shared_memory
+block, so that several search processes can read and write the same table.
+
+The block is an array of fixed-size slots of the form:
+    <check> <score> <data>
+where <score> is the score of the entry as an unsigned 64-bit integer, <data>
+packs the rest of the value as
+    <depth> | <exact-alpha-or-beta> << 8 | <move-from> << 16 | <move-to> << 24
+(with <move-from> and <move-to> both NO_MOVE if the entry has no move), and
+<check> is <key> ^ <score> ^ <data>, where <key> is the integer hash of the
+state (see state.hash_state_int()). An empty slot is all zeros, which decodes
+to a key of 0, that no valid state has.
+
+Writes take no lock (this is the "lockless XOR" scheme): if two processes write
+the same slot at the same time, or if a process reads a slot while another one
+is writing it, the words read may come from different entries. The key decoded
+from such a torn slot does not match the key that was looked up (except with
+negligible probability), so a torn entry is simply treated as a miss.
+
+The slots are grouped in buckets of BUCKET_SIZE consecutive slots: the first
+slot of a bucket keeps the deepest entry, and the others always accept new
+entries, the oldest of them being replaced first.
+"""
+
+SLOT_FORMAT = '<QQQ'
+SLOT_SIZE = struct.calcsize(SLOT_FORMAT)
+BUCKET_SIZE = 2
+
+_64_BITS = 0xFFFFFFFFFFFFFFFF
+_SIGN_BIT = 1 << 63
+
+
+def pack_slot(key, value):
+    """
+    Returns the (<check>, <score>, <data>) words of the slot for the given
+    integer key and table value.
+
+    :param key: an integer hash returned by state.hash_state_int()
+    :type key: int
+    :param value: a (<depth>, <score>, <move>, <exact-alpha-or-beta>) tuple
+    :return: the three words of the slot
+    :rtype: (int, int, int)
+    """
+    move = value[MOVE_INDEX]
+    if move is None:
+        move = (NO_MOVE, NO_MOVE)
+    score = value[SCORE_INDEX] & _64_BITS
+    data = value[DEPTH_INDEX] | value[FLAGS_INDEX] << 8 | move[0] << 16 | \
+        move[1] << 24
+    return key ^ score ^ data, score, data
+
+
+def unpack_slot(score, data):
+    """
+    Returns the table value stored in the given <score> and <data> words.
+
+    :return: a (<depth>, <score>, <move>, <exact-alpha-or-beta>) tuple
+    """
+    if score & _SIGN_BIT:
+        score -= 1 << 64
+    move_from = (data >> 16) & 0xFF
+    move = None if move_from == NO_MOVE else (move_from, (data >> 24) & 0xFF)
+    return data & 0xFF, score, move, (data >> 8) & 0xFF
+
+
+class SharedMemoryTable:
+    """
+    A fixed-size transposition table shared between processes. Each process
+    attaches to the table by name, and keeps its own counters.
+    """
+
+    def __init__(self, name, _shared_memory=None):
+        """
+        Attaches to the SharedMemoryTable with the given name, created by
+        SharedMemoryTable.create() in this process or in another one.
+
+        :param name: the name of the shared memory block of the table
+        :type name: string
+        """
+        if _shared_memory is None:
+            _shared_memory = shared_memory.SharedMemory(name)
+        self._shared_memory = _shared_memory
+        self._buffer = _shared_memory.buf
+        self._max_size = len(self._buffer) // SLOT_SIZE
+        self._max_size -= self._max_size % BUCKET_SIZE
+        self._number_attempted_mutations = 0
+        self._number_entries_replaced = 0
+        self._number_entries_rejected = 0
+        self._number_direct_accesses = 0
+        self._number_entries_swapped = 0
+        self._number_directly_added = 0
+        self._number_safe_accesses = 0
+        self._number_hits = 0
+        self._number_probes_by_depth = {}
+        self._number_hits_by_depth = {}
+
+    @staticmethod
+    def create(max_size, name=None):
+        """
+        Creates a new, empty SharedMemoryTable, and returns it attached to the
+        current process. Other processes can attach to it with
+        SharedMemoryTable(table.get_name()).
+
+        :param max_size: the number of slots in the table; rounded up to a
+            multiple of BUCKET_SIZE
+        :type max_size: integral
+        :param name: the name of the shared memory block of the table, or None
+            to let the system choose a unique name; defaults to None
+        :type name: string
+        :return: the new table
+        :rtype: SharedMemoryTable
+        """
+        max_size = -(-max_size // BUCKET_SIZE) * BUCKET_SIZE
+        block = shared_memory.SharedMemory(name, create=True,
+                                           size=max_size * SLOT_SIZE)
+        block.buf[:max_size * SLOT_SIZE] = bytes(max_size * SLOT_SIZE)
+        return SharedMemoryTable(block.name, block)
+
+    def _probe(self, key):
+        """
+        Returns (<offset>, <value>) for the slot of the bucket of the given
+        integer key that holds it, or (None, None) if no slot of the bucket
+        holds it (torn slots never do).
+        """
+        offset = slot_index(key, self._max_size // BUCKET_SIZE) * \
+            BUCKET_SIZE * SLOT_SIZE
+        for _ in range(BUCKET_SIZE):
+            check, score, data = struct.unpack_from(SLOT_FORMAT, self._buffer,
+                                                    offset)
+            if check ^ score ^ data == key:
+                return offset, unpack_slot(score, data)
+            offset += SLOT_SIZE
+        return None, None
+
+    def __getitem__(self, key):
+        """
+        Returns the value of the entry with the given key.
+
+        :param key: the key of the entry, either a hash string or an integer
+            hash of a state
+        :return: the value of the entry
+        """
+        self._number_direct_accesses += 1
+        if isinstance(key, str):
+            key = hash_string_to_int(key)
+        _, value = self._probe(key)
+        if value is None:
+            raise KeyError(key)
+        return value
+
+    def __setitem__(self, key, value):
+        """
+        Adds an entry to this SharedMemoryTable using its replacement policy
+        (see replace_shallower_value_or_else_oldest_in_bucket()).
+
+        :param key: the key of the new table entry, either a hash string or an
+            integer hash of a state
+        :param value: the value of the new table entry
+        """
+        self.replace_shallower_value_or_else_oldest_in_bucket(key, value)
+
+    def __iter__(self):
+        """
+        Returns an iterator over the integer keys of the entries in this
+        SharedMemoryTable, in slot order.
+
+        :return: a key iterator for this SharedMemoryTable
+        :rtype: iterator
+        """
+        for check, score, data in struct.iter_unpack(
+                SLOT_FORMAT, self._buffer[:self._max_size * SLOT_SIZE]):
+            if check or data:
+                yield check ^ score ^ data
+
+    def __len__(self):
+        """
+        Returns the number of non-empty slots in this SharedMemoryTable. This
+        scans the whole table.
+
+        :return: the number of entries in this SharedMemoryTable
+        :rtype: integral
+        """
+        return sum(1 for _ in self)
+
+    def get(self, key, default=None, depth=None):
+        """
+        Returns the value of the entry with the given key, or the given default
+        value if this SharedMemoryTable does not contain an entry with the
+        given key (or if that entry is torn).
+
+        :param key: the key of the entry, either a hash string or an integer
+            hash of a state
+        :param default: the default to return if there is no entry with the key
+        :param depth: the remaining depth of the search making the lookup,
+            which is only used to count hits by depth (see
+            TranspositionTable.analyze()); defaults to None
+        :return: the value of the entry with the given key, or the default
+        """
+        self._number_safe_accesses += 1
+        if isinstance(key, str):
+            key = hash_string_to_int(key)
+        _, value = self._probe(key)
+        if depth is not None:
+            probes = self._number_probes_by_depth
+            probes[depth] = probes.get(depth, 0) + 1
+            if value is not None:
+                hits = self._number_hits_by_depth
+                hits[depth] = hits.get(depth, 0) + 1
+        if value is None:
+            return default
+        self._number_hits += 1
+        return value
+
+    def reset_counters(self):
+        """
+        Resets the counters of this process to 0 (see
+        TranspositionTable.reset_counters()).
+        """
+        self._number_attempted_mutations = 0
+        self._number_entries_replaced = 0
+        self._number_entries_rejected = 0
+        self._number_direct_accesses = 0
+        self._number_entries_swapped = 0
+        self._number_directly_added = 0
+        self._number_safe_accesses = 0
+        self._number_hits = 0
+        self._number_probes_by_depth = {}
+        self._number_hits_by_depth = {}
+
+    def get_counters(self):
+        """
+        Returns a tuple containing the current value of all the counters of
+        this process, in the same order as TranspositionTable.get_counters().
+        """
+        return (self._number_attempted_mutations,
+                self._number_entries_replaced, self._number_entries_rejected,
+                self._number_direct_accesses, self._number_entries_swapped,
+                self._number_directly_added, self._number_safe_accesses,
+                self._number_hits)
+
+    def get_bytes_per_entry(self):
+        """
+        Returns the number of bytes used per entry of this SharedMemoryTable:
+        the size of one slot.
+
+        :return: the number of bytes used per entry
+        :rtype: int
+        """
+        return SLOT_SIZE
+
+    def get_level_hits(self):
+        """
+        Returns a (<in-memory-hits>, <on-disk-hits>) pair counting the hits of
+        get() in this process since the counters were last reset (see
+        TranspositionTable.get_level_hits()).
+
+        :return: the number of hits served by each level
+        :rtype: (int, int)
+        """
+        return self._number_hits, 0
+
+    def analyze(self, sample_size=ANALYSIS_SAMPLE_SIZE):
+        """
+        Returns an analysis of this SharedMemoryTable (see
+        TranspositionTable.analyze()), based on the lookups by depth of this
+        process and on a sample of evenly spaced buckets. The home slot of an
+        entry is the first slot of its bucket, so a sampled entry in another
+        slot of the bucket is a collision.
+
+        :param sample_size: the (approximate) number of slots to look at;
+            defaults to ANALYSIS_SAMPLE_SIZE
+        :type sample_size: int
+        :return: the analysis of this SharedMemoryTable
+        :rtype: dict(string, object)
+        """
+        stride = max(1, self._max_size // sample_size // BUCKET_SIZE) * \
+            BUCKET_SIZE
+        sample = []
+        number_of_collisions = 0
+        for offset in range(0, self._max_size * SLOT_SIZE, stride * SLOT_SIZE):
+            home_key = None
+            for slot, (check, score, data) in enumerate(struct.iter_unpack(
+                    SLOT_FORMAT,
+                    self._buffer[offset:offset + BUCKET_SIZE * SLOT_SIZE])):
+                if not (check or data):
+                    continue
+                key = check ^ score ^ data
+                if slot == 0:
+                    home_key = key
+                elif home_key is not None and key != home_key:
+                    number_of_collisions += 1
+                sample.append((key, unpack_slot(score, data)))
+        collision_rate = None
+        if sample:
+            collision_rate = number_of_collisions / len(sample)
+        return analyze_sample(sample, collision_rate,
+                              self._number_probes_by_depth,
+                              self._number_hits_by_depth)
+
+    def get_max_size(self):
+        """
+        Returns the number of slots of this SharedMemoryTable.
+
+        :return: the number of slots of this SharedMemoryTable
+        """
+        return self._max_size
+
+    def get_replacement_policy(self):
+        """
+        Returns the replacement policy of this SharedMemoryTable, which cannot
+        be changed.
+
+        :return: the replacement policy of this SharedMemoryTable
+        """
+        return SharedMemoryTable.\
+            replace_shallower_value_or_else_oldest_in_bucket
+
+    def get_name(self):
+        """
+        Returns the name of the shared memory block of this SharedMemoryTable,
+        by which other processes can attach to it.
+
+        :return: the name of the shared memory block
+        :rtype: string
+        """
+        return self._shared_memory.name
+
+    def close(self):
+        """
+        Detaches this process from the SharedMemoryTable.
+        """
+        self._buffer = None
+        self._shared_memory.close()
+
+    def unlink(self):
+        """
+        Destroys the shared memory block of this SharedMemoryTable, once every
+        process has closed it. Should be called once, by the process that
+        created the table.
+        """
+        self._shared_memory.unlink()
+
+    # ========== REPLACEMENT POLICY ========== #
+
+    def replace_shallower_value_or_else_oldest_in_bucket(self, key, value):
+        """
+        Conditionally adds the given key-value pair to this SharedMemoryTable.
+        If the bucket of the key already holds an entry for it, the new entry
+        replaces it iff it is at least as deep (otherwise, the new entry is
+        rejected). Else, the new entry goes to the first slot of the bucket if
+        that slot is empty or holds an entry that is not deeper, and otherwise
+        replaces the oldest entry in the other slots of the bucket.
+
+        :param key: the key of the new table entry, either a hash string or an
+            integer hash of a state
+        :param value: the value of the new table entry
+        """
+        self._number_attempted_mutations += 1
+        if isinstance(key, str):
+            key = hash_string_to_int(key)
+        offset, value_already_in_table = self._probe(key)
+        if value_already_in_table is not None:
+            if value[DEPTH_INDEX] < value_already_in_table[DEPTH_INDEX]:
+                self._number_entries_rejected += 1
+                return
+            self._number_entries_swapped += 1
+        else:
+            offset = slot_index(key, self._max_size // BUCKET_SIZE) * \
+                BUCKET_SIZE * SLOT_SIZE
+            check, _, data = struct.unpack_from(SLOT_FORMAT, self._buffer,
+                                                offset)
+            if (check or data) and value[DEPTH_INDEX] < data & 0xFF:
+                oldest = offset + SLOT_SIZE
+                offset = offset + (BUCKET_SIZE - 1) * SLOT_SIZE
+                check, _, data = struct.unpack_from(SLOT_FORMAT, self._buffer,
+                                                    oldest)
+                # The other slots are kept from oldest to newest.
+                self._buffer[oldest:offset] = \
+                    bytes(self._buffer[oldest + SLOT_SIZE:offset + SLOT_SIZE])
+            if check or data:
+                self._number_entries_replaced += 1
+            else:
+                self._number_directly_added += 1
+        struct.pack_into(SLOT_FORMAT, self._buffer, offset,
+                         *pack_slot(key, value))
+
+
+def _search_successor(args):
+    """
+    Searches the given state with alpha beta, using the global transposition
+    table of this process, and returns the result of the search and the
+    counters of the table.
+    """
+    import minimax
+    from evaluations import simple_eval
+    from state import create_expanded_state_representation
+
+    state, depth = args
+    expanded_state = create_expanded_state_representation(state)
+    result = minimax.alpha_beta(state, expanded_state, simple_eval, depth)
+    return result, minimax._table.get_counters()
+
+
+def _test(number_of_processes=4, depth=4):
+    """
+    Searches the successors of the initial game state in several processes
+    sharing one SharedMemoryTable, and prints the result of each search and
+    the counters of the process that ran it.
+    """
+    import minimax
+    from multiprocessing import Pool
+    from state import get_default_game_start, \
+        create_expanded_state_representation, successors
+
+    name = minimax.init_shared_table(2 ** 16)
+    state = get_default_game_start()
+    expanded_state = create_expanded_state_representation(state)
+    jobs = [(child, depth - 1) for child, _, _ in
+            successors(state, expanded_state)]
+    try:
+        with Pool(number_of_processes, minimax.attach_shared_table,
+                  (name,)) as pool:
+            for result, counters in pool.map(_search_successor, jobs):
+                print(result, counters)
+        print("entries in the shared table:", len(minimax._table))
+    finally:
+        minimax._table.close()
+        minimax._table.unlink()
+
+
+if __name__ == "__main__":
+    _test()
@@ -0,0 +1,305 @@
+from TranspositionTable import *
+from itertools import islice
+from threading import Lock
+
+"""
+A transposition table that several threads can read and write at once, even on
+a free-threaded (no-GIL) build of CPython.
+
+The keys are split by hash into stripes, and each stripe is a separate
+TranspositionTable guarded by its own lock, so that the replacement policy of a
+stripe always runs on its own, while threads working on different stripes do
+not wait for each other. The counters of each stripe are only updated under the
+lock of the stripe, and the counters of the whole table are the sums of those.
+"""
+
+DEFAULT_NUMBER_OF_STRIPES = 16
+
+
+class StripedLockTable:
+    """
+    A thread-safe transposition table made of lock-guarded TranspositionTable
+    stripes that share one replacement policy.
+    """
+
+    def __init__(self, max_size, replacement_policy, max_bytes=None,
+                 number_of_stripes=DEFAULT_NUMBER_OF_STRIPES):
+        """
+        Creates and initializes a new StripedLockTable.
+
+        :param max_size: the maximum number of entries in the table, split
+            evenly between the stripes
+        :type max_size: integral
+        :param replacement_policy: the replacement policy of every stripe (see
+            TranspositionTable.__init__())
+        :type replacement_policy: (TranspositionTable, X, Y) => None, where X
+            is the type of the keys in this table, and Y is the type of the
+            values
+        :param max_bytes: if not None, the memory budget of the table in bytes,
+            split evenly between the stripes; defaults to None
+        :type max_bytes: integral
+        :param number_of_stripes: the number of stripes; defaults to
+            DEFAULT_NUMBER_OF_STRIPES
+        :type number_of_stripes: int
+        """
+        stripe_size = max(1, -(-max_size // number_of_stripes))
+        stripe_bytes = None
+        if max_bytes is not None:
+            stripe_bytes = max_bytes // number_of_stripes
+        self._stripes = [TranspositionTable(stripe_size, replacement_policy,
+                                            stripe_bytes)
+                         for _ in range(number_of_stripes)]
+        self._locks = [Lock() for _ in range(number_of_stripes)]
+        self._replacement_policy = replacement_policy
+
+    def _stripe_index(self, key):
+        """
+        Returns the index of the stripe holding the given key.
+        """
+        return hash(key) % len(self._stripes)
+
+    def __setitem__(self, key, value):
+        """
+        Adds an entry to the stripe of the given key, using the replacement
+        policy while holding the lock of the stripe.
+
+        :param key: the key of the new table entry
+        :param value: the value of the new table entry
+        """
+        index = self._stripe_index(key)
+        with self._locks[index]:
+            self._stripes[index][key] = value
+
+    def __getitem__(self, key):
+        """
+        Returns the value of the entry with the given key.
+
+        :param key: the key of the entry
+        :return: the value of the entry
+        """
+        index = self._stripe_index(key)
+        with self._locks[index]:
+            return self._stripes[index][key]
+
+    def __iter__(self):
+        """
+        Returns an iterator over a snapshot of the keys of this
+        StripedLockTable, stripe by stripe.
+
+        :return: a key iterator for this StripedLockTable
+        :rtype: iterator
+        """
+        keys = []
+        for stripe, lock in zip(self._stripes, self._locks):
+            with lock:
+                keys.extend(stripe)
+        return iter(keys)
+
+    def __len__(self):
+        """
+        Returns the number of entries in this StripedLockTable.
+
+        :return: the number of entries in this StripedLockTable
+        :rtype: integral
+        """
+        return sum(len(stripe) for stripe in self._stripes)
+
+    def get(self, key, default=None, depth=None):
+        """
+        Returns the value of the entry with the given key, or the given default
+        value if this StripedLockTable does not contain an entry with the given
+        key.
+
+        :param key: the key of the entry
+        :param default: the default to return if there is no entry with the key
+        :param depth: the remaining depth of the search making the lookup (see
+            TranspositionTable.get()); defaults to None
+        :type depth: int
+        :return: the value of the entry with the given key, or the default
+        """
+        index = self._stripe_index(key)
+        with self._locks[index]:
+            return self._stripes[index].get(key, default, depth)
+
+    def reset_counters(self):
+        """
+        Resets the counters of every stripe to 0 (see
+        TranspositionTable.reset_counters()).
+        """
+        for stripe, lock in zip(self._stripes, self._locks):
+            with lock:
+                stripe.reset_counters()
+
+    def get_counters(self):
+        """
+        Returns a tuple containing the sum of each counter over all stripes,
+        in the same order as TranspositionTable.get_counters().
+        """
+        sums = [0] * 8
+        for stripe, lock in zip(self._stripes, self._locks):
+            with lock:
+                for i, counter in enumerate(stripe.get_counters()):
+                    sums[i] += counter
+        return tuple(sums)
+
+    def get_bytes_per_entry(self):
+        """
+        Returns the estimated number of bytes used per entry of the whole
+        StripedLockTable (see TranspositionTable.get_bytes_per_entry()).
+
+        :return: the estimated number of bytes used per entry
+        :rtype: float
+        """
+        footprint = 0
+        for stripe, lock in zip(self._stripes, self._locks):
+            with lock:
+                footprint += stripe.get_footprint()
+        size = len(self)
+        if size == 0:
+            return self._stripes[0].get_average_entry_bytes()
+        return footprint / size
+
+    def get_level_hits(self):
+        """
+        Returns a (<in-memory-hits>, <on-disk-hits>) pair counting the hits of
+        get() since the counters were last reset (see
+        TranspositionTable.get_level_hits()).
+
+        :return: the number of hits served by each level
+        :rtype: (int, int)
+        """
+        return self.get_counters()[7], 0
+
+    def analyze(self, sample_size=ANALYSIS_SAMPLE_SIZE):
+        """
+        Returns an analysis of this StripedLockTable (see
+        TranspositionTable.analyze()), sampling every stripe evenly.
+
+        :param sample_size: the (approximate) number of entries to look at;
+            defaults to ANALYSIS_SAMPLE_SIZE
+        :type sample_size: int
+        :return: the analysis of this StripedLockTable
+        :rtype: dict(string, object)
+        """
+        stripe_sample_size = max(1, sample_size // len(self._stripes))
+        sample = []
+        probes_by_depth = {}
+        hits_by_depth = {}
+        for stripe, lock in zip(self._stripes, self._locks):
+            with lock:
+                stride = max(1, len(stripe._table) // stripe_sample_size)
+                sample.extend(islice(stripe._table.items(), 0, None, stride))
+                for depth, probes in stripe._number_probes_by_depth.items():
+                    probes_by_depth[depth] = \
+                        probes_by_depth.get(depth, 0) + probes
+                for depth, hits in stripe._number_hits_by_depth.items():
+                    hits_by_depth[depth] = hits_by_depth.get(depth, 0) + hits
+        return analyze_sample(sample,
+                              expected_collision_rate(len(self),
+                                                      self.get_max_size()),
+                              probes_by_depth, hits_by_depth)
+
+    def get_max_size(self):
+        """
+        Returns the maximum size of this StripedLockTable, which is the sum of
+        the maximum sizes of its stripes.
+
+        :return: the maximum size of this StripedLockTable
+        """
+        return sum(stripe.get_max_size() for stripe in self._stripes)
+
+    def get_replacement_policy(self):
+        """
+        Returns the replacement policy of the stripes of this StripedLockTable.
+
+        :return: the replacement policy of this StripedLockTable
+        """
+        return self._replacement_policy
+
+    def get_stripes(self):
+        """
+        Returns the list of the stripes of this StripedLockTable. The stripes
+        are not thread-safe on their own.
+
+        :return: the stripes of this StripedLockTable
+        :rtype: list(TranspositionTable)
+        """
+        return self._stripes
+
+    def to_json_serializable(self):
+        """
+        Returns a JSON serializable representation of this StripedLockTable,
+        in the same format as TranspositionTable.to_json_serializable(), where
+        the entries of all stripes are merged and the counters are summed.
+
+        :return: a JSON serializable representation of this StripedLockTable
+        """
+        json_object = None
+        for stripe, lock in zip(self._stripes, self._locks):
+            with lock:
+                stripe_object = stripe.to_json_serializable()
+                if json_object is None:
+                    json_object = dict(stripe_object)
+                    json_object['table'] = dict(stripe_object['table'])
+                    continue
+                json_object['table'].update(stripe_object['table'])
+                for name, value in stripe_object.items():
+                    if name.startswith('number-') or \
+                            name in ('current-size', 'max-size'):
+                        json_object[name] += value
+        if json_object['max-bytes'] is not None:
+            json_object['max-bytes'] *= len(self._stripes)
+        return json_object
+
+
+def _stress_test(number_of_threads=8, operations_per_thread=20000,
+                 number_of_keys=5000, max_size=1000):
+    """
+    Hammers a StripedLockTable with random reads and writes from several
+    threads at once, using every replacement policy of TranspositionTable, and
+    checks that every value read belongs to the key it was read with, that no
+    stripe grows past its maximum size, and that no counter update was lost.
+    """
+    import random
+    from threading import Thread
+
+    def value_of(key, depth):
+        return depth, hash(key) % 1000, None, EXACT
+
+    def hammer(table, seed, failures):
+        rng = random.Random(seed)
+        for _ in range(operations_per_thread):
+            key = str(rng.randrange(number_of_keys))
+            if rng.random() < 0.5:
+                table[key] = value_of(key, rng.randrange(8))
+            else:
+                value = table.get(key)
+                if value is not None and \
+                        value != value_of(key, value[DEPTH_INDEX]):
+                    failures.append((key, value))
+
+    policies = [getattr(TranspositionTable, name)
+                for name in dir(TranspositionTable)
+                if name.startswith('replace_')]
+    for policy in policies:
+        table = StripedLockTable(max_size, policy)
+        failures = []
+        threads = [Thread(target=hammer, args=(table, seed, failures))
+                   for seed in range(number_of_threads)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        counters = table.get_counters()
+        total = number_of_threads * operations_per_thread
+        assert not failures, failures[:10]
+        assert all(len(stripe._table) <= stripe.get_max_size()
+                   for stripe in table.get_stripes())
+        assert counters[0] + counters[6] == total, (counters, total)
+        assert counters[0] == \
+            counters[1] + counters[2] + counters[4] + counters[5], counters
+        print(policy.__name__, "OK:", len(table), "entries", counters)
+
+
+if __name__ == "__main__":
+    _stress_test()
@@ -0,0 +1,228 @@
+from position_ranking import *
+import mmap
+import os
+import struct
+
+"""
+Endgame tablebases: the solved result of every position of a material
+signature, the pair (<number-of-live-guards>, <number-of-live-dragons>), as
+computed by retrograde analysis in generate_tablebases.py.
+
+A position is identified by its index among the positions with its material
+(see rank_position()), and each tablebase file holds one result per index.
+The file starts with a header of the form:
+    <magic> <version> <number-of-guards> <number-of-dragons>
+    <number-of-positions>
+followed by <number-of-positions> WDL bytes, the result of each position for
+the king player (one of WDL_DRAGON_WIN, WDL_DRAW, or WDL_KING_WIN), and then
+by <number-of-positions> distance bytes, the number of plies to the end of
+the game when the winner plays the shortest win and the loser the longest
+loss (0 for draws). A draw is either a position that ends in a draw, or one
+from which neither player can force a win.
+
+Since the files are memory-mapped, a probe only reads the two bytes of the
+position, and opening a tablebase only reads its header.
+"""
+
+MAGIC = b'MKTB'
+VERSION = 2
+HEADER_FORMAT = '<4sHBBQ'
+HEADER_SIZE = struct.calcsize(HEADER_FORMAT)
+
+WDL_DRAGON_WIN = 0
+WDL_DRAW = 1
+WDL_KING_WIN = 2
+MAX_DISTANCE = 0xFF
+
+
+def tablebase_filename(directory, number_of_guards, number_of_dragons):
+    """
+    Returns the name of the file of the tablebase of the given material in
+    the given directory.
+
+    :param directory: the directory of the tablebases
+    :type directory: string
+    :param number_of_guards: the number of live guards
+    :type number_of_guards: int
+    :param number_of_dragons: the number of live dragons
+    :type number_of_dragons: int
+    :return: the name of the tablebase file
+    :rtype: string
+    """
+    return os.path.join(directory, "g{0}d{1}.mktb".format(number_of_guards,
+                                                          number_of_dragons))
+
+
+def write_tablebase(filename, number_of_guards, number_of_dragons, wdl,
+                    distances):
+    """
+    Writes a tablebase file with the given material, WDL bytes, and distance
+    bytes.
+
+    :param filename: the name of the file to create (or overwrite)
+    :type filename: string
+    :param number_of_guards: the number of live guards
+    :type number_of_guards: int
+    :param number_of_dragons: the number of live dragons
+    :type number_of_dragons: int
+    :param wdl: the result of each position
+    :type wdl: bytes-like
+    :param distances: the distance of each position
+    :type distances: bytes-like
+    """
+    with open(filename, 'wb') as outfile:
+        outfile.write(struct.pack(HEADER_FORMAT, MAGIC, VERSION,
+                                  number_of_guards, number_of_dragons,
+                                  len(wdl)))
+        outfile.write(wdl)
+        outfile.write(distances)
+
+
+def wdl_to_utility(wdl, distance):
+    """
+    Returns the utility of a position with the given result and distance:
+    KING_WIN or DRAGON_WIN, less the distance to the win, or DRAW.
+
+    :param wdl: one of WDL_DRAGON_WIN, WDL_DRAW, or WDL_KING_WIN
+    :type wdl: int
+    :param distance: the number of plies to the end of the game
+    :type distance: int
+    :return: the utility of the position
+    :rtype: int
+    """
+    if wdl == WDL_KING_WIN:
+        return KING_WIN - distance
+    if wdl == WDL_DRAGON_WIN:
+        return DRAGON_WIN + distance
+    return DRAW
+
+
+class Tablebase:
+    """
+    The memory-mapped tablebase of one material signature.
+    """
+
+    def __init__(self, filename):
+        """
+        Opens the tablebase saved in the file with the given name.
+
+        :param filename: the name of the tablebase file
+        :type filename: string
+        """
+        self._file = open(filename, 'rb')
+        self._map = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, version, number_of_guards, number_of_dragons, \
+            self._number_of_positions = \
+            struct.unpack_from(HEADER_FORMAT, self._map, 0)
+        if magic != MAGIC or version != VERSION:
+            self.close()
+            raise ValueError("not a tablebase: " + filename)
+        self._material = number_of_guards, number_of_dragons
+        self._distance_offset = HEADER_SIZE + self._number_of_positions
+
+    def get_material(self):
+        """
+        Returns the (<number-of-guards>, <number-of-dragons>) material
+        signature of this Tablebase.
+
+        :return: the material signature of this Tablebase
+        :rtype: (int, int)
+        """
+        return self._material
+
+    def __len__(self):
+        """
+        Returns the number of positions in this Tablebase.
+
+        :return: the number of positions in this Tablebase
+        :rtype: int
+        """
+        return self._number_of_positions
+
+    def probe_index(self, index):
+        """
+        Returns the (<wdl>, <distance>) pair of the position with the given
+        index.
+
+        :param index: the index of the position
+        :type index: int
+        :return: the result and distance of the position
+        :rtype: (int, int)
+        """
+        return self._map[HEADER_SIZE + index], \
+            self._map[self._distance_offset + index]
+
+    def close(self):
+        """
+        Closes the file of this Tablebase.
+        """
+        self._map.close()
+        self._file.close()
+
+
+def open_tablebases(directory):
+    """
+    Returns the tablebases in the given directory, by material signature.
+
+    :param directory: the directory of the tablebases
+    :type directory: string
+    :return: the tablebases, by material signature
+    :rtype: dict((int, int), Tablebase)
+    """
+    tablebases = {}
+    for filename in sorted(os.listdir(directory)):
+        if filename.endswith('.mktb'):
+            tablebase = Tablebase(os.path.join(directory, filename))
+            tablebases[tablebase.get_material()] = tablebase
+    return tablebases
+
+
+def probe_tablebases(tablebases, state):
+    """
+    Returns the utility of the given state according to the given
+    tablebases (see wdl_to_utility()), or None if there is no tablebase for
+    its material.
+
+    :param tablebases: the tablebases, by material signature
+    :type tablebases: dict((int, int), Tablebase)
+    :param state: a compact state representation
+    :type state: array of bytes
+    :return: the utility of the state, or None
+    :rtype: int
+    """
+    material, index = rank_position(state)
+    tablebase = tablebases.get(material)
+    if tablebase is None:
+        return None
+    return wdl_to_utility(*tablebase.probe_index(index))
+
+
+def get_tablebase_move(tablebases, state, expanded_state):
+    """
+    Returns the best move of the given non-terminal state according to the
+    given tablebases: the one leading to the successor with the best utility
+    for the player to move, the shortest win or the longest loss. Returns
+    the first move if a successor has no tablebase.
+
+    :param tablebases: the tablebases, by material signature
+    :type tablebases: dict((int, int), Tablebase)
+    :param state: a compact state representation
+    :type state: array of bytes
+    :param expanded_state: the expanded representation of the state
+    :type expanded_state: dict(byte, char)
+    :return: the best move
+    :rtype: (byte, byte)
+    """
+    sign = 1 if player_turn(state) == KING_PLAYER else -1
+    best_move = best_utility = None
+    for new_state, new_expanded_state, move in successors(state,
+                                                          expanded_state):
+        is_term, utility = is_terminal(new_state, new_expanded_state)
+        if not is_term:
+            utility = probe_tablebases(tablebases, new_state)
+            if utility is None:
+                return all_valid_moves(state, expanded_state)[0]
+        if best_utility is None or sign * utility > sign * best_utility:
+            best_utility = utility
+            best_move = move
+    return best_move
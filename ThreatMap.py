@@ -0,0 +1,355 @@
+from state import *
+from threading import local
+
+"""
+The threats of a position, computed once and shared by the leaf test and the
+quiescence search of minimax.py and by the evaluation functions.
+
+The threats are computed from tile masks: ints with bit i set for each tile
+index i in a set of tiles. The masks of the tiles occupied by each player
+(see get_occupancy_masks()) are shifted onto their neighbours (see
+get_neighbour_count_masks()) and counted with popcount().
+"""
+ALL_TILES_MASK = (1 << BOARD_NUM_RANKS * BOARD_NUM_FILES) - 1
+TOP_RANK_MASK = sum(1 << tile_idx for tile_idx in
+                    range(BOARD_NUM_RANKS - 1,
+                          BOARD_NUM_RANKS * BOARD_NUM_FILES, BOARD_NUM_RANKS))
+BOTTOM_RANK_MASK = TOP_RANK_MASK >> (BOARD_NUM_RANKS - 1)
+ORTHOGONAL_TILES_AROUND = [tuple(get_orthogonal_tiles_around(tile_idx))
+                           for tile_idx in
+                           range(BOARD_NUM_RANKS * BOARD_NUM_FILES)]
+ORTHOGONAL_MASKS = [sum(1 << neighbour for neighbour in
+                        get_orthogonal_tiles_around(tile_idx))
+                    for tile_idx in range(BOARD_NUM_RANKS * BOARD_NUM_FILES)]
+SECOND_TILES_MASKS = [ORTHOGONAL_MASKS[tile_idx] |
+                      sum(1 << neighbour for neighbour in
+                          get_diagonal_tiles_around(tile_idx))
+                      for tile_idx in range(BOARD_NUM_RANKS * BOARD_NUM_FILES)]
+
+
+def popcount(mask):
+    """
+    Returns the number of tiles in the given tile mask.
+
+    :param mask: a tile mask
+    :type mask: int
+    :return: the number of bits set in the mask
+    :rtype: int
+    """
+    return bin(mask).count('1')
+
+
+def get_occupancy_masks(state):
+    """
+    Returns a (<king-player-mask>, <guards-mask>, <dragons-mask>) tuple of the
+    tile masks of the tiles holding the king or a guard, a guard, and a
+    dragon in the given state.
+
+    :param state: a compact state representation
+    :type state: array of bytes
+    :return: the occupancy masks of the given state
+    :rtype: (int, int, int)
+    """
+    guards = dragons = 0
+    for i in range(1, STATE_SIZE):
+        num = state[i]
+        if num >= DRAGON_BASE:
+            dragons |= 1 << (num - DRAGON_BASE)
+        elif num != DEAD:
+            guards |= 1 << num
+    return guards | 1 << get_king_tile_index(state), guards, dragons
+
+
+def get_neighbour_count_masks(mask):
+    """
+    Returns a (<at-least-two>, <at-least-three>) pair of the masks of the
+    tiles having at least two, and at least three, orthogonal neighbours in
+    the given tile mask.
+
+    :param mask: a tile mask
+    :type mask: int
+    :return: the masks of the tiles with at least 2 and 3 neighbours in mask
+    :rtype: (int, int)
+    """
+    right = mask >> BOARD_NUM_RANKS
+    left = (mask << BOARD_NUM_RANKS) & ALL_TILES_MASK
+    above = (mask >> 1) & ~TOP_RANK_MASK
+    below = (mask << 1) & ~BOTTOM_RANK_MASK & ALL_TILES_MASK
+    both_files = right & left
+    either_file = right | left
+    both_ranks = above & below
+    either_rank = above | below
+    return (both_files | both_ranks | either_file & either_rank,
+            both_files & either_rank | both_ranks & either_file)
+
+
+def count_guards_threatened(guards, dragons, empty, two_dragons,
+                             three_dragons):
+    """
+    Returns the number of threatened guards, given the masks of the guards,
+    the dragons, the empty tiles, and the tiles with at least two and three
+    dragon neighbours. A guard is threatened if it has at least 3 dragon
+    neighbours, or exactly 2, and a third dragon is a (orthogonal or diagonal)
+    neighbour of one of its empty neighbours, or of one of its neighbours
+    holding the king or a guard that comes after the second dragon in the
+    order of get_orthogonal_tiles_around(), as counted by
+    is_guard_threatened() in state.py.
+
+    :param guards: the mask of the tiles holding a guard
+    :type guards: int
+    :param dragons: the mask of the tiles holding a dragon
+    :type dragons: int
+    :param empty: the mask of the empty tiles
+    :type empty: int
+    :param two_dragons: the mask of the tiles with at least 2 dragon
+        neighbours
+    :type two_dragons: int
+    :param three_dragons: the mask of the tiles with at least 3 dragon
+        neighbours
+    :type three_dragons: int
+    :return: the number of threatened guards
+    :rtype: int
+    """
+    count = popcount(guards & three_dragons)
+    guards &= two_dragons & ~three_dragons
+    while guards:
+        lowest_bit = guards & -guards
+        guards ^= lowest_bit
+        guard_idx = lowest_bit.bit_length() - 1
+        seen_dragons = 0
+        second_tiles = 0
+        for neighbour in ORTHOGONAL_TILES_AROUND[guard_idx]:
+            bit = 1 << neighbour
+            if dragons & bit:
+                seen_dragons += 1
+            elif empty & bit or seen_dragons == 2:
+                second_tiles |= SECOND_TILES_MASKS[neighbour]
+        if second_tiles & dragons & ~ORTHOGONAL_MASKS[guard_idx]:
+            count += 1
+    return count
+
+
+def _chebyshev_distance(tile_idx, other_tile_idx):
+    """
+    Returns the number of king moves (orthogonal or diagonal) between the
+    given tiles, which is the least number of moves a dragon needs to go from
+    one to the other.
+    """
+    return max(abs(tile_idx // BOARD_NUM_RANKS -
+                   other_tile_idx // BOARD_NUM_RANKS),
+               abs(tile_idx % BOARD_NUM_RANKS -
+                   other_tile_idx % BOARD_NUM_RANKS))
+
+
+def _get_race_masks(king_tile_idx, dragon_moves_first):
+    """
+    Returns the (<path-mask>, <dragons-mask>, <guards-mask>) masks of the race
+    of a king on the given tile straight down to the first rank: the tiles of
+    its path, and the tiles from which a dragon, or a guard once converted to
+    a dragon, could reach a tile of the path before the king does.
+    """
+    path = dragons = guards = 0
+    for step in range(1, king_tile_idx % BOARD_NUM_RANKS + 1):
+        path_tile_idx = king_tile_idx - step
+        path |= 1 << path_tile_idx
+        # The dragon player moves before the king's step-th move, step - 1
+        # times, or step times if he moves first. A guard is converted on a
+        # dragon move at the earliest, so it moves at least once less.
+        dragon_moves = step if dragon_moves_first else step - 1
+        for tile_idx in range(BOARD_NUM_RANKS * BOARD_NUM_FILES):
+            distance = _chebyshev_distance(tile_idx, path_tile_idx)
+            if distance <= dragon_moves:
+                dragons |= 1 << tile_idx
+            if distance <= dragon_moves - 1:
+                guards |= 1 << tile_idx
+    return path, dragons, guards
+
+
+"""
+The masks of _get_race_masks() for each tile of the king, when the king
+player moves first and when the dragon player moves first.
+"""
+KING_RACE_MASKS = [_get_race_masks(tile_idx, False)
+                   for tile_idx in range(BOARD_NUM_RANKS * BOARD_NUM_FILES)]
+DRAGON_RACE_MASKS = [_get_race_masks(tile_idx, True)
+                     for tile_idx in range(BOARD_NUM_RANKS * BOARD_NUM_FILES)]
+
+
+def get_unstoppable_king_moves(state):
+    """
+    Returns the number of moves in which the king surely wins by running
+    straight down to the first rank, or None if the race cannot be proven
+    from the distances alone. *** Assumes the state is not terminal. ***
+
+    The race is proven if every tile of the path of the king is empty, and
+    no dragon, nor any guard that could be converted to a dragon, is close
+    enough to a tile of the path to reach it before the king does. Then the
+    king is never captured, since the tile below him stays empty, and the
+    game is not a draw, as long as the dragon player can move at all: the
+    dragon that moved last can always move back. This is checked for the
+    first dragon move when the king player moves first, and is true of the
+    first move otherwise, since the state is not terminal.
+
+    :param state: a compact state representation
+    :type state: array of bytes
+    :return: the number of moves of the king to the first rank, or None
+    :rtype: int
+    """
+    king_units, guards, dragons = get_occupancy_masks(state)
+    king_tile_idx = get_king_tile_index(state)
+    king_moves_first = player_turn(state) == KING_PLAYER
+    if king_moves_first:
+        path, dragon_reach, guard_reach = KING_RACE_MASKS[king_tile_idx]
+    else:
+        path, dragon_reach, guard_reach = DRAGON_RACE_MASKS[king_tile_idx]
+    if path & (king_units | dragons) or dragons & dragon_reach or \
+            guards & guard_reach:
+        return None
+    number_of_moves = king_tile_idx % BOARD_NUM_RANKS
+    if king_moves_first and number_of_moves > 1:
+        # After the first king move, some dragon must still be able to move.
+        empty = (ALL_TILES_MASK & ~(king_units | dragons) &
+                 ~(1 << king_tile_idx - 1)) | 1 << king_tile_idx
+        while dragons:
+            lowest_bit = dragons & -dragons
+            dragons ^= lowest_bit
+            if SECOND_TILES_MASKS[lowest_bit.bit_length() - 1] & empty:
+                break
+        else:
+            return None
+    return number_of_moves
+
+
+class ThreatMap:
+    """
+    The occupancy masks and threats of one position: which pieces are
+    threatened with capture, and whether the king can win on his next turn.
+    """
+
+    def __init__(self, state, expanded_state):
+        """
+        Creates the ThreatMap of the given position.
+
+        :param state: a compact state representation
+        :type state: array of bytes
+        :param expanded_state: the expanded representation of the state
+        :type expanded_state: dict(byte, char)
+        """
+        king_units, guards, dragons = get_occupancy_masks(state)
+        empty = ALL_TILES_MASK & ~(king_units | dragons)
+        two_king_units = get_neighbour_count_masks(king_units)[0]
+        two_dragons, three_dragons = get_neighbour_count_masks(dragons)
+        self._occupancy_masks = king_units, guards, dragons, empty
+        self._neighbour_count_masks = two_king_units, two_dragons, \
+            three_dragons
+        self._dragons_threatened = popcount(dragons & two_king_units)
+        self._guards_threatened = count_guards_threatened(
+            guards, dragons, empty, two_dragons, three_dragons)
+        self._is_king_surrounded = \
+            three_dragons >> get_king_tile_index(state) & 1 == 1
+        self._can_king_win = bool(can_king_win(state, expanded_state))
+
+    def get_occupancy_masks(self):
+        """
+        Returns the (<king-player-mask>, <guards-mask>, <dragons-mask>,
+        <empty-mask>) masks of the position (see get_occupancy_masks()).
+
+        :return: the occupancy masks of the position
+        :rtype: (int, int, int, int)
+        """
+        return self._occupancy_masks
+
+    def get_neighbour_count_masks(self):
+        """
+        Returns the masks of the tiles with at least 2 neighbours holding the
+        king or a guard, with at least 2 dragon neighbours, and with at least 3
+        dragon neighbours (see get_neighbour_count_masks()).
+
+        :return: the neighbour count masks of the position
+        :rtype: (int, int, int)
+        """
+        return self._neighbour_count_masks
+
+    def get_dragons_threatened(self):
+        """
+        Returns the number of dragons with at least 2 neighbours holding the
+        king or a guard.
+
+        :return: the number of threatened dragons
+        :rtype: int
+        """
+        return self._dragons_threatened
+
+    def get_guards_threatened(self):
+        """
+        Returns the number of threatened guards (see
+        count_guards_threatened()).
+
+        :return: the number of threatened guards
+        :rtype: int
+        """
+        return self._guards_threatened
+
+    def is_piece_threatened(self):
+        """
+        Returns True iff any piece is threatened: a guard, a dragon, or the
+        king surrounded by at least 3 dragons. Same as is_piece_threatened()
+        in state.py.
+
+        :return: True iff any piece is threatened
+        :rtype: bool
+        """
+        return self._guards_threatened > 0 or self._dragons_threatened > 0 \
+            or self._is_king_surrounded
+
+    def can_king_win(self):
+        """
+        Returns True iff the king is in a position to win on his next turn.
+        Same as can_king_win() in state.py.
+
+        :return: True iff the king can win on his next turn
+        :rtype: bool
+        """
+        return self._can_king_win
+
+    def is_quiet(self):
+        """
+        Returns True iff no piece is threatened and the king cannot win on his
+        next turn, i.e. iff the position can be evaluated without a quiescence
+        search.
+
+        :return: True iff the position is quiet
+        :rtype: bool
+        """
+        return not (self.is_piece_threatened() or self._can_king_win)
+
+
+"""
+The last position given to get_threat_map() by each thread, and its
+ThreatMap, as a (<position>, <threat-map>) pair in the attribute 'last'. The
+cache is per thread, so that the searches run in threads (see
+StripedLockTable.py) never read the ThreatMap of another thread's position.
+"""
+_cache = local()
+
+
+def get_threat_map(state, expanded_state):
+    """
+    Returns the ThreatMap of the given position, reusing the one computed by
+    the previous call of the same thread if it was for the same position, so
+    that the leaf test of a search and the evaluation of the same leaf share
+    it.
+
+    :param state: a compact state representation
+    :type state: array of bytes
+    :param expanded_state: the expanded representation of the state
+    :type expanded_state: dict(byte, char)
+    :return: the ThreatMap of the given position
+    :rtype: ThreatMap
+    """
+    position = state.tobytes()
+    last = getattr(_cache, 'last', None)
+    if last is None or last[0] != position:
+        last = position, ThreatMap(state, expanded_state)
+        _cache.last = last
+    return last[1]
@@ -1,4 +1,8 @@
 from collections import OrderedDict
+from itertools import islice
+from state import hash_string_to_int
+import struct
+import sys
 
 """
 Each table entry corresponds to one state of the game (in this context, a
@@ -29,6 +33,40 @@ EXACT = 0b00000000
 ALPHA_CUTOFF = 0b00000001
 BETA_CUTOFF = 0b00000010
 
+# The size in bytes of one entry is re-estimated every this many mutations.
+FOOTPRINT_SAMPLE_INTERVAL = 1024
+
+"""
+An access trace is a sequence of fixed-size binary records of the form:
+    <operation> <key> <depth> <exact-alpha-or-beta>
+where <operation> is TRACE_GET for a call to get() and TRACE_SET for an attempt
+to add an entry, and <key> is the integer hash of the state (see
+state.hash_state_int()). For TRACE_SET, <depth> and <exact-alpha-or-beta> are
+those of the new entry. For TRACE_GET, <depth> is the remaining depth of the
+search that made the lookup (or TRACE_NO_DEPTH if it was not given), and
+<exact-alpha-or-beta> is TRACE_NO_FLAGS.
+"""
+TRACE_RECORD_FORMAT = '<BQBB'
+TRACE_RECORD_SIZE = struct.calcsize(TRACE_RECORD_FORMAT)
+TRACE_GET = 0
+TRACE_SET = 1
+TRACE_NO_DEPTH = 0xFF
+TRACE_NO_FLAGS = 0xFF
+
+# The fraction of the maximum size of the table that the first-in first-out
+# queue of replace_two_queue() may hold, and the fraction it remembers the keys
+# of after evicting them.
+TWO_QUEUE_IN_FRACTION = 0.25
+TWO_QUEUE_OUT_FRACTION = 0.5
+
+# For replace_depth_weighted_least_recently_used(), an entry that is one ply
+# deeper than another is kept as if it had been used this fraction of the
+# maximum size of the table accesses more recently.
+LRU_DEPTH_WEIGHT = 0.25
+
+# The number of entries that analyze() looks at by default.
+ANALYSIS_SAMPLE_SIZE = 1024
+
 
 class TranspositionTable:
     """
@@ -38,11 +76,13 @@ class TranspositionTable:
     that was inserted most recently.
     """
 
-    def __init__(self, max_size, replacement_policy):
+    def __init__(self, max_size, replacement_policy, max_bytes=None):
         """
         Creates and initializes a new TranspositionTable.
 
-        :param max_size: the maximum number of entries in the table
+        :param max_size: the maximum number of entries in the table; if
+            'max_bytes' is given, this is only used until the size of the first
+            entry has been sampled
         :type max_size: integral
         :param replacement_policy: a function that takes a TranspositionTable,
             a key, and a value, and adds the key-value pair to the table if it
@@ -53,9 +93,17 @@ class TranspositionTable:
         :type replacement_policy: (TranspositionTable, X, Y) => None, where X
             is the type of the keys in this table, and Y is the type of the
             values
+        :param max_bytes: if not None, the memory budget of the table in bytes,
+            from which the maximum number of entries is derived (and updated)
+            each time the size of an entry is sampled; defaults to None
+        :type max_bytes: integral
         """
         self._table = OrderedDict()
         self._max_size = max_size
+        self._max_bytes = max_bytes
+        self._sampled_entry_bytes = 0
+        self._number_sampled_entries = 0
+        self._mutations_until_sample = 1
         self._current_size = 0
         self._number_attempted_mutations = 0
         self._number_entries_replaced = 0
@@ -65,7 +113,10 @@ class TranspositionTable:
         self._number_directly_added = 0
         self._number_safe_accesses = 0
         self._number_hits = 0
-        self._replacement_policy = replacement_policy
+        self._number_probes_by_depth = {}
+        self._number_hits_by_depth = {}
+        self._trace = None
+        self._set_replacement_policy(replacement_policy)
 
     def __setitem__(self, key, value):
         """
@@ -78,7 +129,13 @@ class TranspositionTable:
         :param key: the key of the new table entry
         :param value: the value of the new table entry
         """
+        if self._trace is not None:
+            self._record(TRACE_SET, key, value[DEPTH_INDEX],
+                         value[FLAGS_INDEX])
         self._replacement_policy(self, key, value)
+        self._mutations_until_sample -= 1
+        if self._mutations_until_sample == 0:
+            self._sample_entry(key, value)
 
     def __getitem__(self, key):
         """
@@ -108,7 +165,7 @@ class TranspositionTable:
         """
         return self._current_size
 
-    def get(self, key, default=None):
+    def get(self, key, default=None, depth=None):
         """
         Returns the value of the entry with the given key, or the given default
         value if this TranspositionTable does not contain an entry with the
@@ -116,14 +173,162 @@ class TranspositionTable:
 
         :param key: the key of the entry
         :param default: the default to return if there is no entry with the key
+        :param depth: the remaining depth of the search making the lookup,
+            which is only used to count hits by depth (see analyze()) and to
+            record it in the access trace; defaults to None
+        :type depth: int
         :return: the value of the entry with the given key, or the default
         """
         self._number_safe_accesses += 1
+        if self._trace is not None:
+            self._record(TRACE_GET, key, depth, TRACE_NO_FLAGS)
         value = self._table.get(key, default)
+        self._count_probe(depth, value is not default)
         if value is not default:
             self._number_hits += 1
+            if self._on_hit is not None:
+                self._on_hit(self, key)
         return value
 
+    def _count_probe(self, depth, hit):
+        """
+        Counts a lookup by a search with the given remaining depth, if known,
+        and whether it was a hit.
+        """
+        if depth is not None:
+            probes = self._number_probes_by_depth
+            probes[depth] = probes.get(depth, 0) + 1
+            if hit:
+                hits = self._number_hits_by_depth
+                hits[depth] = hits.get(depth, 0) + 1
+
+    def _sample_entry(self, key, value):
+        """
+        Adds the size in bytes of the given key-value pair (the key string, the
+        value tuple, and the score and move it contains) to the running
+        estimate of the average size of an entry. If this TranspositionTable
+        has a memory budget, the maximum number of entries is then re-derived
+        from it, and the oldest entries are removed if the table is now over
+        budget.
+
+        :param key: the key of a table entry
+        :param value: the value of a table entry
+        """
+        self._mutations_until_sample = FOOTPRINT_SAMPLE_INTERVAL
+        entry_bytes = sys.getsizeof(key) + sys.getsizeof(value) + \
+            sys.getsizeof(value[SCORE_INDEX])
+        if value[MOVE_INDEX] is not None:
+            entry_bytes += sys.getsizeof(value[MOVE_INDEX])
+        self._sampled_entry_bytes += entry_bytes
+        self._number_sampled_entries += 1
+        if self._max_bytes is not None:
+            # The container itself does not shrink when entries are removed, so
+            # only the entries have to fit in what it leaves of the budget.
+            free_bytes = self._max_bytes - sys.getsizeof(self._table)
+            self._max_size = \
+                max(1, int(free_bytes // self.get_average_entry_bytes()))
+            while self._current_size > self._max_size:
+                self._discard(*self._evict(self))
+                self._current_size -= 1
+
+    def start_trace(self, filename):
+        """
+        Starts recording the access trace of this TranspositionTable to the
+        file with the given name (see TRACE_RECORD_FORMAT), overwriting it.
+        The keys must be hash strings or integer hashes of states.
+
+        :param filename: the name of the file to which to record the trace
+        :type filename: string
+        """
+        self.stop_trace()
+        self._trace = open(filename, 'wb')
+
+    def stop_trace(self):
+        """
+        Stops recording the access trace of this TranspositionTable, if it was
+        being recorded, and closes the trace file.
+        """
+        if self._trace is not None:
+            self._trace.close()
+            self._trace = None
+
+    def _record(self, operation, key, depth, flags):
+        """
+        Appends a record for the given operation to the access trace.
+        """
+        if isinstance(key, str):
+            key = hash_string_to_int(key)
+        if depth is None:
+            depth = TRACE_NO_DEPTH
+        self._trace.write(struct.pack(TRACE_RECORD_FORMAT, operation, key,
+                                      depth, flags))
+
+    def _set_replacement_policy(self, replacement_policy):
+        """
+        Sets the replacement policy of this TranspositionTable, along with the
+        functions that the policy needs to be told about hits and to evict an
+        entry (see POLICY_HOOKS), and builds the bookkeeping of the policy for
+        the entries already in the table.
+
+        :param replacement_policy: the new replacement policy
+        :type replacement_policy: (TranspositionTable, X, Y) => None
+        """
+        self._replacement_policy = replacement_policy
+        setup, self._on_hit, self._evict = POLICY_HOOKS.get(
+            replacement_policy, (None, None, TranspositionTable._evict_first))
+        if setup is not None:
+            setup(self)
+
+    def _discard(self, key, value):
+        """
+        Called with every entry that leaves this TranspositionTable because the
+        replacement policy or the memory budget evicted it, and with every new
+        entry rejected because the table was full. Does nothing, but subclasses
+        can override it to keep such entries elsewhere.
+
+        :param key: the key of the discarded entry
+        :param value: the value of the discarded entry
+        """
+        pass
+
+    def get_average_entry_bytes(self):
+        """
+        Returns the sampled average size in bytes of the objects making up one
+        entry of this TranspositionTable, not counting the container itself, or
+        0 if no entry has been sampled yet.
+
+        :return: the sampled average size in bytes of one entry
+        :rtype: float
+        """
+        if self._number_sampled_entries == 0:
+            return 0
+        return self._sampled_entry_bytes / self._number_sampled_entries
+
+    def get_footprint(self):
+        """
+        Returns an estimate of the memory used by this TranspositionTable in
+        bytes: the exact size of the container plus the sampled average size
+        of an entry times the number of entries.
+
+        :return: an estimate of the memory used by this TranspositionTable
+        :rtype: float
+        """
+        return sys.getsizeof(self._table) + \
+            self._current_size * self.get_average_entry_bytes()
+
+    def get_bytes_per_entry(self):
+        """
+        Returns the estimated number of bytes used per entry of this
+        TranspositionTable, container included, or the sampled average size of
+        an entry if the table is empty.
+
+        :return: the estimated number of bytes used per entry
+        :rtype: float
+        """
+        if self._current_size == 0:
+            return self.get_average_entry_bytes()
+        return self.get_footprint() / self._current_size
+
     def reset_counters(self):
         """
         Resets the following counters to 0, without also clearing the table:
@@ -135,6 +340,7 @@ class TranspositionTable:
             number_directly_added
             number_safe_accesses
             number_hits
+        as well as the number of lookups and hits by depth (see analyze()).
         """
         self._number_attempted_mutations = 0
         self._number_entries_replaced = 0
@@ -144,6 +350,8 @@ class TranspositionTable:
         self._number_directly_added = 0
         self._number_safe_accesses = 0
         self._number_hits = 0
+        self._number_probes_by_depth = {}
+        self._number_hits_by_depth = {}
 
     def get_counters(self):
         """
@@ -164,6 +372,40 @@ class TranspositionTable:
                 self._number_directly_added, self._number_safe_accesses,
                 self._number_hits)
 
+    def get_level_hits(self):
+        """
+        Returns a (<in-memory-hits>, <on-disk-hits>) pair counting the hits of
+        get() served by each level of this TranspositionTable since the
+        counters were last reset. A TranspositionTable only has an in-memory
+        level.
+
+        :return: the number of hits served by each level
+        :rtype: (int, int)
+        """
+        return self._number_hits, 0
+
+    def analyze(self, sample_size=ANALYSIS_SAMPLE_SIZE):
+        """
+        Returns an analysis of this TranspositionTable (see analyze_sample()),
+        based on the lookups by depth since the counters were last reset and on
+        a sample of evenly spaced entries. Taking the sample walks the whole
+        table. The collision rate is the one expected of a table of the same
+        size and maximum size (see expected_collision_rate()).
+
+        :param sample_size: the (approximate) number of entries to look at;
+            defaults to ANALYSIS_SAMPLE_SIZE
+        :type sample_size: int
+        :return: the analysis of this TranspositionTable
+        :rtype: dict(string, object)
+        """
+        stride = max(1, len(self._table) // sample_size)
+        sample = list(islice(self._table.items(), 0, None, stride))
+        return analyze_sample(sample,
+                              expected_collision_rate(len(self._table),
+                                                      self._max_size),
+                              self._number_probes_by_depth,
+                              self._number_hits_by_depth)
+
     def get_max_size(self):
         """
         Returns the maximum size of this TranspositionTable.
@@ -172,6 +414,15 @@ class TranspositionTable:
         """
         return self._max_size
 
+    def get_max_bytes(self):
+        """
+        Returns the memory budget of this TranspositionTable in bytes, or None
+        if its size is given in number of entries.
+
+        :return: the memory budget of this TranspositionTable, or None
+        """
+        return self._max_bytes
+
     def get_replacement_policy(self):
         """
         Returns the replacement policy of this TranspositionTable.
@@ -189,6 +440,7 @@ class TranspositionTable:
         return {
             'table': self._table,
             'max-size': self._max_size,
+            'max-bytes': self._max_bytes,
             'current-size': self._current_size,
             'number-attempted-mutations': self._number_attempted_mutations,
             'number-entries-replaced': self._number_entries_replaced,
@@ -213,7 +465,8 @@ class TranspositionTable:
         :return: the corresponding TranspositionTable
         :rtype: TranspositionTable
         """
-        table = TranspositionTable(json_object['max-size'], None)
+        table = TranspositionTable(json_object['max-size'], None,
+                                   json_object.get('max-bytes'))
         table._table = OrderedDict(json_object['table'].items())
         table._current_size = json_object['current-size']
         table._number_attempted_mutations = \
@@ -225,8 +478,8 @@ class TranspositionTable:
         table._number_directly_added = json_object['number-directly-added']
         table._number_safe_accesses = json_object['number-safe-accesses']
         table._number_hits = json_object['number-hits']
-        table._replacement_policy = getattr(table,
-                                            json_object['replacement-policy'])
+        table._set_replacement_policy(
+            getattr(TranspositionTable, json_object['replacement-policy']))
         return table
 
     # ========== REPLACEMENT POLICIES ========== #
@@ -243,7 +496,7 @@ class TranspositionTable:
         self._number_attempted_mutations += 1
         if self._current_size == self._max_size:
             self._number_entries_replaced += 1
-            del self._table[next(self._table.keys().__iter__())]
+            self._discard(*self._table.popitem(last=False))
         else:
             self._current_size += 1
             self._number_directly_added += 1
@@ -266,7 +519,7 @@ class TranspositionTable:
         if self._table.pop(key, default=None) is None:
             if self._current_size == self._max_size:
                 self._number_entries_replaced += 1
-                del self._table[next(self._table.keys().__iter__())]
+                self._discard(*self._table.popitem(last=False))
             else:
                 self._current_size += 1
                 self._number_directly_added += 1
@@ -292,6 +545,7 @@ class TranspositionTable:
         if self._table.pop(key, default=None) is None:
             if self._current_size == self._max_size:
                 self._number_entries_rejected += 1
+                self._discard(key, value)
             else:
                 self._current_size += 1
                 self._number_directly_added += 1
@@ -325,8 +579,10 @@ class TranspositionTable:
                 first_value = self._table.pop(first_key)
                 if value[DEPTH_INDEX] >= first_value[DEPTH_INDEX]:
                     self._number_entries_replaced += 1
+                    self._discard(first_key, first_value)
                 else:
                     self._number_entries_rejected += 1
+                    self._discard(key, value)
                     key = first_key
                     value = first_value
             else:
@@ -362,7 +618,7 @@ class TranspositionTable:
         if value_already_in_table is None:
             if self._current_size == self._max_size:
                 self._number_entries_replaced += 1
-                del self._table[next(self._table.keys().__iter__())]
+                self._discard(*self._table.popitem(last=False))
             else:
                 self._current_size += 1
                 self._number_directly_added += 1
@@ -394,6 +650,7 @@ class TranspositionTable:
         if value_already_in_table is None:
             if self._current_size == self._max_size:
                 self._number_entries_rejected += 1
+                self._discard(key, value)
             else:
                 self._current_size += 1
                 self._number_directly_added += 1
@@ -405,3 +662,301 @@ class TranspositionTable:
             else:
                 self._number_entries_rejected += 1
                 self._table[key] = value_already_in_table
+
+    def _evict_first(self):
+        """
+        Removes the first entry of this TranspositionTable, which is the entry
+        that the policies based on insertion order would replace next, and
+        returns it as a (<key>, <value>) pair.
+        """
+        return self._table.popitem(last=False)
+
+    def replace_clock(self, key, value):
+        """
+        Adds the given key-value pair to the given TranspositionTable using the
+        CLOCK (or "second chance") policy. If an entry with the same key is
+        already present in the table, that entry is replaced by ("swapped
+        with") the new entry, which keeps its place in the table. If the table
+        is already full, and no entry with the same key is already present in
+        the table, the entries are looked at from the oldest one: an entry
+        that was hit by get() since it was last looked at loses its mark and
+        goes to the back of the table, and the first entry without a mark is
+        replaced.
+
+        :param key: the key of the new table entry
+        :param value: the value of the new table entry
+        """
+        self._number_attempted_mutations += 1
+        if key in self._table:
+            self._number_entries_swapped += 1
+        elif self._current_size >= self._max_size:
+            self._number_entries_replaced += 1
+            self._discard(*self._evict_clock())
+        else:
+            self._current_size += 1
+            self._number_directly_added += 1
+        self._table[key] = value
+
+    def _setup_clock(self):
+        """
+        Starts with no entry marked as hit.
+        """
+        self._referenced = set()
+
+    def _hit_clock(self, key):
+        """
+        Marks the entry with the given key as hit.
+        """
+        self._referenced.add(key)
+
+    def _evict_clock(self):
+        """
+        Removes and returns the entry that replace_clock() would replace.
+        """
+        table = self._table
+        referenced = self._referenced
+        while True:
+            key = next(iter(table))
+            if key not in referenced:
+                return key, table.pop(key)
+            referenced.discard(key)
+            table.move_to_end(key)
+
+    def replace_two_queue(self, key, value):
+        """
+        Adds the given key-value pair to the given TranspositionTable using the
+        2Q policy. New entries go to a first-in first-out queue holding up to
+        TWO_QUEUE_IN_FRACTION of the table, and the keys of the entries evicted
+        from that queue are remembered for a while (up to
+        TWO_QUEUE_OUT_FRACTION of the table). An entry whose key is remembered
+        when it is added goes instead to a least-recently-used queue, where
+        hits by get() move it to the back. If an entry with the same key is
+        already present in the table, it is replaced by ("swapped with") the
+        new entry, which keeps its place in its queue. If the table is already
+        full, the oldest entry of the first-in first-out queue is replaced if
+        that queue is over its share of the table, and the least recently used
+        entry of the other queue is replaced otherwise.
+
+        :param key: the key of the new table entry
+        :param value: the value of the new table entry
+        """
+        self._number_attempted_mutations += 1
+        if key in self._table:
+            self._number_entries_swapped += 1
+            self._table[key] = value
+            return
+        if self._current_size >= self._max_size:
+            self._number_entries_replaced += 1
+            self._discard(*self._evict_two_queue())
+        else:
+            self._current_size += 1
+            self._number_directly_added += 1
+        if self._two_queue_out.pop(key, False):
+            self._two_queue_main[key] = None
+        else:
+            self._two_queue_in[key] = None
+        self._table[key] = value
+
+    def _setup_two_queue(self):
+        """
+        Puts the entries already in the table in the least-recently-used
+        queue.
+        """
+        self._two_queue_in = OrderedDict()
+        self._two_queue_out = OrderedDict()
+        self._two_queue_main = OrderedDict.fromkeys(self._table)
+
+    def _hit_two_queue(self, key):
+        """
+        Moves the entry with the given key to the back of the
+        least-recently-used queue, if it is in that queue.
+        """
+        if key in self._two_queue_main:
+            self._two_queue_main.move_to_end(key)
+
+    def _evict_two_queue(self):
+        """
+        Removes and returns the entry that replace_two_queue() would replace.
+        """
+        if self._two_queue_main and len(self._two_queue_in) <= \
+                self._max_size * TWO_QUEUE_IN_FRACTION:
+            key = self._two_queue_main.popitem(last=False)[0]
+        else:
+            key = self._two_queue_in.popitem(last=False)[0]
+            self._two_queue_out[key] = True
+            if len(self._two_queue_out) > \
+                    self._max_size * TWO_QUEUE_OUT_FRACTION:
+                self._two_queue_out.popitem(last=False)
+        return key, self._table.pop(key)
+
+    def replace_depth_weighted_least_recently_used(self, key, value):
+        """
+        Conditionally adds the given key-value pair to the given
+        TranspositionTable using a least-recently-used policy that weighs the
+        depth of the entries. If the table already contains an entry for the
+        given key, then the given key-value pair replaces ("is swapped with")
+        the old entry iff the new entry is at least as deep as the old entry
+        (otherwise, the new entry is rejected), and the entry counts as used
+        either way. If the table is already full, and no entry with the same
+        key is already present in the table, then the given key-value pair
+        replaces the entry with the lowest <last-use> + <depth> * W, where
+        <last-use> counts the additions and hits by get() to the table, and W
+        is LRU_DEPTH_WEIGHT times the maximum size of the table. The entries
+        are kept in one least-recently-used queue per depth, so finding that
+        entry only looks at the front of each queue.
+
+        :param key: the key of the new table entry
+        :param value: the value of the new table entry
+        """
+        self._number_attempted_mutations += 1
+        value_already_in_table = self._table.get(key)
+        if value_already_in_table is not None:
+            if value[DEPTH_INDEX] >= value_already_in_table[DEPTH_INDEX]:
+                self._number_entries_swapped += 1
+                self._lru_queues[value_already_in_table[DEPTH_INDEX]].pop(key)
+                self._table[key] = value
+            else:
+                self._number_entries_rejected += 1
+                value = value_already_in_table
+        elif self._current_size >= self._max_size:
+            self._number_entries_replaced += 1
+            self._discard(*self._evict_depth_weighted_least_recently_used())
+            self._table[key] = value
+        else:
+            self._current_size += 1
+            self._number_directly_added += 1
+            self._table[key] = value
+        self._hit_depth_weighted_least_recently_used(key, value)
+
+    def _setup_depth_weighted_least_recently_used(self):
+        """
+        Counts the entries already in the table as used, in table order.
+        """
+        self._lru_clock = 0
+        self._lru_queues = {}
+        for key, value in self._table.items():
+            self._hit_depth_weighted_least_recently_used(key, value)
+
+    def _hit_depth_weighted_least_recently_used(self, key, value=None):
+        """
+        Counts the entry with the given key (and value, if known) as used.
+        """
+        if value is None:
+            value = self._table[key]
+        queue = self._lru_queues.get(value[DEPTH_INDEX])
+        if queue is None:
+            queue = self._lru_queues[value[DEPTH_INDEX]] = OrderedDict()
+        self._lru_clock += 1
+        queue.pop(key, None)
+        queue[key] = self._lru_clock
+
+    def _evict_depth_weighted_least_recently_used(self):
+        """
+        Removes and returns the entry that
+        replace_depth_weighted_least_recently_used() would replace.
+        """
+        weight = self._max_size * LRU_DEPTH_WEIGHT
+        victim_queue = None
+        victim_priority = None
+        for depth, queue in self._lru_queues.items():
+            if queue:
+                priority = next(iter(queue.values())) + depth * weight
+                if victim_priority is None or priority < victim_priority:
+                    victim_queue = queue
+                    victim_priority = priority
+        key = victim_queue.popitem(last=False)[0]
+        return key, self._table.pop(key)
+
+
+def expected_collision_rate(number_of_entries, max_size):
+    """
+    Returns the expected fraction of the given number of entries that share
+    their home slot (see analyze_sample()) with another entry, if their keys
+    hash uniformly to max_size slots, or None if there are no entries.
+
+    :param number_of_entries: the number of entries in the table
+    :type number_of_entries: int
+    :param max_size: the number of slots in the table
+    :type max_size: int
+    :return: the expected collision rate of the table
+    :rtype: float
+    """
+    if number_of_entries == 0:
+        return None
+    return 1 - (1 - 1 / max_size) ** (number_of_entries - 1)
+
+
+def analyze_sample(sample, collision_rate, probes_by_depth, hits_by_depth):
+    """
+    Returns an analysis of a transposition table, given a sample of its
+    entries, as a dict with the following items:
+        'sampled-entries': the number of entries in the sample
+        'depth-histogram': a dict mapping each depth to the fraction of the
+            sampled entries with that depth
+        'flag-mix': the fractions of the sampled entries whose score is EXACT,
+            an ALPHA_CUTOFF, and a BETA_CUTOFF, in that order
+        'hit-rate-by-depth': a dict mapping each remaining depth of the
+            searches that made lookups to the fraction of those lookups that
+            were hits
+        'collision-rate': the given collision rate
+    A collision is an entry whose home slot, the first slot that its integer
+    key (see state.hash_state_int()) hashes to, holds a different key. Two
+    different states never have the same integer key, so this only measures
+    how crowded the slots are. Fixed-size tables, such as a SharedMemoryTable,
+    check the home slot of their sampled entries, while the tables without
+    slots report expected_collision_rate() for max_size slots.
+
+    :param sample: (<key>, <value>) pairs sampled from the table
+    :type sample: list((X, (int, numeric, (byte, byte), int)))
+    :param collision_rate: the fraction of the entries of the table that are
+        collisions, or None if it is unknown
+    :type collision_rate: float
+    :param probes_by_depth: the number of lookups of the table by depth
+    :type probes_by_depth: dict(int, int)
+    :param hits_by_depth: the number of hits of the table by depth
+    :type hits_by_depth: dict(int, int)
+    :return: the analysis of the table
+    :rtype: dict(string, object)
+    """
+    depths = {}
+    flags = [0, 0, 0]
+    for key, value in sample:
+        depths[value[DEPTH_INDEX]] = depths.get(value[DEPTH_INDEX], 0) + 1
+        flags[value[FLAGS_INDEX]] += 1
+    number_sampled = len(sample)
+    return {
+        'sampled-entries': number_sampled,
+        'depth-histogram': {depth: count / number_sampled
+                            for depth, count in sorted(depths.items())},
+        'flag-mix': tuple(count / number_sampled if number_sampled else 0
+                          for count in flags),
+        'hit-rate-by-depth': {depth: hits_by_depth.get(depth, 0) / probes
+                              for depth, probes in
+                              sorted(probes_by_depth.items())},
+        'collision-rate': collision_rate
+    }
+
+
+"""
+For each replacement policy that needs them, a tuple of the form:
+    (<setup>, <on-hit>, <evict>)
+where <setup> builds the bookkeeping of the policy for the entries already in
+the table, <on-hit> is called with every key hit by get(), and <evict> removes
+the entry that the policy would replace next and returns it as a
+(<key>, <value>) pair. The other policies only rely on the insertion order of
+the table.
+"""
+POLICY_HOOKS = {
+    TranspositionTable.replace_clock: (
+        TranspositionTable._setup_clock,
+        TranspositionTable._hit_clock,
+        TranspositionTable._evict_clock),
+    TranspositionTable.replace_two_queue: (
+        TranspositionTable._setup_two_queue,
+        TranspositionTable._hit_two_queue,
+        TranspositionTable._evict_two_queue),
+    TranspositionTable.replace_depth_weighted_least_recently_used: (
+        TranspositionTable._setup_depth_weighted_least_recently_used,
+        TranspositionTable._hit_depth_weighted_least_recently_used,
+        TranspositionTable._evict_depth_weighted_least_recently_used)
+}
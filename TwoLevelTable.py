@@ -0,0 +1,122 @@
+from TranspositionTable import *
+from MappedTable import MappedTable
+
+"""
+A transposition table made of two levels: a TranspositionTable in memory (the
+front table), backed by a MappedTable on disk (the back table).
+
+Entries that the replacement policy of the front table evicts, or rejects
+because the front table is full, spill to the back table, and a lookup that
+misses the front table falls through to the back table. A state can therefore
+have an entry in both levels, in which case the one in the front table is the
+most recent and is the one returned.
+"""
+
+
+class TwoLevelTable(TranspositionTable):
+    """
+    A TranspositionTable whose discarded entries spill to a memory-mapped file,
+    so that the table can hold more entries than fit in memory.
+    """
+
+    def __init__(self, max_size, replacement_policy, filename, back_size,
+                 max_bytes=None):
+        """
+        Creates and initializes a new TwoLevelTable, creating (or overwriting)
+        the file with the given name to hold its back table.
+
+        :param max_size: the maximum number of entries in the front table
+        :type max_size: integral
+        :param replacement_policy: the replacement policy of the front table
+            (see TranspositionTable.__init__())
+        :type replacement_policy: (TranspositionTable, X, Y) => None, where X
+            is the type of the keys in this table, and Y is the type of the
+            values
+        :param filename: the name of the file holding the back table
+        :type filename: string
+        :param back_size: the number of slots in the back table
+        :type back_size: integral
+        :param max_bytes: if not None, the memory budget of the front table in
+            bytes (see TranspositionTable.__init__()); defaults to None
+        :type max_bytes: integral
+        """
+        TranspositionTable.__init__(self, max_size, replacement_policy,
+                                    max_bytes)
+        self._back = MappedTable.create(filename, back_size,
+                                        replacement_policy.__name__)
+        self._number_back_hits = 0
+
+    def get(self, key, default=None, depth=None):
+        """
+        Returns the value of the entry with the given key in the front table,
+        or else in the back table, or the given default value if neither table
+        contains an entry with the given key.
+
+        :param key: the key of the entry
+        :param default: the default to return if there is no entry with the key
+        :param depth: the remaining depth of the search making the lookup (see
+            TranspositionTable.get()); defaults to None
+        :type depth: int
+        :return: the value of the entry with the given key, or the default
+        """
+        self._number_safe_accesses += 1
+        if self._trace is not None:
+            self._record(TRACE_GET, key, depth, TRACE_NO_FLAGS)
+        value = self._table.get(key)
+        if value is None:
+            value = self._back.get(key)
+            self._count_probe(depth, value is not None)
+            if value is None:
+                return default
+            self._number_back_hits += 1
+        else:
+            self._count_probe(depth, True)
+            if self._on_hit is not None:
+                self._on_hit(self, key)
+        self._number_hits += 1
+        return value
+
+    def _discard(self, key, value):
+        """
+        Spills the given entry to the back table.
+
+        :param key: the key of the discarded entry
+        :param value: the value of the discarded entry
+        """
+        self._back.put(key, value)
+
+    def reset_counters(self):
+        """
+        Resets the counters of both levels to 0 (see
+        TranspositionTable.reset_counters()).
+        """
+        TranspositionTable.reset_counters(self)
+        self._back.reset_counters()
+        self._number_back_hits = 0
+
+    def get_level_hits(self):
+        """
+        Returns a (<in-memory-hits>, <on-disk-hits>) pair counting the hits of
+        get() served by the front table and by the back table since the
+        counters were last reset.
+
+        :return: the number of hits served by each level
+        :rtype: (int, int)
+        """
+        return self._number_hits - self._number_back_hits, \
+            self._number_back_hits
+
+    def get_back_table(self):
+        """
+        Returns the back table of this TwoLevelTable.
+
+        :return: the back table of this TwoLevelTable
+        :rtype: MappedTable
+        """
+        return self._back
+
+    def close(self):
+        """
+        Closes the file holding the back table of this TwoLevelTable.
+        """
+        self._back.close()
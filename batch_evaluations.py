@@ -0,0 +1,243 @@
+import numpy as np
+from evaluations import *
+
+"""
+Evaluates many states at once with NumPy, for offline analysis and scoring,
+returning the same scores as simple_eval() and split_weight_eval().
+
+The states are given as an (N, STATE_SIZE) uint8 array, one compact state per
+row (see states_to_array()). Each state is first drawn on a board of
+NUMBER_OF_TILES + 1 columns, where the last column stands for every tile off
+the board, and the features are then computed for all the states at once by
+indexing the boards with the precomputed neighbour arrays below.
+"""
+NUMBER_OF_TILES = BOARD_NUM_RANKS * BOARD_NUM_FILES
+OFF_BOARD_TILE = NUMBER_OF_TILES
+
+# The codes of the contents of the tiles on the boards.
+EMPTY_CODE = 0
+KING_CODE = 1
+GUARD_CODE = 2
+DRAGON_CODE = 3
+OFF_BOARD_CODE = 4
+
+BOARD_CONTROL_VECTOR = np.array(BOARD_CONTROL, dtype=np.int64)
+KING_PROGRESS_VECTOR = np.array([get_king_progress(tile_idx)
+                                 for tile_idx in range(NUMBER_OF_TILES)],
+                                dtype=np.int64)
+
+
+def _pad(tiles, length):
+    """
+    Returns the given tiles followed by OFF_BOARD_TILE up to the given length.
+    """
+    return list(tiles) + [OFF_BOARD_TILE] * (length - len(tiles))
+
+
+"""
+The orthogonal neighbours of each tile, in the order of
+get_orthogonal_tiles_around(), padded with OFF_BOARD_TILE (shape (26, 4)).
+The off-board tile has no neighbours.
+"""
+NEIGHBOUR_INDICES = np.array(
+    [_pad(ORTHOGONAL_TILES_AROUND[tile_idx], 4)
+     for tile_idx in range(NUMBER_OF_TILES)] + [_pad((), 4)], dtype=np.intp)
+
+"""
+For each tile of a guard and each of its (padded) neighbours, the orthogonal
+and diagonal neighbours of that neighbour which are not themselves neighbours
+of the guard, padded with OFF_BOARD_TILE (shape (26, 4, 8)). These are the
+tiles from which a third dragon could move next to a guard (see
+count_guards_threatened()).
+"""
+THIRD_DRAGON_INDICES = np.array(
+    [[_pad([second for second in SECOND_TILES_AROUND[neighbour]
+            if second not in ORTHOGONAL_TILES_AROUND[tile_idx]]
+           if neighbour != OFF_BOARD_TILE else (), 8)
+      for neighbour in NEIGHBOUR_INDICES[tile_idx]]
+     for tile_idx in range(NUMBER_OF_TILES)] + [[_pad((), 8)] * 4],
+    dtype=np.intp)
+
+NET_FEATURE_WEIGHT_VECTOR = np.array(NET_FEATURE_WEIGHTS, dtype=np.int64)
+
+
+def states_to_array(states):
+    """
+    Returns an (N, STATE_SIZE) uint8 array holding the given compact states.
+
+    :param states: N compact state representations
+    :type states: iterable(array of bytes)
+    :return: the states, one per row
+    :rtype: numpy.ndarray
+    """
+    return np.array([list(state) for state in states],
+                    dtype=np.uint8).reshape(-1, STATE_SIZE)
+
+
+def get_boards(states):
+    """
+    Returns an (N, NUMBER_OF_TILES + 1) uint8 array of the contents (one of
+    EMPTY_CODE, KING_CODE, GUARD_CODE, or DRAGON_CODE) of the tiles of the
+    given states, whose last column is OFF_BOARD_CODE.
+
+    :param states: an (N, STATE_SIZE) uint8 array of compact states
+    :type states: numpy.ndarray
+    :return: the boards of the states
+    :rtype: numpy.ndarray
+    """
+    number_of_states = states.shape[0]
+    rows = np.arange(number_of_states)[:, np.newaxis]
+    boards = np.full((number_of_states, NUMBER_OF_TILES + 1), EMPTY_CODE,
+                     dtype=np.uint8)
+    pieces = states[:, 1:].astype(np.intp)
+    is_dragon = pieces >= DRAGON_BASE
+    tiles = np.where(is_dragon, pieces - DRAGON_BASE, pieces)
+    # Dead pieces (DEAD == OFF_BOARD_TILE) are drawn on the off-board tile.
+    boards[rows, tiles] = np.where(is_dragon, DRAGON_CODE, GUARD_CODE)
+    boards[:, OFF_BOARD_TILE] = OFF_BOARD_CODE
+    boards[rows[:, 0], states[:, 0] >> NUM_META_STATE_BITS] = KING_CODE
+    return boards
+
+
+def batch_features(states):
+    """
+    Returns an (N, len(FEATURES)) int64 array of the features of the given
+    states, with the same values as extract_features().
+
+    :param states: an (N, STATE_SIZE) uint8 array of compact states
+    :type states: numpy.ndarray
+    :return: the features of the states, one row per state
+    :rtype: numpy.ndarray
+    """
+    boards = get_boards(states)
+    king_tiles = (states[:, 0] >> NUM_META_STATE_BITS).astype(np.intp)
+    is_empty = boards[:, :NUMBER_OF_TILES] == EMPTY_CODE
+    is_dragon = boards[:, :NUMBER_OF_TILES] == DRAGON_CODE
+    is_guard = boards[:, :NUMBER_OF_TILES] == GUARD_CODE
+
+    # The neighbours of every tile of every board: (N, NUMBER_OF_TILES, 4).
+    neighbours = boards[:, NEIGHBOUR_INDICES[:NUMBER_OF_TILES]]
+    king_units = ((neighbours == KING_CODE) |
+                  (neighbours == GUARD_CODE)).sum(axis=2)
+    dragon_units = (neighbours == DRAGON_CODE).sum(axis=2)
+
+    features = np.empty((states.shape[0], len(FEATURES)), dtype=np.int64)
+    features[:, 0] = (is_guard @ BOARD_CONTROL_VECTOR +
+                      BOARD_CONTROL_VECTOR[king_tiles])
+    features[:, 1] = is_guard.sum(axis=1)
+    features[:, 2] = KING_PROGRESS_VECTOR[king_tiles]
+    features[:, 3] = (is_empty & (king_units >= 2)).sum(axis=1)
+    features[:, 4] = is_dragon @ BOARD_CONTROL_VECTOR
+    features[:, 5] = is_dragon.sum(axis=1)
+    features[:, 6] = (is_empty & (dragon_units >= 3)).sum(axis=1)
+    features[:, 7] = (is_dragon & (king_units >= 2)).sum(axis=1)
+    features[:, 8] = _batch_guards_threatened(states, boards)
+    return features
+
+
+def _batch_guards_threatened(states, boards):
+    """
+    Returns an (N,) array of the number of threatened guards of the given
+    states and their boards (see count_guards_threatened()).
+    """
+    number_of_states = states.shape[0]
+    rows = np.arange(number_of_states)[:, np.newaxis, np.newaxis]
+    pieces = states[:, 1:].astype(np.intp)
+    is_guard = pieces < DRAGON_BASE
+    guards = np.where(is_guard, pieces, OFF_BOARD_TILE)
+    is_guard &= guards != OFF_BOARD_TILE
+
+    # The neighbours of each piece: (N, STATE_SIZE - 1, 4 neighbours), where
+    # the pieces that are not live guards only have off-board neighbours.
+    neighbours = boards[rows, NEIGHBOUR_INDICES[guards]]
+    is_dragon = neighbours == DRAGON_CODE
+    dragons_seen = np.cumsum(is_dragon, axis=2)
+    number_of_dragons = dragons_seen[:, :, -1]
+    count = (is_guard & (number_of_dragons > 2)).sum(axis=1)
+
+    # Only the guards with exactly 2 dragon neighbours look for a third one.
+    # A non-dragon neighbour is unoccupied if it is empty, or if it comes
+    # after the second dragon (dragons_seen counts the earlier dragons).
+    state_idx, piece_idx = np.nonzero(is_guard & (number_of_dragons == 2))
+    neighbours = neighbours[state_idx, piece_idx]
+    is_unoccupied = (neighbours == EMPTY_CODE) | \
+        ((dragons_seen[state_idx, piece_idx] == 2) &
+         (neighbours != DRAGON_CODE) & (neighbours != OFF_BOARD_CODE))
+    third_dragons = (boards[state_idx[:, np.newaxis, np.newaxis],
+                            THIRD_DRAGON_INDICES[guards[state_idx,
+                                                        piece_idx]]] ==
+                     DRAGON_CODE).any(axis=2)
+    is_threatened = (is_unoccupied & third_dragons).any(axis=1)
+    return count + np.bincount(state_idx, weights=is_threatened,
+                               minlength=number_of_states).astype(np.int64)
+
+
+def batch_split_weight_eval(states):
+    """
+    Returns an (N,) int64 array of the scores of split_weight_eval() for the
+    given states.
+
+    :param states: an (N, STATE_SIZE) uint8 array of compact states
+    :type states: numpy.ndarray
+    :return: the scores of the states
+    :rtype: numpy.ndarray
+    """
+    return batch_features(states) @ NET_FEATURE_WEIGHT_VECTOR
+
+
+def batch_simple_eval(states):
+    """
+    Returns an (N,) int64 array of the scores of simple_eval() for the given
+    states.
+
+    :param states: an (N, STATE_SIZE) uint8 array of compact states
+    :type states: numpy.ndarray
+    :return: the scores of the states
+    :rtype: numpy.ndarray
+    """
+    features = batch_features(states)
+    # np.round() rounds halves to even, like round() in simple_eval().
+    guard_piece_score = np.round(features[:, 1] * 5 / 4).astype(np.int64)
+    return (guard_piece_score - features[:, 5] +
+            features[:, 3] - features[:, 6] +
+            features[:, 7] - features[:, 8] +
+            features[:, 2])
+
+
+def _test(number_of_states=20000, seed=1):
+    """
+    Checks the batch evaluations against the scalar ones on positions reached
+    by random games, and times both.
+    """
+    import random
+    import time
+    rng = random.Random(seed)
+    states = []
+    while len(states) < number_of_states:
+        state = get_default_game_start()
+        expanded_state = create_expanded_state_representation(state)
+        while not is_terminal(state, expanded_state)[0]:
+            state, expanded_state, _ = rng.choice(
+                successors(state, expanded_state))
+            states.append(state)
+    states = states[:number_of_states]
+    array = states_to_array(states)
+    for batch_eval, scalar_eval in ((batch_split_weight_eval,
+                                     split_weight_eval),
+                                    (batch_simple_eval, simple_eval)):
+        start = time.perf_counter()
+        scores = batch_eval(array)
+        batch_time = time.perf_counter() - start
+        start = time.perf_counter()
+        expected = [scalar_eval(state,
+                                create_expanded_state_representation(state))
+                    for state in states]
+        scalar_time = time.perf_counter() - start
+        assert scores.tolist() == expected, scalar_eval.__name__
+        print(scalar_eval.__name__, "OK:", len(states), "states,",
+              round(batch_time, 3), "s batched,", round(scalar_time, 3),
+              "s one at a time")
+
+
+if __name__ == "__main__":
+    _test()
@@ -0,0 +1,332 @@
+import numpy as np
+from batch_moves import *
+from compiled_evaluations import compiled_split_weight_eval
+from array import array
+import copy
+
+"""
+Breadth-first minimax for shallow full-width searches, with NumPy.
+
+Instead of one recursive call per node, the search tree is built one ply at
+a time: each ply is a frontier of compact states in an (N, STATE_SIZE) uint8
+array, with the index of the parent of each state in the previous ply, the
+move from the parent, and whether the state is terminal and its utility.
+Each ply is expanded in one batch too (see batch_moves.py), and the children
+of a state come in one contiguous run, in the order of all_valid_moves().
+The non-terminal states of the last ply are evaluated in one batch (see
+batch_evaluations.py), and the values are backed up ply by ply with
+segmented maximum and minimum reductions over the runs of children.
+
+The values are those of plain fixed-depth minimax, without quiescence search
+or transposition table: the utility of terminal states, and the evaluation
+of the other states at the depth limit. Since the whole tree is in memory,
+the depth is limited to MAX_BATCH_DEPTH.
+"""
+
+MAX_BATCH_DEPTH = 3
+
+"""
+The batch evaluation function of each scalar evaluation function.
+"""
+BATCH_EVALUATIONS = {
+    split_weight_eval: batch_split_weight_eval,
+    compiled_split_weight_eval: batch_split_weight_eval,
+    simple_eval: batch_simple_eval
+}
+
+
+def get_batch_evaluation(evaluate):
+    """
+    Returns the batch evaluation function returning the same scores as the
+    given evaluation function (or as the function it wraps, see
+    cached_evaluation()), or a function evaluating the states one at a time
+    with it if there is none.
+
+    :param evaluate: a function taking a state and an expanded state and
+        returning a heuristic estimate of the state's utility for the current
+        player
+    :type evaluate: (array of bytes, dict(byte, char)) => numeric
+    :return: a function taking an (N, STATE_SIZE) uint8 array of states and
+        returning an (N,) int64 array of their scores
+    :rtype: (numpy.ndarray) => numpy.ndarray
+    """
+    batch_evaluate = BATCH_EVALUATIONS.get(getattr(evaluate, '__wrapped__',
+                                                   evaluate))
+    if batch_evaluate is not None:
+        return batch_evaluate
+
+    def evaluate_one_at_a_time(states):
+        scores = []
+        for row in states:
+            state = array('B', row.tobytes())
+            scores.append(evaluate(
+                state, create_expanded_state_representation(state)))
+        return np.array(scores, dtype=np.int64)
+
+    return evaluate_one_at_a_time
+
+
+def expand_frontier(states):
+    """
+    Returns the (<parents>, <moves>, <children>, <is-terminal>, <utilities>)
+    arrays of the children of the given non-terminal states: the index of the
+    parent of each child in the given array, the (<from-tile-index>,
+    <to-tile-index>) move from the parent, the compact state of the child,
+    whether it is terminal, and its utility if it is terminal (0 otherwise).
+
+    :param states: an (N, STATE_SIZE) uint8 array of non-terminal states
+    :type states: numpy.ndarray
+    :return: the parents, moves, states, terminal flags, and utilities of
+        the children
+    :rtype: (numpy.ndarray, numpy.ndarray, numpy.ndarray, numpy.ndarray,
+             numpy.ndarray)
+    """
+    parents, moves, children = batch_successors(states)
+    is_term, utilities = batch_is_terminal(children)
+    return parents, moves, children, is_term, utilities
+
+
+def back_up(states, is_term, utilities, parents, child_values):
+    """
+    Returns the (N,) int64 array of the minimax values of the given states,
+    from the values of their children: the utility of the terminal states,
+    and the maximum of the values of the children of the other states if it
+    is the king player's turn, and their minimum otherwise.
+
+    :param states: an (N, STATE_SIZE) uint8 array of states
+    :type states: numpy.ndarray
+    :param is_term: whether each state is terminal
+    :type is_term: numpy.ndarray
+    :param utilities: the utility of each terminal state
+    :type utilities: numpy.ndarray
+    :param parents: the index of the parent of each child, in increasing
+        order (see expand_frontier())
+    :type parents: numpy.ndarray
+    :param child_values: the value of each child
+    :type child_values: numpy.ndarray
+    :return: the values of the states
+    :rtype: numpy.ndarray
+    """
+    values = utilities.copy()
+    expanded = np.nonzero(~is_term)[0]
+    if expanded.shape[0] == 0:
+        return values
+    # Every non-terminal state has a child, so no run of children is empty.
+    offsets = np.searchsorted(parents, expanded)
+    maxima = np.maximum.reduceat(child_values, offsets)
+    minima = np.minimum.reduceat(child_values, offsets)
+    is_king_turn = (states[expanded, 0] & TURN_MASK) != 0
+    values[expanded] = np.where(is_king_turn, maxima, minima)
+    return values
+
+
+def batch_minimax_root(state, expanded_state, batch_evaluate, depth):
+    """
+    Searches the given non-terminal state breadth-first to the given depth,
+    and returns the (<moves>, <values>) arrays of its moves and of the
+    minimax values of their children.
+
+    :param state: a compact state representation
+    :type state: array of bytes
+    :param expanded_state: the expanded representation of the state
+    :type expanded_state: dict(byte, char)
+    :param batch_evaluate: a function taking an (N, STATE_SIZE) uint8 array
+        of states and returning an (N,) int64 array of their scores
+    :type batch_evaluate: (numpy.ndarray) => numpy.ndarray
+    :param depth: the depth of the search, from 1 to MAX_BATCH_DEPTH
+    :type depth: int
+    :return: the moves of the state, and the values of their children
+    :rtype: (numpy.ndarray, numpy.ndarray)
+    """
+    if not 1 <= depth <= MAX_BATCH_DEPTH:
+        raise ValueError("depth not in [1, {0}]: {1}".format(MAX_BATCH_DEPTH,
+                                                             depth))
+    root = np.frombuffer(state.tobytes(), dtype=np.uint8).reshape(1, -1)
+    plies = []
+    frontier = root
+    frontier_is_term = np.zeros(1, dtype=bool)
+    for _ in range(depth):
+        expanded = np.nonzero(~frontier_is_term)[0]
+        parents, moves, children, is_term, utilities = \
+            expand_frontier(frontier[expanded])
+        plies.append((expanded[parents], moves, children, is_term, utilities))
+        frontier = children
+        frontier_is_term = is_term
+
+    # Evaluate the leaves, then back up the values to the root's children.
+    _, _, children, is_term, utilities = plies[-1]
+    values = utilities.copy()
+    leaves = np.nonzero(~is_term)[0]
+    if leaves.shape[0] > 0:
+        values[leaves] = batch_evaluate(children[leaves])
+    for ply in range(depth - 1, 0, -1):
+        parents = plies[ply][0]
+        _, _, states, is_term, utilities = plies[ply - 1]
+        values = back_up(states, is_term, utilities, parents, values)
+    return plies[0][1], values
+
+
+def batch_minimax(state, expanded_state, evaluate, remaining_depth):
+    """
+    Performs breadth-first minimax search (see batch_minimax_root()),
+    returning a (<utility>, <move>) pair like minimax(), where the move is
+    the first one with the best utility. The depth is at most
+    MAX_BATCH_DEPTH. The leaves are evaluated in one batch by the batch
+    evaluation function of the given evaluation function (see
+    get_batch_evaluation()).
+
+    :param state: the root state of the search
+    :type state: array of bytes
+    :param expanded_state: the expanded representation of the state
+    :type expanded_state: dict(byte, char)
+    :param evaluate: a function taking a state and an expanded state and
+        returning a heuristic estimate of the state's utility for the current
+        player
+    :type evaluate: (array of bytes, dict(byte, char)) => numeric
+    :param remaining_depth: the depth of the search; only the first
+        MAX_BATCH_DEPTH plies are searched
+    :type remaining_depth: int
+    :return: a (<utility>, <move>) pair
+    :rtype: (numeric, (byte, byte))
+    """
+    is_term, utility = is_terminal(state, expanded_state)
+    if is_term:
+        return utility, None
+    if remaining_depth == 0:
+        return evaluate(state, expanded_state), None
+    moves, values = batch_minimax_root(state, expanded_state,
+                                       get_batch_evaluation(evaluate),
+                                       min(remaining_depth, MAX_BATCH_DEPTH))
+    if player_turn(state) == KING_PLAYER:
+        best = int(np.argmax(values))
+    else:
+        best = int(np.argmin(values))
+    return int(values[best]), tuple(int(tile_idx) for tile_idx in moves[best])
+
+
+def alpha_beta_batch_ordered(state, expanded_state, evaluate,
+                             remaining_depth, ordering_depth=2):
+    """
+    Performs alpha beta search like alpha_beta(), but first orders the moves
+    of the root by the values of a breadth-first minimax search (see
+    batch_minimax_root()) to the given depth, best first, and then searches
+    them in that order, so that the window narrows as early as possible. The
+    result is stored in the global transposition table like the one of
+    alpha_beta().
+
+    :param state: the root state of the search
+    :type state: array of bytes
+    :param expanded_state: the expanded representation of the state
+    :type expanded_state: dict(byte, char)
+    :param evaluate: a function taking a state and an expanded state and
+        returning a heuristic estimate of the state's utility for the current
+        player
+    :type evaluate: (array of bytes, dict(byte, char)) => numeric
+    :param remaining_depth: the depth of the alpha beta search
+    :type remaining_depth: int
+    :param ordering_depth: the depth of the ordering search, which is at most
+        remaining_depth - 1; defaults to 2
+    :type ordering_depth: int
+    :return: a (<utility>, <move>) pair
+    :rtype: (numeric, (byte, byte))
+    """
+    import minimax
+    ordering_depth = min(ordering_depth, remaining_depth - 1,
+                         MAX_BATCH_DEPTH)
+    if ordering_depth < 1 or is_terminal(state, expanded_state)[0]:
+        return minimax.alpha_beta(state, expanded_state, evaluate,
+                                  remaining_depth)
+    moves, values = batch_minimax_root(state, expanded_state,
+                                       get_batch_evaluation(evaluate),
+                                       ordering_depth)
+    is_max = player_turn(state) == KING_PLAYER
+    # A stable sort keeps the moves with equal values in their order.
+    order = np.argsort(-values if is_max else values, kind='stable')
+
+    alpha = DRAGON_WIN
+    beta = KING_WIN
+    utility = best_move = None
+    for i in order:
+        move = int(moves[i, 0]), int(moves[i, 1])
+        new_state = copy.deepcopy(state)
+        new_expanded_state = expanded_state.copy()
+        move_piece(new_state, new_expanded_state, *move)
+        new_utility = minimax.alpha_beta(new_state, new_expanded_state,
+                                         evaluate, remaining_depth - 1,
+                                         alpha, beta)[0]
+        if is_max:
+            if utility is None or new_utility > utility:
+                utility = new_utility
+                best_move = move
+            alpha = max(alpha, utility)
+        else:
+            if utility is None or new_utility < utility:
+                utility = new_utility
+                best_move = move
+            beta = min(beta, utility)
+    minimax._table[hash_state(state)] = (remaining_depth, utility, best_move,
+                                         minimax.EXACT)
+    return utility, best_move
+
+
+def _plain_minimax(state, expanded_state, evaluate, depth):
+    """
+    Returns the value of plain fixed-depth minimax search, without
+    quiescence search or transposition table.
+    """
+    is_term, utility = is_terminal(state, expanded_state)
+    if is_term:
+        return utility
+    if depth == 0:
+        return evaluate(state, expanded_state)
+    values = [_plain_minimax(new_state, new_expanded_state, evaluate,
+                             depth - 1)
+              for new_state, new_expanded_state, _ in
+              successors(state, expanded_state)]
+    return max(values) if player_turn(state) == KING_PLAYER else min(values)
+
+
+def _test(number_of_states=30, seed=1):
+    """
+    Checks batch_minimax() against plain recursive minimax at depths 1 to 3
+    on positions reached by random games, and times both.
+    """
+    import random
+    import time
+    rng = random.Random(seed)
+    states = []
+    while len(states) < number_of_states:
+        state = get_default_game_start()
+        expanded_state = create_expanded_state_representation(state)
+        for _ in range(rng.randrange(40)):
+            if is_terminal(state, expanded_state)[0]:
+                break
+            state, expanded_state, _ = rng.choice(
+                successors(state, expanded_state))
+        if not is_terminal(state, expanded_state)[0]:
+            states.append(state)
+    for depth in range(1, MAX_BATCH_DEPTH + 1):
+        batch_time = scalar_time = 0
+        for state in states:
+            expanded_state = create_expanded_state_representation(state)
+            start = time.perf_counter()
+            utility, move = batch_minimax(state, expanded_state,
+                                          split_weight_eval, depth)
+            batch_time += time.perf_counter() - start
+            start = time.perf_counter()
+            expected = _plain_minimax(state, expanded_state,
+                                      split_weight_eval, depth)
+            scalar_time += time.perf_counter() - start
+            assert utility == expected, (state, depth, utility, expected)
+            new_state = copy.deepcopy(state)
+            new_expanded_state = expanded_state.copy()
+            move_piece(new_state, new_expanded_state, *move)
+            assert _plain_minimax(new_state, new_expanded_state,
+                                  split_weight_eval, depth - 1) == utility
+        print("depth", depth, "OK:", len(states), "states,",
+              round(batch_time, 3), "s breadth-first,",
+              round(scalar_time, 3), "s recursive")
+
+
+if __name__ == "__main__":
+    _test()
@@ -0,0 +1,406 @@
+import numpy as np
+from batch_evaluations import *
+
+"""
+Generates and applies the moves of many states at once with NumPy, with the
+same rules as all_valid_moves(), move_piece(), and is_terminal().
+
+The states are given as an (N, STATE_SIZE) uint8 array, one compact state per
+row (see states_to_array()), and the moves are returned as flat arrays, one
+entry per move: the index of the state the move is made from, and its
+from-tile and to-tile indices. The moves of a state come in one contiguous
+run, in the order of all_valid_moves(): the moves of the king, and then those
+of each guard, or those of each dragon, in the order of the pieces in the
+state, and the moves of each piece in the order of the directions below.
+
+Every piece can make at most MAX_MOVES_PER_PIECE moves, so the candidate
+moves are laid out in an (N, STATE_SIZE, MAX_MOVES_PER_PIECE) array, indexed
+by state, by index of the piece in the state (0 being the king), and by
+direction, whose valid entries np.nonzero() lists in that order.
+"""
+MAX_MOVES_PER_PIECE = 8
+
+# The directions of the moves, in the order of _all_orthogonal_moves() and
+# of the diagonal moves of _all_valid_moves_for_dragon().
+BELOW = 0
+LEFT = 1
+RIGHT = 2
+ABOVE = 3
+ABOVE_LEFT = 4
+BELOW_LEFT = 5
+ABOVE_RIGHT = 6
+BELOW_RIGHT = 7
+
+
+def _get_neighbour(tile_idx, direction):
+    """
+    Returns the tile next to the given tile in the given orthogonal direction
+    (as in _check_below(), _check_left(), _check_right(), and
+    _check_above()), or OFF_BOARD_TILE if there is none or if the given tile
+    is OFF_BOARD_TILE.
+    """
+    if tile_idx == OFF_BOARD_TILE:
+        return OFF_BOARD_TILE
+    if direction == BELOW:
+        on_board = tile_idx % BOARD_NUM_RANKS != 0
+        neighbour = tile_idx - 1
+    elif direction == LEFT:
+        neighbour = tile_idx - BOARD_NUM_RANKS
+        on_board = neighbour >= 0
+    elif direction == RIGHT:
+        neighbour = tile_idx + BOARD_NUM_RANKS
+        on_board = neighbour < NUMBER_OF_TILES
+    else:
+        neighbour = tile_idx + 1
+        on_board = neighbour % BOARD_NUM_RANKS != 0
+    return neighbour if on_board else OFF_BOARD_TILE
+
+
+"""
+The tiles next to each tile in the directions BELOW, LEFT, RIGHT, and ABOVE,
+or OFF_BOARD_TILE (shape (26, 4)).
+"""
+STEP_INDICES = np.array(
+    [[_get_neighbour(tile_idx, direction)
+      for direction in (BELOW, LEFT, RIGHT, ABOVE)]
+     for tile_idx in range(NUMBER_OF_TILES + 1)], dtype=np.intp)
+
+"""
+The tiles two steps away from each tile in each of the directions of
+STEP_INDICES, where the king lands when he jumps over a guard (shape
+(26, 4)).
+"""
+JUMP_INDICES = STEP_INDICES[STEP_INDICES, np.arange(4)]
+
+"""
+The tiles a dragon on each tile may move to, in the order of the directions,
+or OFF_BOARD_TILE (shape (26, MAX_MOVES_PER_PIECE)). The diagonal moves
+through a left or right tile off the board are off the board too.
+"""
+DRAGON_MOVE_INDICES = np.concatenate(
+    (STEP_INDICES,
+     STEP_INDICES[STEP_INDICES[:, [LEFT, LEFT, RIGHT, RIGHT]],
+                  [ABOVE, BELOW, ABOVE, BELOW]]), axis=1)
+
+
+def _get_king_tiles(states):
+    """
+    Returns the (N,) array of the tiles of the kings of the given states.
+    """
+    return (states[:, 0] >> NUM_META_STATE_BITS).astype(np.intp)
+
+
+def _count_neighbours(boards, codes):
+    """
+    Returns the (N, NUMBER_OF_TILES + 1) array of the numbers of orthogonal
+    neighbours of each tile of the given boards holding one of the given
+    codes.
+    """
+    is_code = np.isin(boards, codes)
+    return is_code[:, STEP_INDICES].sum(axis=2)
+
+
+def _are_kings_captured(boards, king_tiles):
+    """
+    Returns the (N,) bool array of whether the king of each of the given
+    boards is captured, as in _is_king_captured(): when at least three
+    dragons are next to him, and the fourth tile next to him is not empty.
+    """
+    rows = np.arange(boards.shape[0])[:, np.newaxis]
+    around = boards[rows, STEP_INDICES[king_tiles]]
+    return ((around == DRAGON_CODE).sum(axis=1) >= 3) & \
+        ~(around == EMPTY_CODE).any(axis=1)
+
+
+def _get_candidate_moves(states, boards):
+    """
+    Returns the (<targets>, <is-valid>) pair of (N, STATE_SIZE,
+    MAX_MOVES_PER_PIECE) arrays of the candidate moves of the given states
+    (see the module docstring): the tile each piece would move to in each
+    direction, and whether that move is valid for the player to move. The
+    states whose result is already marked, or whose king is captured, have
+    no valid moves, as in all_valid_moves().
+    """
+    number_of_states = states.shape[0]
+    rows = np.arange(number_of_states)[:, np.newaxis, np.newaxis]
+    king_tiles = _get_king_tiles(states)
+    pieces = states[:, 1:].astype(np.intp)
+    is_guard = pieces < DEAD
+    is_dragon = pieces > DEAD
+    tiles = np.concatenate(
+        (king_tiles[:, np.newaxis],
+         np.where(is_dragon, pieces - DRAGON_BASE,
+                  np.where(is_guard, pieces, OFF_BOARD_TILE))), axis=1)
+    is_king_turn = (states[:, 0] & TURN_MASK) != 0
+    can_move = ~((states[:, 0] & WIN_MASK != 0) |
+                 _are_kings_captured(boards, king_tiles))
+    movers = np.concatenate(
+        (is_king_turn[:, np.newaxis],
+         np.where(is_king_turn[:, np.newaxis], is_guard, is_dragon)),
+        axis=1) & can_move[:, np.newaxis]
+
+    # The king and the guards move orthogonally onto empty tiles, or onto a
+    # dragon surrounded by two of them, and the king may also jump over a
+    # guard onto the empty tile behind him.
+    targets = DRAGON_MOVE_INDICES[tiles]
+    contents = boards[rows, targets]
+    is_valid = contents == EMPTY_CODE
+    if is_king_turn.any():
+        is_surrounded = _count_neighbours(boards, [KING_CODE, GUARD_CODE]) >= 2
+        steps = targets[:, :, :4]
+        is_valid[:, :, :4] |= (contents[:, :, :4] == DRAGON_CODE) & \
+            is_surrounded[rows, steps] & \
+            is_king_turn[:, np.newaxis, np.newaxis]
+        is_valid[:, :, 4:] &= ~is_king_turn[:, np.newaxis, np.newaxis]
+        jumps = JUMP_INDICES[tiles[:, 0]]
+        is_jump = is_king_turn[:, np.newaxis] & \
+            (contents[:, 0, :4] == GUARD_CODE)
+        targets[:, 0, :4] = np.where(is_jump, jumps, steps[:, 0])
+        is_valid[:, 0, :4] = np.where(
+            is_jump, boards[rows[:, :, 0], jumps] == EMPTY_CODE,
+            is_valid[:, 0, :4])
+    is_valid &= movers[:, :, np.newaxis]
+    return targets, is_valid
+
+
+def batch_all_valid_moves(states):
+    """
+    Returns the (<parents>, <from-tiles>, <to-tiles>) arrays of the valid
+    moves of the given states, with the same moves in the same order as
+    all_valid_moves() (see the module docstring). Unlike all_valid_moves(),
+    does not mark the states whose king is captured as won.
+
+    :param states: an (N, STATE_SIZE) uint8 array of compact states
+    :type states: numpy.ndarray
+    :return: the index of the state of each move, and its from-tile and
+        to-tile indices
+    :rtype: (numpy.ndarray, numpy.ndarray, numpy.ndarray)
+    """
+    boards = get_boards(states)
+    targets, is_valid = _get_candidate_moves(states, boards)
+    parents, slots, directions = np.nonzero(is_valid)
+    pieces = states[parents, slots]
+    from_tiles = np.where(slots == 0, pieces >> NUM_META_STATE_BITS,
+                          pieces % DRAGON_BASE).astype(np.uint8)
+    to_tiles = targets[parents, slots, directions].astype(np.uint8)
+    return parents, from_tiles, to_tiles
+
+
+def _convert_surrounded_guards(states):
+    """
+    Converts, in place, every guard of the given states surrounded by at
+    least three dragons to a dragon, until none is left, as move_piece()
+    does. Since a conversion only adds a dragon, the guards converted do not
+    depend on the order of the conversions, so all the guards surrounded at
+    once are converted at once.
+    """
+    rows = np.arange(states.shape[0])
+    while rows.shape[0] > 0:
+        pieces = states[rows, 1:]
+        dragon_counts = _count_neighbours(get_boards(states[rows]),
+                                          [DRAGON_CODE])
+        is_guard = pieces < DEAD
+        guard_tiles = np.where(is_guard, pieces, OFF_BOARD_TILE)
+        is_converted = is_guard & (np.take_along_axis(
+            dragon_counts, guard_tiles.astype(np.intp), axis=1) >= 3)
+        pieces[is_converted] += DRAGON_BASE
+        states[rows, 1:] = pieces
+        rows = rows[is_converted.any(axis=1)]
+
+
+def batch_move_pieces(states, parents, from_tiles, to_tiles):
+    """
+    Returns the (M, STATE_SIZE) uint8 array of the states resulting from the
+    given valid moves, each made from the state with the given index in the
+    given states, with the same rules as move_piece(): the dragon a king or a
+    guard moves onto is captured, the guards surrounded by at least three
+    dragons are converted to dragons, and then it is the other player's turn.
+    The given states are not modified.
+
+    :param states: an (N, STATE_SIZE) uint8 array of compact states
+    :type states: numpy.ndarray
+    :param parents: the index of the state of each move
+    :type parents: numpy.ndarray
+    :param from_tiles: the from-tile index of each move
+    :type from_tiles: numpy.ndarray
+    :param to_tiles: the to-tile index of each move
+    :type to_tiles: numpy.ndarray
+    :return: the states after the moves
+    :rtype: numpy.ndarray
+    """
+    children = states[parents]
+    rows = np.arange(children.shape[0])
+    from_tiles = from_tiles.astype(np.intp)
+    to_tiles = to_tiles.astype(np.intp)
+    pieces = children[:, 1:].astype(np.intp)
+    is_king_move = _get_king_tiles(children) == from_tiles
+
+    # The moving piece is the first live piece on the from-tile, and the
+    # captured dragon, if any, the first live dragon on the to-tile.
+    is_moving = (pieces != DEAD) & \
+        (pieces % DRAGON_BASE == from_tiles[:, np.newaxis])
+    slots = np.argmax(is_moving, axis=1) + 1
+    is_dragon_move = ~is_king_move & \
+        (pieces[rows, slots - 1] >= DRAGON_BASE)
+    is_captured = pieces == to_tiles[:, np.newaxis] + DRAGON_BASE
+    is_capture = ~is_dragon_move & is_captured.any(axis=1)
+    captured_slots = np.argmax(is_captured, axis=1) + 1
+    children[rows[is_capture], captured_slots[is_capture]] = DEAD
+
+    piece_moves = ~is_king_move
+    children[rows[piece_moves], slots[piece_moves]] = np.where(
+        is_dragon_move, to_tiles + DRAGON_BASE, to_tiles)[piece_moves]
+    children[is_king_move, 0] = \
+        (to_tiles[is_king_move] << NUM_META_STATE_BITS) | \
+        (children[is_king_move, 0] & ALL_META_STATE_MASK)
+
+    _convert_surrounded_guards(children)
+    children[:, 0] ^= TURN_MASK
+    return children
+
+
+def batch_successors(states):
+    """
+    Returns the (<parents>, <moves>, <children>) arrays of the successors of
+    the given states, as successors() does for each: the index of the state
+    of each successor, the (<from-tile-index>, <to-tile-index>) move to it
+    (shape (M, 2)), and its compact state.
+
+    :param states: an (N, STATE_SIZE) uint8 array of compact states
+    :type states: numpy.ndarray
+    :return: the parents, moves, and states of the successors
+    :rtype: (numpy.ndarray, numpy.ndarray, numpy.ndarray)
+    """
+    parents, from_tiles, to_tiles = batch_all_valid_moves(states)
+    children = batch_move_pieces(states, parents, from_tiles, to_tiles)
+    return parents, np.stack((from_tiles, to_tiles), axis=1), children
+
+
+def batch_is_terminal(states):
+    """
+    Returns the (<is-terminal>, <utilities>) arrays of the given states, with
+    the same values as is_terminal(): KING_WIN, DRAGON_WIN, or DRAW for the
+    terminal states, and 0 for the others. Unlike is_terminal(), does not
+    mark the states won.
+
+    :param states: an (N, STATE_SIZE) uint8 array of compact states
+    :type states: numpy.ndarray
+    :return: whether each state is terminal, and its utility
+    :rtype: (numpy.ndarray, numpy.ndarray)
+    """
+    boards = get_boards(states)
+    king_tiles = _get_king_tiles(states)
+    is_marked = (states[:, 0] & WIN_MASK) != 0
+    is_king_win = np.where(is_marked, (states[:, 0] & WHO_WON_MASK) != 0,
+                           king_tiles % BOARD_NUM_RANKS == 0)
+    is_dragon_win = ~is_king_win & \
+        (is_marked | _are_kings_captured(boards, king_tiles))
+    is_draw = ~_get_candidate_moves(states, boards)[1].any(axis=(1, 2)) & \
+        ~is_king_win & ~is_dragon_win
+    utilities = np.where(is_king_win, KING_WIN,
+                         np.where(is_dragon_win, DRAGON_WIN, DRAW))
+    return is_king_win | is_dragon_win | is_draw, utilities.astype(np.int64)
+
+
+def batch_perft(state, depth):
+    """
+    Returns the numbers of positions reached from the given state after each
+    number of plies from 1 to the given depth, expanding one ply at a time
+    in one batch. The terminal positions (see batch_is_terminal()) are
+    counted, but not expanded.
+
+    :param state: a compact state representation
+    :type state: array of bytes
+    :param depth: the number of plies
+    :type depth: int
+    :return: the number of positions at each ply
+    :rtype: list(int)
+    """
+    frontier = states_to_array([state])
+    counts = []
+    for _ in range(depth):
+        frontier = frontier[~batch_is_terminal(frontier)[0]]
+        frontier = batch_successors(frontier)[2]
+        counts.append(frontier.shape[0])
+    return counts
+
+
+def _perft(state, expanded_state, counts, ply=0):
+    """
+    Adds to the given counts, from the given ply on, the numbers of positions
+    reached from the given state after each number of plies, expanding one
+    position at a time with successors(), as batch_perft() counts them.
+    """
+    if ply == len(counts) or is_terminal(state, expanded_state)[0]:
+        return
+    new_successors = successors(state, expanded_state)
+    counts[ply] += len(new_successors)
+    for new_state, new_expanded_state, _ in new_successors:
+        _perft(new_state, new_expanded_state, counts, ply + 1)
+
+
+def _test(number_of_states=20000, seed=1, perft_depth=4):
+    """
+    Checks the batch functions against the scalar ones on positions reached
+    by random games, and batch_perft() against successors() from the start
+    of the game, and times both.
+    """
+    import copy
+    import random
+    import time
+    rng = random.Random(seed)
+    states = []
+    while len(states) < number_of_states:
+        state = get_default_game_start()
+        expanded_state = create_expanded_state_representation(state)
+        while not is_terminal(state, expanded_state)[0]:
+            state, expanded_state, _ = rng.choice(
+                successors(state, expanded_state))
+            states.append(state)
+    states = states[:number_of_states]
+    array = states_to_array(states)
+
+    start = time.perf_counter()
+    parents, moves, children = batch_successors(array)
+    is_term, utilities = batch_is_terminal(children)
+    batch_time = time.perf_counter() - start
+    start = time.perf_counter()
+    expected = []
+    for i, state in enumerate(states):
+        state = copy.copy(state)
+        expanded_state = create_expanded_state_representation(state)
+        for new_state, new_expanded_state, move in successors(state,
+                                                              expanded_state):
+            new_state = copy.copy(new_state)
+            expected.append((i, move, new_state.tolist(),
+                             is_terminal(new_state, new_expanded_state)))
+    scalar_time = time.perf_counter() - start
+    actual = [(i, tuple(move), child, (term, utility)) for
+              i, move, child, term, utility in
+              zip(parents.tolist(), moves.tolist(), children.tolist(),
+                  is_term.tolist(), utilities.tolist())]
+    assert actual == expected
+    start_terminal = [is_terminal(copy.copy(state),
+                                  create_expanded_state_representation(state))
+                      for state in states]
+    assert list(zip(*(values.tolist() for values in
+                      batch_is_terminal(array)))) == start_terminal
+    print("batch_successors() and batch_is_terminal() OK:", len(states),
+          "states,", len(expected), "successors,", round(batch_time, 3),
+          "s batched,", round(scalar_time, 3), "s one at a time")
+
+    state = get_default_game_start()
+    start = time.perf_counter()
+    counts = batch_perft(state, perft_depth)
+    batch_time = time.perf_counter() - start
+    start = time.perf_counter()
+    expected = [0] * perft_depth
+    _perft(state, create_expanded_state_representation(state), expected)
+    scalar_time = time.perf_counter() - start
+    assert counts == expected, (counts, expected)
+    print("batch_perft() OK:", counts, round(batch_time, 3), "s batched,",
+          round(scalar_time, 3), "s one at a time")
+
+
+if __name__ == "__main__":
+    _test()
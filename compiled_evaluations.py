@@ -0,0 +1,302 @@
+from evaluations import *
+
+"""
+Evaluation functions defined declaratively, as a weight for each of the
+features of extract_features() (see FEATURES), and compiled into one Python
+function each by compile_evaluation().
+
+The score of such a function is the sum of each feature times its weight.
+The compiled function computes only what its features with a non-zero weight
+need: each intermediate value (a tile mask, a counter of the piece loop, a
+neighbour count mask) is computed once, however many features use it, and
+all the code is inlined, so that evaluating a leaf is one function call.
+"""
+
+"""
+The weights of the evaluation functions compiled at import time, by name.
+'split' has the same scores as split_weight_eval(); 'material' only counts
+the pieces and the progress of the king.
+"""
+EVALUATION_WEIGHTS = {
+    'split': dict(zip(FEATURES, NET_FEATURE_WEIGHTS)),
+    'material': {'guards-alive': 20000, 'dragons-alive': -18000,
+                 'king-progress': 10}
+}
+
+"""
+For each feature, the expression of its value, and the intermediate values
+the expression uses.
+"""
+_FEATURE_EXPRESSIONS = {
+    'king-board-control': ('king_board_control', ('king_board_control',)),
+    'guards-alive': ('guards_alive', ('guards_alive',)),
+    'king-progress': ('KING_PROGRESS[king_tile_idx]', ('king_tile_idx',)),
+    'king-controlled-tiles': ("bin(empty & two_king_units).count('1')",
+                              ('empty', 'king_units_neighbours')),
+    'dragon-board-control': ('dragon_board_control',
+                             ('dragon_board_control',)),
+    'dragons-alive': ('dragons_alive', ('dragons_alive',)),
+    'dragon-controlled-tiles': ("bin(empty & three_dragons).count('1')",
+                                ('empty', 'dragons_neighbours')),
+    'dragons-threatened': ("bin(dragons & two_king_units).count('1')",
+                           ('dragons', 'king_units_neighbours')),
+    'guards-threatened': ('guards_threatened', ('guards_threatened',))
+}
+
+"""
+The counters computed by the loop over the pieces of the state: for each,
+its initial value, and its update for a dragon and for a guard on tile 'num'
+(or None if it does not change), and the values it uses.
+"""
+_PIECE_COUNTERS = {
+    'guards': ('0', None, 'guards |= 1 << num', ()),
+    'dragons': ('0', 'dragons |= 1 << num', None, ()),
+    'guards_alive': ('0', None, 'guards_alive += 1', ()),
+    'dragons_alive': ('0', 'dragons_alive += 1', None, ()),
+    'king_board_control': ('BOARD_CONTROL[king_tile_idx]', None,
+                           'king_board_control += BOARD_CONTROL[num]',
+                           ('king_tile_idx',)),
+    'dragon_board_control': ('0',
+                             'dragon_board_control += BOARD_CONTROL[num]',
+                             None, ())
+}
+
+
+def _neighbour_count_code(mask, two, three=None):
+    """
+    Returns the lines computing the masks of the tiles with at least two and,
+    if 'three' is given, three neighbours in the given mask (see
+    get_neighbour_count_masks()).
+    """
+    lines = [
+        'right = {0} >> {1}'.format(mask, BOARD_NUM_RANKS),
+        'left = ({0} << {1}) & {2}'.format(mask, BOARD_NUM_RANKS,
+                                           ALL_TILES_MASK),
+        'above = ({0} >> 1) & {1}'.format(mask, ~TOP_RANK_MASK),
+        'below = ({0} << 1) & {1}'.format(
+            mask, ~BOTTOM_RANK_MASK & ALL_TILES_MASK),
+        'both_files = right & left',
+        'either_file = right | left',
+        'both_ranks = above & below',
+        'either_rank = above | below',
+        '{0} = both_files | both_ranks | either_file & either_rank'.format(
+            two)]
+    if three is not None:
+        lines.append(
+            '{0} = both_files & either_rank | both_ranks & either_file'.format(
+                three))
+    return lines
+
+
+"""
+The other intermediate values: for each, the lines computing it, and the
+values they use.
+"""
+_VALUES = {
+    'king_tile_idx': (['king_tile_idx = state[0] >> {0}'.format(
+        NUM_META_STATE_BITS)], ()),
+    'king_units': (['king_units = guards | 1 << king_tile_idx'],
+                   ('guards', 'king_tile_idx')),
+    'empty': (['empty = {0} & ~(king_units | dragons)'.format(
+        ALL_TILES_MASK)], ('king_units', 'dragons')),
+    'king_units_neighbours': (
+        _neighbour_count_code('king_units', 'two_king_units'),
+        ('king_units',)),
+    'dragons_neighbours': (
+        _neighbour_count_code('dragons', 'two_dragons', 'three_dragons'),
+        ('dragons',)),
+    'guards_threatened': ([
+        "guards_threatened = bin(guards & three_dragons).count('1')",
+        'candidates = guards & two_dragons & ~three_dragons',
+        'while candidates:',
+        '    lowest_bit = candidates & -candidates',
+        '    candidates ^= lowest_bit',
+        '    guard_idx = lowest_bit.bit_length() - 1',
+        '    seen_dragons = 0',
+        '    second_tiles = 0',
+        '    for neighbour in ORTHOGONAL_TILES_AROUND[guard_idx]:',
+        '        bit = 1 << neighbour',
+        '        if dragons & bit:',
+        '            seen_dragons += 1',
+        '        elif empty & bit or seen_dragons == 2:',
+        '            second_tiles |= SECOND_TILES_MASKS[neighbour]',
+        '    if second_tiles & dragons & ~ORTHOGONAL_MASKS[guard_idx]:',
+        '        guards_threatened += 1'],
+        ('guards', 'dragons', 'empty', 'dragons_neighbours'))
+}
+
+"""
+The names the compiled functions refer to.
+"""
+_NAMESPACE = {
+    'BOARD_CONTROL': tuple(BOARD_CONTROL),
+    'KING_PROGRESS': tuple(get_king_progress(tile_idx) for tile_idx in
+                           range(BOARD_NUM_RANKS * BOARD_NUM_FILES)),
+    'ORTHOGONAL_TILES_AROUND': tuple(ORTHOGONAL_TILES_AROUND),
+    'ORTHOGONAL_MASKS': tuple(ORTHOGONAL_MASKS),
+    'SECOND_TILES_MASKS': tuple(SECOND_TILES_MASKS)
+}
+
+
+def generate_evaluation_source(weights, name):
+    """
+    Returns the source code of an evaluation function with the given name,
+    whose score is the sum of the given weight of each feature times the
+    value of the feature.
+
+    :param weights: the weight of each feature, by name (see FEATURES);
+        missing features have a weight of 0
+    :type weights: dict(string, numeric)
+    :param name: the name of the function
+    :type name: string
+    :return: the source code of the function
+    :rtype: string
+    """
+    for feature in weights:
+        if feature not in _FEATURE_EXPRESSIONS:
+            raise ValueError("unknown feature: " + repr(feature))
+    terms = [(weight, feature) for feature, weight in weights.items()
+             if weight != 0]
+    terms.sort(key=lambda term: FEATURES.index(term[1]))
+
+    # Find every value the terms use. The counters of the piece loop are all
+    # updated by the one loop, which comes after everything they use.
+    needed = set()
+
+    def require(value):
+        if value not in needed:
+            needed.add(value)
+            for dependency in _get_dependencies(value):
+                require(dependency)
+
+    for _, feature in terms:
+        for value in _FEATURE_EXPRESSIONS[feature][1]:
+            require(value)
+    counters = [counter for counter in _PIECE_COUNTERS if counter in needed]
+
+    # Emit the values in an order where each value comes after the values it
+    # uses.
+    lines = []
+    emitted = set()
+
+    def emit(value):
+        if value in _PIECE_COUNTERS:
+            value = 'pieces'
+        if value in emitted:
+            return
+        emitted.add(value)
+        if value == 'pieces':
+            for counter in counters:
+                for dependency in _get_dependencies(counter):
+                    emit(dependency)
+            lines.extend('{0} = {1}'.format(counter,
+                                            _PIECE_COUNTERS[counter][0])
+                         for counter in counters)
+            lines.extend(_piece_loop_code(counters))
+        else:
+            for dependency in _get_dependencies(value):
+                emit(dependency)
+            lines.extend(_VALUES[value][0])
+
+    for _, feature in terms:
+        for value in _FEATURE_EXPRESSIONS[feature][1]:
+            emit(value)
+
+    expression = ' + '.join('{0!r} * {1}'.format(
+        weight, _FEATURE_EXPRESSIONS[feature][0]) for weight, feature in terms)
+    lines.append('return ' + (expression or '0'))
+    return 'def {0}(state, expanded_state):\n'.format(name) + \
+        ''.join('    ' + line + '\n' for line in lines)
+
+
+def _get_dependencies(value):
+    """
+    Returns the values the given intermediate value uses.
+    """
+    if value in _PIECE_COUNTERS:
+        return _PIECE_COUNTERS[value][3]
+    return _VALUES[value][1]
+
+
+def _piece_loop_code(counters):
+    """
+    Returns the lines of the loop over the pieces of the state that updates
+    the given counters.
+    """
+    dragon_updates = [_PIECE_COUNTERS[counter][1] for counter in counters
+                      if _PIECE_COUNTERS[counter][1] is not None]
+    guard_updates = [_PIECE_COUNTERS[counter][2] for counter in counters
+                     if _PIECE_COUNTERS[counter][2] is not None]
+    lines = ['for i in range(1, {0}):'.format(STATE_SIZE),
+             '    num = state[i]',
+             '    if num >= {0}:'.format(DRAGON_BASE)]
+    if any('num' in update for update in dragon_updates):
+        lines.append('        num -= {0}'.format(DRAGON_BASE))
+    if dragon_updates:
+        lines.extend('        ' + update for update in dragon_updates)
+    else:
+        lines.append('        pass')
+    if guard_updates:
+        lines.append('    elif num != {0}:'.format(DEAD))
+        lines.extend('        ' + update for update in guard_updates)
+    return lines
+
+
+def compile_evaluation(weights, name='compiled_eval'):
+    """
+    Returns an evaluation function, taking a state and an expanded state,
+    whose score is the sum of the given weight of each feature times the
+    value of the feature. The source code of the function is in its 'source'
+    attribute.
+
+    :param weights: the weight of each feature, by name (see FEATURES);
+        missing features have a weight of 0
+    :type weights: dict(string, numeric)
+    :param name: the name of the function; defaults to 'compiled_eval'
+    :type name: string
+    :return: the compiled evaluation function
+    :rtype: (array of bytes, dict(byte, char)) => numeric
+    """
+    source = generate_evaluation_source(weights, name)
+    namespace = dict(_NAMESPACE)
+    exec(compile(source, '<' + name + '>', 'exec'), namespace)
+    evaluate = namespace[name]
+    evaluate.source = source
+    return evaluate
+
+
+"""
+The evaluation functions compiled from EVALUATION_WEIGHTS, by name.
+"""
+COMPILED_EVALUATIONS = {
+    name: compile_evaluation(weights, 'compiled_' + name.replace('-', '_') +
+                             '_eval')
+    for name, weights in EVALUATION_WEIGHTS.items()}
+compiled_split_weight_eval = COMPILED_EVALUATIONS['split']
+
+
+def _test():
+    """
+    Prints the source code of the compiled evaluation functions, and checks
+    that the compiled 'split' function has the same scores as
+    split_weight_eval() along random games.
+    """
+    import random
+    for name, evaluate in COMPILED_EVALUATIONS.items():
+        print(evaluate.source)
+    rng = random.Random(1)
+    number_of_states = 0
+    for _ in range(200):
+        state = get_default_game_start()
+        expanded_state = create_expanded_state_representation(state)
+        while not is_terminal(state, expanded_state)[0]:
+            assert compiled_split_weight_eval(state, expanded_state) == \
+                split_weight_eval(state, expanded_state), state
+            number_of_states += 1
+            state, expanded_state, _ = rng.choice(
+                successors(state, expanded_state))
+    print("compiled_split_weight_eval() OK on", number_of_states, "states")
+
+
+if __name__ == "__main__":
+    _test()
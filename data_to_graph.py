@@ -8,7 +8,15 @@ keys_list = ["search","evaluate","max_depth","move_number","player","time",
              "num_usable_hits","num_usable_hits_exact","num_usable_hits_alpha",
              "num_usable_hits_beta","num_usable_hits_pruning",
              "num_move_ordering_alpha_cutoff",
-             "num_move_ordering_beta_cutoff","num_alpha_cutoff","num_beta_cutoff"]
+             "num_move_ordering_beta_cutoff","num_alpha_cutoff",
+             "num_beta_cutoff","table_memory_hits",
+             "table_disk_hits","eval_cache_hits",
+             "eval_cache_misses","table_depth_histogram",
+             "table_exact_fraction","table_alpha_cutoff_fraction",
+             "table_beta_cutoff_fraction","table_hit_rate_by_depth",
+             "table_collision_rate","num_king_races","num_endgame_hits",
+             "num_tablebase_hits","num_playouts","playouts_per_second",
+             "table_bytes_per_entry"]
 import matplotlib.pyplot as plt
 
 
@@ -95,10 +103,9 @@ for f in file:
     if f.isspace():
         break
     line = f.rstrip().split(",")
-    i = 0
-    for key in keys_list:
-        d[key] = line[i]
-        i += 1
+    # The rows recorded before a column was added are shorter.
+    for key, value in zip(keys_list, line):
+        d[key] = value
     data.append(d)
 
 c1 = {
@@ -0,0 +1,145 @@
+from state import *
+
+"""
+Recognizers of endgames: positions with so little material that their result,
+or a bound on it, follows from the rules alone.
+
+The recognizers are registered by material signature, the pair
+(<number-of-live-guards>, <number-of-live-dragons>). Each takes a
+non-terminal state and its expanded state, and returns a
+(<lower-bound>, <upper-bound>, <move>) tuple bounding the utility of the
+position, where <move> is a move reaching the utility when both bounds are
+equal, and may be None otherwise, or returns None if it does not recognize
+the position.
+
+Since a dragon is only captured by a guard and the king or by two guards, and
+the king and the guards are only captured by three dragons, the material of
+an endgame never grows back: a position without dragons stays without
+dragons, and one with at most two dragons can never capture anything.
+"""
+
+"""
+The registered recognizers, by material signature.
+"""
+ENDGAME_RECOGNIZERS = {}
+
+
+def register_recognizer(number_of_guards, number_of_dragons, recognizer):
+    """
+    Registers the given recognizer for the positions with the given numbers
+    of live guards and dragons.
+
+    :param number_of_guards: the number of live guards
+    :type number_of_guards: int
+    :param number_of_dragons: the number of live dragons
+    :type number_of_dragons: int
+    :param recognizer: a function taking a non-terminal state and its
+        expanded state, and returning a (<lower-bound>, <upper-bound>,
+        <move>) tuple, or None
+    :type recognizer: (array of bytes, dict(byte, char)) =>
+        (numeric, numeric, (byte, byte))
+    """
+    ENDGAME_RECOGNIZERS.setdefault((number_of_guards, number_of_dragons),
+                                   []).append(recognizer)
+
+
+def get_material_signature(state):
+    """
+    Returns the (<number-of-live-guards>, <number-of-live-dragons>) pair of
+    the given state, the lengths of get_live_guards_enumeration() and
+    get_live_dragon_enumeration(), counted in one pass over the state.
+
+    :param state: a compact state representation
+    :type state: array of bytes
+    :return: the material signature of the state
+    :rtype: (int, int)
+    """
+    number_of_guards = number_of_dragons = 0
+    for i in range(1, STATE_SIZE):
+        num = state[i]
+        if num >= DRAGON_BASE:
+            number_of_dragons += 1
+        elif num != DEAD:
+            number_of_guards += 1
+    return number_of_guards, number_of_dragons
+
+
+def recognize_endgame(state, expanded_state):
+    """
+    Returns the tightest (<lower-bound>, <upper-bound>, <move>) tuple given
+    by the recognizers registered for the material of the given non-terminal
+    state, or None if none of them recognizes it.
+
+    :param state: a compact state representation
+    :type state: array of bytes
+    :param expanded_state: the expanded representation of the state
+    :type expanded_state: dict(byte, char)
+    :return: the bounds of the utility of the state, and a move reaching it
+        if the bounds are equal, or None
+    :rtype: (numeric, numeric, (byte, byte))
+    """
+    recognizers = ENDGAME_RECOGNIZERS.get(get_material_signature(state))
+    if recognizers is None:
+        return None
+    result = None
+    for recognizer in recognizers:
+        bounds = recognizer(state, expanded_state)
+        if bounds is None:
+            continue
+        if result is None:
+            result = bounds
+        else:
+            lower = max(result[0], bounds[0])
+            upper = min(result[1], bounds[1])
+            result = lower, upper, result[2] or bounds[2]
+        if result[0] == result[1]:
+            break
+    return result
+
+
+def recognize_no_dragons(state, expanded_state):
+    """
+    Recognizes the positions without dragons, where it must be the king
+    player's turn: the king wins if he can reach the first rank right away,
+    and otherwise the game is a draw, since the dragon player will then have
+    no moves.
+
+    :param state: a compact state representation
+    :type state: array of bytes
+    :param expanded_state: the expanded representation of the state
+    :type expanded_state: dict(byte, char)
+    :return: the exact utility of the state, and a move reaching it
+    :rtype: (numeric, numeric, (byte, byte))
+    """
+    if player_turn(state) != KING_PLAYER:
+        return DRAW, DRAW, None
+    king_tile_idx = get_king_tile_index(state)
+    moves = all_valid_moves(state, expanded_state)
+    for move in moves:
+        if move[0] == king_tile_idx and move[1] % BOARD_NUM_RANKS == 0:
+            return KING_WIN, KING_WIN, move
+    return DRAW, DRAW, moves[0]
+
+
+def recognize_few_dragons(state, expanded_state):
+    """
+    Recognizes the positions with at most two dragons, where neither the
+    king nor a guard can ever be captured, so that the dragon player cannot
+    win: the utility is at least a draw.
+
+    :param state: a compact state representation
+    :type state: array of bytes
+    :param expanded_state: the expanded representation of the state
+    :type expanded_state: dict(byte, char)
+    :return: the bounds of the utility of the state
+    :rtype: (numeric, numeric, (byte, byte))
+    """
+    return DRAW, KING_WIN, None
+
+
+for _number_of_guards in range(STATE_SIZE):
+    register_recognizer(_number_of_guards, 0, recognize_no_dragons)
+    for _number_of_dragons in (1, 2):
+        if _number_of_guards + _number_of_dragons < STATE_SIZE:
+            register_recognizer(_number_of_guards, _number_of_dragons,
+                                recognize_few_dragons)
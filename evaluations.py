@@ -1,4 +1,5 @@
 from state import *
+from ThreatMap import *
 
 """
 An array wherein the numbers correspond to the value of the tile
@@ -63,8 +64,14 @@ def split_weight_eval(state, expanded_state):
     :return: a heuristic estimate of the utility value of the given state
     :rtyep: a numeric value   
     """
-    return get_king_features(state, expanded_state) - \
-        get_dragon_features(state, expanded_state)
+    features = extract_features(state, expanded_state)
+    king_score = 0
+    dragon_score = 0
+    for feature, king_weight, dragon_weight in \
+            zip(features, KING_FEATURE_WEIGHTS, DRAGON_FEATURE_WEIGHTS):
+        king_score += king_weight * feature
+        dragon_score += dragon_weight * feature
+    return king_score - dragon_score
 
 
 def get_king_features(state, expanded_state):
@@ -246,57 +253,56 @@ def get_king_progress(king_tile_idx):
     return val ** 6
 
 
+def _get_expanded_occupancy_masks(expanded_state):
+    """
+    Returns a (<king-player-mask>, <dragons-mask>) pair of the tile masks of
+    the tiles holding the king or a guard, and a dragon in the given expanded
+    state.
+    """
+    king_units = dragons = 0
+    for tile_idx in range(BOARD_NUM_RANKS * BOARD_NUM_FILES):
+        content = expanded_state[tile_idx]
+        if content == DRAGON:
+            dragons |= 1 << tile_idx
+        elif content != EMPTY:
+            king_units |= 1 << tile_idx
+    return king_units, dragons
+
+
 def get_king_controlled_tiles(expanded_state):
     """
-    Returns the number of tiles controlled by the king player.
+    Returns the number of tiles controlled by the king player: the empty
+    tiles with at least two neighbours holding the king or a guard.
 
     :param expanded_state: the expanded representation of the state
     :type expanded_state: dict(byte, char)
     :return: the number of tiles controlled by the king player
     :rtype: int
     """
-    controlled_tiles = 0
-    for tile in range(BOARD_NUM_RANKS * BOARD_NUM_FILES):
-        content = expanded_state[tile]
-        if content == EMPTY:
-            neighbours = get_orthogonal_tiles_around(tile)
-            surrounding_p1_units = 0
-            for tile_number in neighbours:
-                neighbour_content = expanded_state[tile_number]
-                if neighbour_content == GUARD or neighbour_content == KING:
-                    surrounding_p1_units += 1
-            if surrounding_p1_units >= 2:
-                controlled_tiles += 1
-    return controlled_tiles
+    king_units, dragons = _get_expanded_occupancy_masks(expanded_state)
+    empty = ALL_TILES_MASK & ~(king_units | dragons)
+    return popcount(empty & get_neighbour_count_masks(king_units)[0])
 
 
 def get_dragon_controlled_tiles(expanded_state):
     """
-    Returns the number of tiles controlled by the dragon player.
+    Returns the number of tiles controlled by the dragon player: the empty
+    tiles with at least three dragon neighbours.
 
     :param expanded_state: the expanded representation of the state
     :type expanded_state: dict(byte, char)
     :return: the number of tiles controlled by the dragon player
     :rtype: int
     """
-    controlled_tiles = 0
-    for tile in range(BOARD_NUM_RANKS * BOARD_NUM_FILES):
-        content = expanded_state[tile]
-        if content == EMPTY:
-            neighbours = get_orthogonal_tiles_around(tile)
-            surrounding_p2_units = 0
-            for tile_number in neighbours:
-                neighbour_content = expanded_state[tile_number]
-                if neighbour_content == DRAGON:
-                    surrounding_p2_units += 1
-            if surrounding_p2_units >= 3:
-                controlled_tiles += 1
-    return controlled_tiles
+    king_units, dragons = _get_expanded_occupancy_masks(expanded_state)
+    empty = ALL_TILES_MASK & ~(king_units | dragons)
+    return popcount(empty & get_neighbour_count_masks(dragons)[1])
 
 
 def get_dragon_threatened(state, expanded_state):
     """
-    Returns the number of DRAGONS threatened to be captured by the king player.
+    Returns the number of DRAGONS threatened to be captured by the king player:
+    the dragons with at least two neighbours holding the king or a guard.
 
     :param state: the current node in the search
     :type state: array of bytes
@@ -305,23 +311,14 @@ def get_dragon_threatened(state, expanded_state):
     :return: the number of DRAGONS threatened to be captured by the king player
     :rtype: int
     """
-    count_threatened_tiles = 0
-    dragon_positions = get_live_dragon_enumeration(state)
-    for _, dragon in dragon_positions:
-        threats = 0
-        neighbour_tiles = get_orthogonal_tiles_around(dragon-DRAGON_BASE)
-        for neighbour in neighbour_tiles:
-            content = expanded_state[neighbour]
-            if content == GUARD or content == KING:
-                threats += 1
-        if threats >= 2:
-            count_threatened_tiles += 1
-    return count_threatened_tiles
+    return get_threat_map(state, expanded_state).get_dragons_threatened()
 
 
 def get_guard_threatened(state, expanded_state):
     """
-    Returns the number of GUARDS threatened to be captured by the dragon player.
+    Returns the number of GUARDS threatened to be captured by the dragon
+    player: the guards with at least three dragon neighbours, or with two and
+    a third dragon that could move next to them (see _is_guard_threatened()).
 
     :param state: the current node in the search
     :type state: array of bytes
@@ -330,42 +327,425 @@ def get_guard_threatened(state, expanded_state):
     :return: the number of GUARDS threatened to be captured by the dragon player
     :rtype: int
     """
-    count_threatened_tiles = 0
-    guard_positions = get_live_guards_enumeration(state)
-    for _, guard in guard_positions:
-        threats = 0
-        used_positions = []
-        guard_neighbours = get_orthogonal_tiles_around(guard)
-        # Examine all direct neighbour of this guard.
-        for neighbour in guard_neighbours:
-            content = expanded_state[neighbour]
-            if content == DRAGON:
-                threats += 1
-                used_positions.append(neighbour)
-            elif content == KING or content == GUARD:
-                used_positions.append(neighbour)
-            # If there are exactly 2 threats, we need to consider if a third
-            # dragon could move into the spot on the next turn.  If there are
-            # fewer than 2 dragons, there is no way this guard could be
-            # captured in the next turn, so move on to the next guard.
-            if threats == 2:
-                unoccupied_neighbours = \
-                        [i for i in guard_neighbours if i not in used_positions]
-                for unoccupied_tile in unoccupied_neighbours:
-                    second_neighbours = \
-                            get_orthogonal_tiles_around(unoccupied_tile)
-                    second_neighbours.extend(
-                            get_diagonal_tiles_around(unoccupied_tile))
-                    for n in second_neighbours:
-                        content = expanded_state[n]
-                        # Increase the threat if there is a dragon on one
-                        # of the neighbouring tiles, but only if the tile
-                        # of interest is not on which has already been seen.
-                        if n not in used_positions and content == DRAGON:
-                            threats += 1
-        if threats >= 3:
-            count_threatened_tiles += 1
-    return count_threatened_tiles
+    return get_threat_map(state, expanded_state).get_guards_threatened()
+
+
+"""
+The features returned by extract_features(), in order, and their weights in
+the king and dragon sums of split_weight_eval(), which are the same as in
+get_king_features() and get_dragon_features().
+"""
+FEATURES = ('king-board-control', 'guards-alive', 'king-progress',
+            'king-controlled-tiles', 'dragon-board-control', 'dragons-alive',
+            'dragon-controlled-tiles', 'dragons-threatened',
+            'guards-threatened')
+KING_FEATURE_WEIGHTS = (500, 20000, 10, 500, 0, 0, 0, 750, -100)
+DRAGON_FEATURE_WEIGHTS = (0, 0, 0, 0, 1000, 18000, 25, -5000, 12000)
+
+SECOND_TILES_AROUND = [tuple(get_orthogonal_tiles_around(tile_idx) +
+                             get_diagonal_tiles_around(tile_idx))
+                       for tile_idx in
+                       range(BOARD_NUM_RANKS * BOARD_NUM_FILES)]
+
+
+def _is_guard_threatened(expanded_state, guard_idx):
+    """
+    Returns True iff get_guard_threatened() counts the guard at the given tile
+    as threatened: the guard has at least 3 dragon neighbours, or exactly 2,
+    and a third dragon is a (orthogonal or diagonal) neighbour of a tile that
+    get_guard_threatened() examines as unoccupied, which is any empty
+    neighbour of the guard, or any neighbour holding the king or a guard that
+    comes after the second dragon in the order of
+    get_orthogonal_tiles_around().
+
+    :param expanded_state: the expanded representation of the state
+    :type expanded_state: dict(byte, char)
+    :param guard_idx: the tile index (0-24) of a guard
+    :type guard_idx: byte
+    :return: True iff the guard is threatened
+    :rtype: bool
+    """
+    neighbours = ORTHOGONAL_TILES_AROUND[guard_idx]
+    dragons = 0
+    unoccupied_neighbours = []
+    for neighbour in neighbours:
+        content = expanded_state[neighbour]
+        if content == DRAGON:
+            dragons += 1
+        elif content == EMPTY or dragons == 2:
+            unoccupied_neighbours.append(neighbour)
+    if dragons != 2:
+        return dragons > 2
+    for unoccupied_tile in unoccupied_neighbours:
+        for tile_idx in SECOND_TILES_AROUND[unoccupied_tile]:
+            if expanded_state[tile_idx] == DRAGON and \
+                    tile_idx not in neighbours:
+                return True
+    return False
+
+
+def extract_features(state, expanded_state):
+    """
+    Returns the features used by split_weight_eval() as a tuple ordered as
+    FEATURES, reading the masks and threats of the ThreatMap of the given
+    state (see get_threat_map()). Each feature has the same value as the
+    function computing it on its own:
+        get_board_control_king()
+        len(get_live_guards_enumeration())
+        get_king_progress()
+        get_king_controlled_tiles()
+        get_board_control_dragon()
+        len(get_live_dragon_enumeration())
+        get_dragon_controlled_tiles()
+        get_dragon_threatened()
+        get_guard_threatened()
+
+    :param state: the current state for evaluation
+    :type state: array of bytes
+    :param expanded_state: the expanded representation of the state
+    :type expanded_state: dict(byte,char)
+    :return: the features of the given state
+    :rtype: tuple(int)
+    """
+    threat_map = get_threat_map(state, expanded_state)
+    _, _, _, empty = threat_map.get_occupancy_masks()
+    two_king_units, _, three_dragons = threat_map.get_neighbour_count_masks()
+    king_tile_idx = get_king_tile_index(state)
+    king_board_control = BOARD_CONTROL[king_tile_idx]
+    dragon_board_control = 0
+    guards_alive = dragons_alive = 0
+    for i in range(1, STATE_SIZE):
+        num = state[i]
+        if num >= DRAGON_BASE:
+            dragons_alive += 1
+            dragon_board_control += BOARD_CONTROL[num - DRAGON_BASE]
+        elif num != DEAD:
+            guards_alive += 1
+            king_board_control += BOARD_CONTROL[num]
+    return (king_board_control, guards_alive, get_king_progress(king_tile_idx),
+            popcount(empty & two_king_units), dragon_board_control,
+            dragons_alive, popcount(empty & three_dragons),
+            threat_map.get_dragons_threatened(),
+            threat_map.get_guards_threatened())
+
+
+"""
+For each tile, the mask (one bit per tile index) of the tiles whose
+king-controlled-tiles, dragon-controlled-tiles and dragons-threatened terms
+depend on the content of the tile: the tile itself and its orthogonal
+neighbours.
+"""
+NEIGHBOURHOOD_MASK_OF = [
+    sum(1 << neighbour
+        for neighbour in (tile_idx,) + ORTHOGONAL_TILES_AROUND[tile_idx])
+    for tile_idx in range(BOARD_NUM_RANKS * BOARD_NUM_FILES)]
+
+
+def _get_guard_threat_neighbourhood_mask(tile_idx):
+    """
+    Returns the mask of the tiles where the guards-threatened term of a guard
+    depends on the content of the given tile, as seen by
+    _is_guard_threatened(): the tiles of which the given tile is itself, a
+    neighbour, or a second tile around a neighbour.
+    """
+    mask = 0
+    for guard_idx in range(BOARD_NUM_RANKS * BOARD_NUM_FILES):
+        depends_on = {guard_idx}
+        for neighbour in ORTHOGONAL_TILES_AROUND[guard_idx]:
+            depends_on.add(neighbour)
+            depends_on.update(SECOND_TILES_AROUND[neighbour])
+        if tile_idx in depends_on:
+            mask |= 1 << guard_idx
+    return mask
+
+
+GUARD_THREAT_MASK_OF = [_get_guard_threat_neighbourhood_mask(tile_idx)
+                        for tile_idx in
+                        range(BOARD_NUM_RANKS * BOARD_NUM_FILES)]
+
+
+class IncrementalExpandedState(dict):
+    """
+    An expanded state that keeps the features of extract_features() up to
+    date as its tiles change, so that evaluating it does not look at the whole
+    board.
+
+    The material, board control and king progress terms are updated whenever
+    a tile is set, which covers every move, capture and cascaded guard
+    conversion made by move_piece(). The terms that depend on the
+    neighbourhood of a tile (controlled tiles and threatened pieces) are kept
+    as masks of the tiles they count, and only the tiles around the tiles that
+    changed since the last call to get_features() are recomputed.
+
+    Use set_expanded_state_type(IncrementalExpandedState) to have
+    create_expanded_state_representation() create these, and
+    incremental_split_weight_eval() to evaluate them.
+    """
+
+    def __init__(self, representation):
+        """
+        Creates a new IncrementalExpandedState with the same tiles as the
+        given expanded state.
+
+        :param representation: an expanded state representation
+        :type representation: dict(byte, char)
+        """
+        dict.__init__(self, representation)
+        self._features = [0] * len(FEATURES)
+        self._guards = 0
+        self._king_controlled = self._dragon_controlled = 0
+        self._dragons_threatened = self._guards_threatened = 0
+        self._changed = ALL_TILES_MASK
+        for tile_idx in range(BOARD_NUM_RANKS * BOARD_NUM_FILES):
+            if self[tile_idx] != EMPTY:
+                self._count_piece(tile_idx, self[tile_idx], 1)
+
+    def __setitem__(self, tile_idx, content):
+        """
+        Sets the content of the given tile, updating the material, board
+        control and king progress terms, and remembering that the tile
+        changed.
+
+        :param tile_idx: a tile index (0-24)
+        :type tile_idx: byte
+        :param content: one of KING, GUARD, DRAGON, or EMPTY
+        :type content: char
+        """
+        previous_content = self[tile_idx]
+        if previous_content != content:
+            dict.__setitem__(self, tile_idx, content)
+            if previous_content != EMPTY:
+                self._count_piece(tile_idx, previous_content, -1)
+            if content != EMPTY:
+                self._count_piece(tile_idx, content, 1)
+            self._changed |= 1 << tile_idx
+
+    def _count_piece(self, tile_idx, content, sign):
+        """
+        Adds (if sign is 1) or removes (if sign is -1) the material and board
+        control of the given piece on the given tile, and sets the king
+        progress if the king is added.
+        """
+        features = self._features
+        if content == DRAGON:
+            features[4] += sign * BOARD_CONTROL[tile_idx]
+            features[5] += sign
+        elif content == GUARD:
+            features[0] += sign * BOARD_CONTROL[tile_idx]
+            features[1] += sign
+            self._guards ^= 1 << tile_idx
+        else:
+            features[0] += sign * BOARD_CONTROL[tile_idx]
+            features[2] = get_king_progress(tile_idx) if sign > 0 else 0
+
+    def _update_neighbourhood_terms(self):
+        """
+        Recomputes the controlled-tiles and threatened-pieces terms of the
+        tiles around the tiles that changed, and forgets the changes.
+        """
+        near_tiles = guard_tiles = 0
+        changed = self._changed
+        while changed:
+            lowest_bit = changed & -changed
+            tile_idx = lowest_bit.bit_length() - 1
+            near_tiles |= NEIGHBOURHOOD_MASK_OF[tile_idx]
+            guard_tiles |= GUARD_THREAT_MASK_OF[tile_idx]
+            changed ^= lowest_bit
+        self._changed = 0
+
+        king_controlled = self._king_controlled & ~near_tiles
+        dragon_controlled = self._dragon_controlled & ~near_tiles
+        dragons_threatened = self._dragons_threatened & ~near_tiles
+        while near_tiles:
+            lowest_bit = near_tiles & -near_tiles
+            tile_idx = lowest_bit.bit_length() - 1
+            near_tiles ^= lowest_bit
+            content = self[tile_idx]
+            if content == EMPTY:
+                king_units = dragon_units = 0
+                for neighbour in ORTHOGONAL_TILES_AROUND[tile_idx]:
+                    neighbour_content = self[neighbour]
+                    if neighbour_content == DRAGON:
+                        dragon_units += 1
+                    elif neighbour_content != EMPTY:
+                        king_units += 1
+                if king_units >= 2:
+                    king_controlled |= lowest_bit
+                if dragon_units >= 3:
+                    dragon_controlled |= lowest_bit
+            elif content == DRAGON:
+                king_units = 0
+                for neighbour in ORTHOGONAL_TILES_AROUND[tile_idx]:
+                    neighbour_content = self[neighbour]
+                    if neighbour_content == GUARD or neighbour_content == KING:
+                        king_units += 1
+                if king_units >= 2:
+                    dragons_threatened |= lowest_bit
+
+        guards_threatened = self._guards_threatened & ~guard_tiles
+        guard_tiles &= self._guards
+        while guard_tiles:
+            lowest_bit = guard_tiles & -guard_tiles
+            guard_tiles ^= lowest_bit
+            if _is_guard_threatened(self, lowest_bit.bit_length() - 1):
+                guards_threatened |= lowest_bit
+
+        self._king_controlled = king_controlled
+        self._dragon_controlled = dragon_controlled
+        self._dragons_threatened = dragons_threatened
+        self._guards_threatened = guards_threatened
+        features = self._features
+        features[3] = popcount(king_controlled)
+        features[6] = popcount(dragon_controlled)
+        features[7] = popcount(dragons_threatened)
+        features[8] = popcount(guards_threatened)
+
+    def get_features(self):
+        """
+        Returns the features of this expanded state, with the same values as
+        extract_features() returns for it.
+
+        :return: the features of this expanded state, ordered as FEATURES
+        :rtype: tuple(int)
+        """
+        if self._changed:
+            self._update_neighbourhood_terms()
+        return tuple(self._features)
+
+    def copy(self):
+        """
+        Returns a copy of this IncrementalExpandedState, with its own terms,
+        bringing the terms of this one up to date first.
+
+        :return: a copy of this IncrementalExpandedState
+        :rtype: IncrementalExpandedState
+        """
+        if self._changed:  # So that the copy only tracks its own changes.
+            self._update_neighbourhood_terms()
+        duplicate = IncrementalExpandedState.__new__(IncrementalExpandedState)
+        dict.update(duplicate, self)
+        duplicate.__dict__.update(self.__dict__)
+        duplicate._features = self._features[:]
+        return duplicate
+
+    def __copy__(self):
+        return self.copy()
+
+    def __deepcopy__(self, memo):
+        return self.copy()
+
+    def __reduce__(self):
+        return IncrementalExpandedState, (dict(self),)
+
+
+def incremental_split_weight_eval(state, expanded_state):
+    """
+    Returns the same score as split_weight_eval(), reading the features kept
+    by the given expanded state if it is an IncrementalExpandedState.
+
+    :param state: the current state for evaluation
+    :type state: array of bytes
+    :param expanded_state: the expanded representation of the state
+    :type expanded_state: dict(byte,char)
+    :return: a heuristic estimate of the utility value of the given state
+    :rtype: numeric
+    """
+    if not isinstance(expanded_state, IncrementalExpandedState):
+        return split_weight_eval(state, expanded_state)
+    features = expanded_state.get_features()
+    king_score = 0
+    dragon_score = 0
+    for feature, king_weight, dragon_weight in \
+            zip(features, KING_FEATURE_WEIGHTS, DRAGON_FEATURE_WEIGHTS):
+        king_score += king_weight * feature
+        dragon_score += dragon_weight * feature
+    return king_score - dragon_score
+
+
+"""
+The weights of the features in the score of split_weight_eval(), which is the
+king sum minus the dragon sum.
+"""
+NET_FEATURE_WEIGHTS = tuple(king_weight - dragon_weight
+                            for king_weight, dragon_weight in
+                            zip(KING_FEATURE_WEIGHTS, DRAGON_FEATURE_WEIGHTS))
+
+
+def lazy_split_weight_eval(state, expanded_state, alpha=DRAGON_WIN,
+                           beta=KING_WIN):
+    """
+    Returns the same score as split_weight_eval() if it is inside the given
+    (alpha, beta) window, or else possibly a bound on the score that is
+    already outside the window.
+
+    The evaluation is done in two stages. The first stage computes the
+    material, board control and king progress terms from the compact state
+    only, and bounds the remaining terms (controlled tiles and threatened
+    pieces) by the number of empty tiles and of live pieces. If even the
+    highest possible score is at most alpha, it is returned (the true score
+    is no higher); if even the lowest possible score is at least beta, it is
+    returned (the true score is no lower). Only otherwise does the second
+    stage compute the remaining terms from the ThreatMap of the state.
+
+    A search passes its window to this function because its 'uses_window'
+    attribute is True.
+
+    :param state: the current state for evaluation
+    :type state: array of bytes
+    :param expanded_state: the expanded representation of the state
+    :type expanded_state: dict(byte,char)
+    :param alpha: the utility of the best move found so far for the king
+        player; defaults to DRAGON_WIN
+    :type alpha: numeric
+    :param beta: the utility of the best move found so far for the dragon
+        player; defaults to KING_WIN
+    :type beta: numeric
+    :return: the score of split_weight_eval(), or a bound outside the window
+    :rtype: numeric
+    """
+    king_tile_idx = get_king_tile_index(state)
+    king_board_control = BOARD_CONTROL[king_tile_idx]
+    dragon_board_control = 0
+    guards_alive = dragons_alive = 0
+    for i in range(1, STATE_SIZE):
+        num = state[i]
+        if num >= DRAGON_BASE:
+            dragons_alive += 1
+            dragon_board_control += BOARD_CONTROL[num - DRAGON_BASE]
+        elif num != DEAD:
+            guards_alive += 1
+            king_board_control += BOARD_CONTROL[num]
+    weights = NET_FEATURE_WEIGHTS
+    score = (weights[0] * king_board_control + weights[1] * guards_alive +
+             weights[2] * get_king_progress(king_tile_idx) +
+             weights[4] * dragon_board_control + weights[5] * dragons_alive)
+
+    # Each remaining feature is between 0 and its bound.
+    empty_tiles = BOARD_NUM_RANKS * BOARD_NUM_FILES - 1 - guards_alive - \
+        dragons_alive
+    highest = lowest = score
+    for weight, bound in ((weights[3], empty_tiles), (weights[6], empty_tiles),
+                          (weights[7], dragons_alive),
+                          (weights[8], guards_alive)):
+        if weight > 0:
+            highest += weight * bound
+        else:
+            lowest += weight * bound
+    if highest <= alpha:
+        return highest
+    if lowest >= beta:
+        return lowest
+
+    threat_map = get_threat_map(state, expanded_state)
+    _, _, _, empty = threat_map.get_occupancy_masks()
+    two_king_units, _, three_dragons = threat_map.get_neighbour_count_masks()
+    return (score + weights[3] * popcount(empty & two_king_units) +
+            weights[6] * popcount(empty & three_dragons) +
+            weights[7] * threat_map.get_dragons_threatened() +
+            weights[8] * threat_map.get_guards_threatened())
+
+
+lazy_split_weight_eval.uses_window = True
 
 
 def _test():
@@ -396,6 +776,13 @@ def _test():
           simple_eval(state, expanded_state))
     print("value of split_weight_eval() on initial game state:",
           split_weight_eval(state, expanded_state))
+    print("features of the initial game state:",
+          dict(zip(FEATURES, extract_features(state, expanded_state))))
+    print("value of incremental_split_weight_eval() on initial game state:",
+          incremental_split_weight_eval(
+              state, IncrementalExpandedState(expanded_state)))
+    print("value of lazy_split_weight_eval() on initial game state:",
+          lazy_split_weight_eval(state, expanded_state))
 
 if __name__ == "__main__":
     # If the code in _test() was directly here, it causes variable name
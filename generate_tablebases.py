@@ -0,0 +1,233 @@
+import numpy as np
+from Tablebase import *
+from multiprocessing import Pool
+import argparse
+import time
+
+"""
+Generates the endgame tablebases read by Tablebase.py, by retrograde
+analysis.
+
+The positions of a material signature are expanded in parallel by a process
+pool, a chunk of indices per task, with the rules of successors() and
+is_terminal(). A successor with less material, or with a guard converted to
+a dragon, belongs to another tablebase, which must have been generated
+before, so generate_tablebases() goes through the signatures by increasing
+number of pieces, and then by increasing number of guards.
+
+The expanded positions are then solved with NumPy, one ply at a time: at
+ply n, a position is won by the player to move if one of its successors
+whose result is known from an earlier ply is won by him, and lost if all of
+its successors are known to be won by the other player. The positions still
+unknown when a ply decides nothing more are draws.
+"""
+
+DEFAULT_CHUNK_SIZE = 2 ** 14
+UNKNOWN = 0xFF
+
+"""
+The tablebases opened by each worker process, to probe the successors with
+another material signature.
+"""
+_worker_tablebases = None
+
+
+def _init_worker(directory):
+    """
+    Opens the tablebases of the given directory in a worker process.
+    """
+    global _worker_tablebases
+    _worker_tablebases = open_tablebases(directory)
+
+
+def _expand_chunk(args):
+    """
+    Expands the positions of the given material whose indices are in the
+    given range, and returns a (<terminal>, <child-counts>, <children>,
+    <child-wdl>, <child-distances>) tuple of arrays: for each index, its
+    result if it is terminal, or UNKNOWN, and its number of successors, and
+    for each successor, its index if it has the same material, or else -1
+    and its result and distance.
+    """
+    number_of_guards, number_of_dragons, start, stop = args
+    material = number_of_guards, number_of_dragons
+    terminal = np.full(stop - start, UNKNOWN, dtype=np.uint8)
+    child_counts = np.zeros(stop - start, dtype=np.int32)
+    children = []
+    child_wdl = []
+    child_distances = []
+    for index in range(start, stop):
+        state = unrank_position(number_of_guards, number_of_dragons, index)
+        expanded_state = create_expanded_state_representation(state)
+        is_term, utility = is_terminal(state, expanded_state)
+        if is_term:
+            terminal[index - start] = WDL_KING_WIN if utility == KING_WIN \
+                else WDL_DRAGON_WIN if utility == DRAGON_WIN else WDL_DRAW
+            continue
+        new_successors = successors(state, expanded_state)
+        child_counts[index - start] = len(new_successors)
+        for new_state, _, _ in new_successors:
+            new_material, new_index = rank_position(new_state)
+            if new_material == material:
+                children.append(new_index)
+                child_wdl.append(UNKNOWN)
+                child_distances.append(0)
+                continue
+            tablebase = _worker_tablebases.get(new_material)
+            if tablebase is None:
+                raise ValueError("missing tablebase for {0} guards and {1} "
+                                 "dragons".format(*new_material))
+            children.append(-1)
+            wdl, distance = tablebase.probe_index(new_index)
+            child_wdl.append(wdl)
+            child_distances.append(distance)
+    return terminal, child_counts, np.array(children, dtype=np.int64), \
+        np.array(child_wdl, dtype=np.uint8), \
+        np.array(child_distances, dtype=np.int32)
+
+
+def solve(terminal, child_counts, children, child_wdl, child_distances):
+    """
+    Returns the (<wdl>, <distances>) uint8 arrays of the results of the
+    positions expanded by _expand_chunk() (concatenated over all indices).
+
+    :return: the result and the distance of each index
+    :rtype: (numpy.ndarray, numpy.ndarray)
+    """
+    number_of_positions = terminal.shape[0]
+    wdl = terminal.copy()
+    distances = np.zeros(number_of_positions, dtype=np.int32)
+    unknown_distance = np.iinfo(np.int32).max
+    distances[terminal == UNKNOWN] = unknown_distance
+
+    # The positions to solve, their successors, and whose turn it is.
+    nodes = np.nonzero(terminal == UNKNOWN)[0]
+    counts = child_counts[nodes]
+    # A non-terminal position always has a successor, so no segment of
+    # np.add.reduceat() below is empty.
+    assert (counts > 0).all()
+    offsets = np.concatenate(([0], np.cumsum(counts)[:-1]))
+    # The positions where it is the king player's turn are the second half.
+    is_king_turn = nodes >= number_of_positions // 2
+    is_internal = children >= 0
+    internal_children = np.where(is_internal, children, 0)
+
+    ply = 0
+    while nodes.shape[0] > 0:
+        ply += 1
+        # The results of the successors known before this ply.
+        successor_distances = np.where(is_internal,
+                                       distances[internal_children],
+                                       child_distances)
+        successor_wdl = np.where(is_internal, wdl[internal_children],
+                                 child_wdl)
+        successor_wdl[successor_distances >= ply] = UNKNOWN
+        king_wins = np.add.reduceat(successor_wdl == WDL_KING_WIN, offsets)
+        dragon_wins = np.add.reduceat(successor_wdl == WDL_DRAGON_WIN,
+                                      offsets)
+        unsolved = distances[nodes] == unknown_distance
+        new_king_wins = unsolved & np.where(is_king_turn, king_wins > 0,
+                                            king_wins == counts)
+        new_dragon_wins = unsolved & np.where(is_king_turn,
+                                              dragon_wins == counts,
+                                              dragon_wins > 0)
+        if not (new_king_wins.any() or new_dragon_wins.any()):
+            break
+        if ply > MAX_DISTANCE:
+            raise ValueError("distance over " + str(MAX_DISTANCE))
+        wdl[nodes[new_king_wins]] = WDL_KING_WIN
+        wdl[nodes[new_dragon_wins]] = WDL_DRAGON_WIN
+        distances[nodes[new_king_wins | new_dragon_wins]] = ply
+    draws = distances == unknown_distance
+    wdl[draws] = WDL_DRAW
+    distances[draws] = 0
+    return wdl, distances.astype(np.uint8)
+
+
+def generate_tablebase(number_of_guards, number_of_dragons, directory,
+                       processes=None, chunk_size=DEFAULT_CHUNK_SIZE):
+    """
+    Generates the tablebase of the given material in the given directory,
+    where the tablebases of the material it can lead to must already be.
+
+    :param number_of_guards: the number of live guards
+    :type number_of_guards: int
+    :param number_of_dragons: the number of live dragons
+    :type number_of_dragons: int
+    :param directory: the directory of the tablebases
+    :type directory: string
+    :param processes: the number of worker processes; defaults to the number
+        of CPUs
+    :type processes: int
+    :param chunk_size: the number of indices per task; defaults to
+        DEFAULT_CHUNK_SIZE
+    :type chunk_size: int
+    :return: the name of the tablebase file
+    :rtype: string
+    """
+    number_of_positions = get_number_of_positions(number_of_guards,
+                                                  number_of_dragons)
+    tasks = [(number_of_guards, number_of_dragons, start,
+              min(start + chunk_size, number_of_positions))
+             for start in range(0, number_of_positions, chunk_size)]
+    with Pool(processes, _init_worker, (directory,)) as pool:
+        chunks = pool.map(_expand_chunk, tasks)
+    terminal, child_counts, children, child_wdl, child_distances = \
+        (np.concatenate(arrays) for arrays in zip(*chunks))
+    wdl, distances = solve(terminal, child_counts, children, child_wdl,
+                           child_distances)
+    filename = tablebase_filename(directory, number_of_guards,
+                                  number_of_dragons)
+    write_tablebase(filename, number_of_guards, number_of_dragons,
+                    wdl.tobytes(), distances.tobytes())
+    return filename
+
+
+def generate_tablebases(max_pieces, directory, processes=None):
+    """
+    Generates, in the given directory, the tablebases of every material with
+    at most the given number of guards and dragons that is not there yet,
+    printing the counts of results of each.
+
+    :param max_pieces: the maximum number of guards and dragons
+    :type max_pieces: int
+    :param directory: the directory of the tablebases
+    :type directory: string
+    :param processes: the number of worker processes; defaults to the number
+        of CPUs
+    :type processes: int
+    """
+    os.makedirs(directory, exist_ok=True)
+    print("guards,dragons,king_wins,dragon_wins,draws,max_distance,seconds")
+    for number_of_pieces in range(max_pieces + 1):
+        for number_of_guards in range(number_of_pieces + 1):
+            number_of_dragons = number_of_pieces - number_of_guards
+            filename = tablebase_filename(directory, number_of_guards,
+                                          number_of_dragons)
+            if os.path.exists(filename):
+                continue
+            start = time.perf_counter()
+            generate_tablebase(number_of_guards, number_of_dragons,
+                               directory, processes)
+            results = np.memmap(filename, np.uint8, 'r', HEADER_SIZE)
+            number_of_positions = results.shape[0] // 2
+            wdl = results[:number_of_positions]
+            print(number_of_guards, number_of_dragons,
+                  int((wdl == WDL_KING_WIN).sum()),
+                  int((wdl == WDL_DRAGON_WIN).sum()),
+                  int((wdl == WDL_DRAW).sum()),
+                  int(results[number_of_positions:].max()),
+                  round(time.perf_counter() - start, 1), sep=',')
+            del results, wdl
+
+
+if __name__ == "__main__":
+    _parser = argparse.ArgumentParser(
+        description="Generate endgame tablebases by retrograde analysis.")
+    _parser.add_argument("directory", help="the directory of the tablebases")
+    _parser.add_argument("-n", "--max-pieces", type=int, default=3,
+                         help="the maximum number of guards and dragons")
+    _parser.add_argument("-p", "--processes", type=int, default=None,
+                         help="the number of worker processes")
+    _args = _parser.parse_args()
+    generate_tablebases(_args.max_pieces, _args.directory, _args.processes)
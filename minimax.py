@@ -1,9 +1,35 @@
 from TranspositionTable import *
 from state import *
+from ThreatMap import get_threat_map, get_unstoppable_king_moves
+from endgame_recognizers import recognize_endgame
+from Tablebase import open_tablebases, probe_tablebases, get_tablebase_move
+import math
+import random
+import time
 
 _table = None
+_analyze_table = False
+_eval_cache = None
+_tablebases = None
 DEFAULT_DEPTH_LIMIT = 4
 
+# For Monte Carlo tree search.
+DEFAULT_PLAYOUTS = 1000
+DEFAULT_EXPLORATION = math.sqrt(2)
+DEFAULT_MCTS_MAX_NODES = 2 ** 20
+MAX_PLAYOUT_PLIES = 200
+LIGHT_PLAYOUT_PLIES = 8
+PLAYOUT_SCORE_SCALE = 20000
+PLAYOUT_POLICIES = ('random', 'light')
+_mcts_tree = {}
+_mcts_root_key = None
+_mcts_playouts = DEFAULT_PLAYOUTS
+_mcts_seconds = None
+_mcts_exploration = DEFAULT_EXPLORATION
+_mcts_playout_policy = 'random'
+_mcts_max_nodes = DEFAULT_MCTS_MAX_NODES
+_mcts_random = random.Random()
+
 # For minimax and alpha beta.
 num_term = 0
 num_leafs = 0
@@ -18,13 +44,21 @@ num_move_ordering_alpha_cutoff = 0
 num_move_ordering_beta_cutoff = 0
 num_alpha_cutoff = 0
 num_beta_cutoff = 0
+num_king_races = 0
+num_endgame_hits = 0
+num_tablebase_hits = 0
+
+# For Monte Carlo tree search only.
+num_playouts = 0
+playout_seconds = 0.0
 
 
-def init_table(max_size, replacement_policy):
+def init_table(max_size, replacement_policy, max_bytes=None):
     """
     Initializes the global transposition table with the given parameters.
 
-    :param max_size: the maximum number of entries in the table
+    :param max_size: the maximum number of entries in the table; ignored once
+        the table has sampled the size of its entries if 'max_bytes' is given
     :type max_size: integral
     :param replacement_policy: a function that takes a TranspositionTable, a
         key, and a value, and returns a key and a value, which is either one of
@@ -34,9 +68,248 @@ def init_table(max_size, replacement_policy):
         added to the table (i.e. the new entry is rejected)
     :type replacement_policy: (TranspositionTable, X, Y) => X, Y, where X is
         the type of the keys in this table, and Y is the type of the values
+    :param max_bytes: if not None, the memory budget of the table in bytes,
+        from which its maximum number of entries is derived; defaults to None
+    :type max_bytes: integral
+    """
+    global _table
+    _table = TranspositionTable(max_size, replacement_policy, max_bytes)
+
+
+def init_two_level_table(max_size, replacement_policy, filename, back_size,
+                         max_bytes=None):
+    """
+    Initializes the global transposition table as a TwoLevelTable, whose
+    in-memory front table spills the entries it discards to a memory-mapped
+    back table in the file with the given name.
+
+    :param max_size: the maximum number of entries in the front table
+    :type max_size: integral
+    :param replacement_policy: the replacement policy of the front table (see
+        init_table())
+    :type replacement_policy: (TranspositionTable, X, Y) => X, Y, where X is
+        the type of the keys in this table, and Y is the type of the values
+    :param filename: the name of the file holding the back table
+    :type filename: string
+    :param back_size: the number of slots in the back table
+    :type back_size: integral
+    :param max_bytes: if not None, the memory budget of the front table in
+        bytes; defaults to None
+    :type max_bytes: integral
+    """
+    from TwoLevelTable import TwoLevelTable
+
+    global _table
+    _table = TwoLevelTable(max_size, replacement_policy, filename, back_size,
+                           max_bytes)
+
+
+def init_striped_table(max_size, replacement_policy, max_bytes=None,
+                       number_of_stripes=None):
+    """
+    Initializes the global transposition table as a StripedLockTable, so that
+    searches running in several threads can share it safely, including on a
+    free-threaded build of CPython. The global counters of this module are not
+    protected, and are only exact when a single thread searches at a time.
+
+    :param max_size: the maximum number of entries in the table
+    :type max_size: integral
+    :param replacement_policy: the replacement policy of every stripe of the
+        table (see init_table())
+    :type replacement_policy: (TranspositionTable, X, Y) => X, Y, where X is
+        the type of the keys in this table, and Y is the type of the values
+    :param max_bytes: if not None, the memory budget of the table in bytes;
+        defaults to None
+    :type max_bytes: integral
+    :param number_of_stripes: the number of lock stripes, or None to use
+        StripedLockTable.DEFAULT_NUMBER_OF_STRIPES; defaults to None
+    :type number_of_stripes: int
     """
+    from StripedLockTable import StripedLockTable, DEFAULT_NUMBER_OF_STRIPES
+
+    global _table
+    if number_of_stripes is None:
+        number_of_stripes = DEFAULT_NUMBER_OF_STRIPES
+    _table = StripedLockTable(max_size, replacement_policy, max_bytes,
+                              number_of_stripes)
+
+
+def init_shared_table(max_size):
+    """
+    Initializes the global transposition table as a new SharedMemoryTable with
+    the given number of slots, and returns the name by which other processes
+    can attach to it with attach_shared_table(). The table must be unlinked by
+    this process once every process is done with it.
+
+    :param max_size: the number of slots in the table
+    :type max_size: integral
+    :return: the name of the shared memory block of the table
+    :rtype: string
+    """
+    from SharedMemoryTable import SharedMemoryTable
+
     global _table
-    _table = TranspositionTable(max_size, replacement_policy)
+    _table = SharedMemoryTable.create(max_size)
+    return _table.get_name()
+
+
+def attach_shared_table(name):
+    """
+    Initializes the global transposition table of this process as the
+    SharedMemoryTable with the given name, created by init_shared_table() in
+    another process, so that searches in both processes share the table.
+
+    :param name: the name of the shared memory block of the table
+    :type name: string
+    """
+    from SharedMemoryTable import SharedMemoryTable
+
+    global _table
+    _table = SharedMemoryTable(name)
+
+
+def start_table_trace(filename):
+    """
+    Starts recording the access trace of the global transposition table to the
+    file with the given name (see TranspositionTable.start_trace()). The trace
+    can be replayed against any replacement policy and size with
+    trace_replay.py.
+
+    :param filename: the name of the file to which to record the trace
+    :type filename: string
+    """
+    global _table
+    _table.start_trace(filename)
+
+
+def stop_table_trace():
+    """
+    Stops recording the access trace of the global transposition table.
+    """
+    global _table
+    _table.stop_trace()
+
+
+def set_table_analysis(enabled):
+    """
+    Sets whether get_table_metadata_and_global_counters_then_reset() analyzes
+    the global transposition table (see TranspositionTable.analyze()). The
+    analysis samples the table, which takes time on large tables, so it is off
+    by default, and its columns are then None.
+
+    :param enabled: whether to analyze the table
+    :type enabled: bool
+    """
+    global _analyze_table
+    _analyze_table = enabled
+
+
+def init_eval_cache(max_size):
+    """
+    Initializes the global evaluation cache with the given number of slots.
+    Evaluation functions only use it once wrapped by cached_evaluation().
+
+    :param max_size: the number of slots in the cache
+    :type max_size: integral
+    """
+    from EvaluationCache import EvaluationCache
+
+    global _eval_cache
+    _eval_cache = EvaluationCache(max_size)
+
+
+def init_tablebases(directory):
+    """
+    Opens the endgame tablebases in the given directory (see Tablebase.py),
+    which alpha beta search then probes for the exact utility of the
+    positions they hold.
+
+    :param directory: the directory of the tablebases
+    :type directory: string
+    """
+    global _tablebases
+    _tablebases = open_tablebases(directory)
+
+
+def init_monte_carlo_tree_search(playouts=DEFAULT_PLAYOUTS, seconds=None,
+                                 exploration=DEFAULT_EXPLORATION,
+                                 playout_policy='random',
+                                 max_nodes=DEFAULT_MCTS_MAX_NODES, seed=None):
+    """
+    Sets the budget and the parameters of Monte Carlo tree search, and clears
+    its tree.
+
+    :param playouts: the number of playouts of each search, if no time budget
+        is given; defaults to DEFAULT_PLAYOUTS
+    :type playouts: int
+    :param seconds: the time budget of each search in seconds, or None to
+        use the playout budget; defaults to None
+    :type seconds: float
+    :param exploration: the exploration constant of UCT; defaults to
+        DEFAULT_EXPLORATION
+    :type exploration: float
+    :param playout_policy: one of PLAYOUT_POLICIES (see _playout()); defaults
+        to 'random'
+    :type playout_policy: string
+    :param max_nodes: the memory cap of the tree, as a number of nodes; a
+        search stops early when the tree reaches it; defaults to
+        DEFAULT_MCTS_MAX_NODES
+    :type max_nodes: int
+    :param seed: the seed of the random moves, or None; defaults to None
+    :type seed: int
+    """
+    global _mcts_tree
+    global _mcts_root_key
+    global _mcts_playouts
+    global _mcts_seconds
+    global _mcts_exploration
+    global _mcts_playout_policy
+    global _mcts_max_nodes
+    global _mcts_random
+    if playout_policy not in PLAYOUT_POLICIES:
+        raise ValueError("unknown playout policy: " + repr(playout_policy))
+    _mcts_tree = {}
+    _mcts_root_key = None
+    _mcts_playouts = playouts
+    _mcts_seconds = seconds
+    _mcts_exploration = exploration
+    _mcts_playout_policy = playout_policy
+    _mcts_max_nodes = max_nodes
+    _mcts_random = random.Random(seed)
+
+
+def cached_evaluation(evaluate):
+    """
+    Returns an evaluation function returning the same scores as the given one,
+    through the global evaluation cache, or the given function itself if the
+    cache was not initialized. The cache must only be used by one evaluation
+    function at a time.
+
+    :param evaluate: a function taking a state and an expanded state and
+        returning a heuristic estimate of the state's utility for the current
+        player
+    :type evaluate: (array of bytes, dict(byte, char)) => numeric
+    :return: the cached evaluation function
+    :rtype: (array of bytes, dict(byte, char)) => numeric
+    """
+    global _eval_cache
+    if _eval_cache is None:
+        return evaluate
+    return _eval_cache.wrap(evaluate)
+
+
+def get_eval_cache_counters():
+    """
+    Returns the number of hits and misses of the global evaluation cache as a
+    (<hits>, <misses>) pair, or (0, 0) if the cache was not initialized.
+
+    :return: the number of hits and misses of the global evaluation cache
+    :rtype: (int, int)
+    """
+    global _eval_cache
+    if _eval_cache is None:
+        return 0, 0
+    return _eval_cache.get_counters()
 
 
 def get_table_count():
@@ -53,12 +326,20 @@ def get_table_count():
 def get_table_metadata_and_global_counters_then_reset():
     """
     Returns a list containing all the metadata of the global TranspositionTable
-    and all the global counters used by minimax and alpha beta search, then
-    resets all of these.
+    and all the global counters used by minimax and alpha beta search, followed
+    by the hits of each level of the table, the hits and misses of the global
+    evaluation cache, the analysis of the table if it is enabled (see
+    set_table_analysis() and _analysis_columns()), the number of proven king
+    races, of endgame recognizer hits, and of tablebase hits, the number of
+    playouts of Monte Carlo tree search and their rate per second, and the
+    number of bytes used per entry of the table, then resets all of these. The columns are in the order of the
+    header of data.csv.
 
     :return: a list containing all the counters
     """
     global _table
+    global _analyze_table
+    global _eval_cache
     global num_term
     global num_leafs
     global num_usable_hits
@@ -70,13 +351,30 @@ def get_table_metadata_and_global_counters_then_reset():
     global num_move_ordering_beta_cutoff
     global num_alpha_cutoff
     global num_beta_cutoff
+    global num_king_races
+    global num_endgame_hits
+    global num_tablebase_hits
+    global num_playouts
+    global playout_seconds
+    playouts_per_second = 0
+    if playout_seconds > 0:
+        playouts_per_second = round(num_playouts / playout_seconds, 1)
+    analysis = None
+    if _analyze_table:
+        analysis = _table.analyze()
     counters = [_table.get_replacement_policy().__name__, _table.get_max_size(),
                 get_table_count(), *_table.get_counters(), num_term, num_leafs,
                 num_usable_hits, num_usable_hits_exact, num_usable_hits_alpha,
                 num_usable_hits_beta, num_usable_hits_pruning,
                 num_move_ordering_alpha_cutoff, num_move_ordering_beta_cutoff,
-                num_alpha_cutoff, num_beta_cutoff]
+                num_alpha_cutoff, num_beta_cutoff, *_table.get_level_hits(),
+                *get_eval_cache_counters(),
+                *_analysis_columns(analysis), num_king_races,
+                num_endgame_hits, num_tablebase_hits, num_playouts,
+                playouts_per_second, round(_table.get_bytes_per_entry(), 1)]
     _table.reset_counters()
+    if _eval_cache is not None:
+        _eval_cache.reset_counters()
     num_term = 0
     num_leafs = 0
     num_usable_hits = 0
@@ -88,9 +386,43 @@ def get_table_metadata_and_global_counters_then_reset():
     num_move_ordering_beta_cutoff = 0
     num_alpha_cutoff = 0
     num_beta_cutoff = 0
+    num_king_races = 0
+    num_endgame_hits = 0
+    num_tablebase_hits = 0
+    num_playouts = 0
+    playout_seconds = 0.0
     return counters
 
 
+def _analysis_columns(analysis):
+    """
+    Returns the given analysis of a transposition table (see
+    TranspositionTable.analyze()) as a list of the following columns:
+        the depth histogram, as space-separated <depth>:<fraction> pairs
+        the fraction of EXACT, ALPHA_CUTOFF, and BETA_CUTOFF entries
+        the hit rate by depth, as space-separated <depth>:<hit-rate> pairs
+        the collision rate
+    where all fractions and rates are rounded to 4 decimal places. Every
+    column is None if there is no analysis.
+
+    :param analysis: the analysis of a transposition table, or None
+    :type analysis: dict(string, object)
+    :return: the columns of the analysis
+    :rtype: list
+    """
+    if analysis is None:
+        return [None] * 6
+    collision_rate = analysis['collision-rate']
+    if collision_rate is not None:
+        collision_rate = round(collision_rate, 4)
+    return [' '.join(str(depth) + ':' + str(round(fraction, 4)) for
+                     depth, fraction in analysis['depth-histogram'].items()),
+            *(round(fraction, 4) for fraction in analysis['flag-mix']),
+            ' '.join(str(depth) + ':' + str(round(rate, 4)) for
+                     depth, rate in analysis['hit-rate-by-depth'].items()),
+            collision_rate]
+
+
 def dump_table(filename):
     """
     Prints the global transposition table to the file with the given name in
@@ -105,6 +437,20 @@ def dump_table(filename):
         json.dump(_table.to_json_serializable(), outfile, indent=1)
 
 
+def dump_table_binary(filename):
+    """
+    Saves the global transposition table to the file with the given name in
+    the binary format of MappedTable, which can be memory-mapped and probed
+    without loading it.
+
+    :param filename: the name of the file to which to save the table
+    """
+    from MappedTable import save_table
+
+    global _table
+    save_table(_table, filename)
+
+
 def print_utility_move_and_global_counters(result):
     """
     Prints the given result of minimax or alpha beta search, as well as the
@@ -125,6 +471,11 @@ def print_utility_move_and_global_counters(result):
     global num_move_ordering_beta_cutoff
     global num_alpha_cutoff
     global num_beta_cutoff
+    global num_king_races
+    global num_endgame_hits
+    global num_tablebase_hits
+    global num_playouts
+    global playout_seconds
     print("Final:", "utility", result[0], "move", result[1], "terminal",
           num_term, "leafs", num_leafs, "usable_hits", num_usable_hits)
     print("For alpha beta only:", "usable_hits_exact", num_usable_hits_exact,
@@ -132,7 +483,12 @@ def print_utility_move_and_global_counters(result):
           num_usable_hits_beta, "usable_hits_pruning", num_usable_hits_pruning,
           "move_ordering_alpha_cutoff", num_move_ordering_alpha_cutoff,
           "move_ordering_beta_cutoff", num_move_ordering_beta_cutoff,
-          "alpha_cutoff", num_alpha_cutoff, "beta_cutoff", num_beta_cutoff)
+          "alpha_cutoff", num_alpha_cutoff, "beta_cutoff", num_beta_cutoff,
+          "king_races", num_king_races, "endgame_hits", num_endgame_hits,
+          "tablebase_hits", num_tablebase_hits)
+    if num_playouts > 0:
+        print("For Monte Carlo tree search only:", "playouts", num_playouts,
+              "playouts_per_second", round(num_playouts / playout_seconds, 1))
 
 
 def minimax(state, expanded_state, evaluate, remaining_depth):
@@ -164,7 +520,7 @@ def minimax(state, expanded_state, evaluate, remaining_depth):
     global num_leafs
     global num_usable_hits
     hash_string = hash_state(state)
-    value = _table.get(hash_string)
+    value = _table.get(hash_string, depth=remaining_depth)
     if value is not None and value[DEPTH_INDEX] >= remaining_depth:
         num_usable_hits += 1
         return value[SCORE_INDEX], value[MOVE_INDEX]
@@ -175,8 +531,7 @@ def minimax(state, expanded_state, evaluate, remaining_depth):
     elif remaining_depth == 0:
         num_leafs += 1
         best_move = None
-        if is_piece_threatened(state, expanded_state) or \
-                can_king_win(state, expanded_state):
+        if not get_threat_map(state, expanded_state).is_quiet():
             utility = quiescence_search(state, expanded_state, evaluate)
         else:
             utility = evaluate(state, expanded_state)
@@ -222,7 +577,7 @@ def minimax_ordered(state, expanded_state, evaluate, remaining_depth):
     global num_leafs
     global num_usable_hits
     hash_string = hash_state(state)
-    value = _table.get(hash_string)
+    value = _table.get(hash_string, depth=remaining_depth)
     if value is not None and value[DEPTH_INDEX] >= remaining_depth:
         num_usable_hits += 1
         return value[SCORE_INDEX], value[MOVE_INDEX]
@@ -233,8 +588,7 @@ def minimax_ordered(state, expanded_state, evaluate, remaining_depth):
     elif remaining_depth == 0:
         num_leafs += 1
         best_move = None
-        if is_piece_threatened(state, expanded_state) or \
-                can_king_win(state, expanded_state):
+        if not get_threat_map(state, expanded_state).is_quiet():
             utility = quiescence_search_ordered(state, expanded_state, evaluate)
         else:
             utility = evaluate(state, expanded_state)
@@ -251,6 +605,79 @@ def minimax_ordered(state, expanded_state, evaluate, remaining_depth):
     return utility, best_move
 
 
+def _get_king_race_move(state, expanded_state, valid_moves):
+    """
+    Returns the move to play in a position where the king wins the race to
+    the first rank (see get_unstoppable_king_moves()): the king's step down,
+    or any valid move of the dragon player, who loses anyway.
+
+    :param state: a compact state representation
+    :type state: array of bytes
+    :param expanded_state: the expanded representation of the state
+    :type expanded_state: dict(byte, char)
+    :param valid_moves: the function returning the valid moves of a state
+    :type valid_moves: (array of bytes, dict(byte, char)) => list((byte, byte))
+    :return: the move to play
+    :rtype: (byte, byte)
+    """
+    if player_turn(state) == KING_PLAYER:
+        king_tile_idx = get_king_tile_index(state)
+        return king_tile_idx, king_tile_idx - 1
+    return valid_moves(state, expanded_state)[0]
+
+
+def _get_king_race_utility(state, king_race_moves):
+    """
+    Returns the utility of a position where the king wins the race to the
+    first rank in the given number of moves: KING_WIN, less the number of
+    plies to the win, like the tablebase utilities (see wdl_to_utility()).
+
+    :param state: a compact state representation
+    :type state: array of bytes
+    :param king_race_moves: the number of moves of the king to the first rank
+        (see get_unstoppable_king_moves())
+    :type king_race_moves: int
+    :return: the utility of the position
+    :rtype: int
+    """
+    if player_turn(state) == KING_PLAYER:
+        return KING_WIN - (2 * king_race_moves - 1)
+    return KING_WIN - 2 * king_race_moves
+
+
+def _probe_endgame(state, expanded_state, alpha, beta):
+    """
+    Returns the (<utility>, <move>) pair of the given non-terminal state if
+    an endgame recognizer (see recognize_endgame()) gives its exact utility,
+    or a bound on it outside of the window from alpha to beta, in which case
+    the utility is the fail-hard 'alpha' or 'beta' value, or returns None.
+
+    :param state: a compact state representation
+    :type state: array of bytes
+    :param expanded_state: the expanded representation of the state
+    :type expanded_state: dict(byte, char)
+    :param alpha: the utility of the best (i.e. highest-utility) move found so
+        far for the king player
+    :type: alpha numeric
+    :param beta: the utility of the best (i.e. lowest-utility) move found so
+        far for the dragon player
+    :type: beta numeric
+    :return: a (<utility>, <move>) pair, or None
+    :rtype: (numeric, (byte, byte))
+    """
+    bounds = recognize_endgame(state, expanded_state)
+    if bounds is None:
+        return None
+    lower, upper, move = bounds
+    if lower == upper:
+        return lower, move
+    if lower >= beta:
+        return beta, move
+    if upper <= alpha:
+        return alpha, move
+    return None
+
+
 def alpha_beta(state, expanded_state, evaluate, remaining_depth,
                alpha=DRAGON_WIN, beta=KING_WIN):
     """
@@ -266,7 +693,8 @@ def alpha_beta(state, expanded_state, evaluate, remaining_depth,
     :type expanded_state: dict(byte, char)
     :param evaluate: a function taking a state and an expanded state and
         returning a heuristic estimate of the state's utility for the current
-        player
+        player; if it has a true 'uses_window' attribute, it is also given
+        alpha and beta at the leaves, and may return a bound outside them
     :type evaluate: (array of bytes, dict(byte, char)) => numeric
     :param remaining_depth: how many more plies to visit recursively (i.e. what
         is the (maximum) remaining depth of the minimax recursive call tree);
@@ -284,6 +712,7 @@ def alpha_beta(state, expanded_state, evaluate, remaining_depth,
     :rtype: (numeric, (byte, byte))
     """
     global _table
+    global _tablebases
     global num_term
     global num_leafs
     global num_usable_hits
@@ -295,8 +724,11 @@ def alpha_beta(state, expanded_state, evaluate, remaining_depth,
     global num_move_ordering_beta_cutoff
     global num_alpha_cutoff
     global num_beta_cutoff
+    global num_king_races
+    global num_endgame_hits
+    global num_tablebase_hits
     hash_string = hash_state(state)
-    value = _table.get(hash_string)
+    value = _table.get(hash_string, depth=remaining_depth)
     if value is not None and value[DEPTH_INDEX] >= remaining_depth:
         num_usable_hits += 1
         flags = value[FLAGS_INDEX]
@@ -314,16 +746,39 @@ def alpha_beta(state, expanded_state, evaluate, remaining_depth,
             num_usable_hits_pruning += 1
             return score, value[MOVE_INDEX]
     is_term, utility = is_terminal(state, expanded_state)
+    tablebase_utility = king_race_moves = endgame = None
+    if not is_term:
+        if _tablebases is not None:
+            tablebase_utility = probe_tablebases(_tablebases, state)
+        if tablebase_utility is None:
+            king_race_moves = get_unstoppable_king_moves(state)
+            if king_race_moves is None:
+                endgame = _probe_endgame(state, expanded_state, alpha, beta)
     if is_term:
         num_term += 1
         best_move = None
+    elif tablebase_utility is not None:
+        num_tablebase_hits += 1
+        utility = tablebase_utility
+        best_move = None
+        if remaining_depth > 0:
+            best_move = get_tablebase_move(_tablebases, state, expanded_state)
+    elif king_race_moves is not None:
+        num_king_races += 1
+        utility = _get_king_race_utility(state, king_race_moves)
+        best_move = _get_king_race_move(state, expanded_state,
+                                        all_valid_moves)
+    elif endgame is not None:
+        num_endgame_hits += 1
+        utility, best_move = endgame
     elif remaining_depth == 0:
         num_leafs += 1
         best_move = None
-        if is_piece_threatened(state, expanded_state) or \
-                can_king_win(state, expanded_state):
+        if not get_threat_map(state, expanded_state).is_quiet():
             utility = quiescence_search_alpha_beta(state, expanded_state,
                                                    evaluate, alpha, beta)
+        elif getattr(evaluate, 'uses_window', False):
+            utility = evaluate(state, expanded_state, alpha, beta)
         else:
             utility = evaluate(state, expanded_state)
     else:
@@ -334,8 +789,7 @@ def alpha_beta(state, expanded_state, evaluate, remaining_depth,
         if value is not None:
             stored_move = best_move = value[MOVE_INDEX]
             stored_state = copy.deepcopy(state)
-            stored_expanded_state = \
-                create_expanded_state_representation(stored_state)
+            stored_expanded_state = expanded_state.copy()
             move_piece(stored_state, stored_expanded_state, best_move[0],
                        best_move[1])
             utility = alpha_beta(stored_state, stored_expanded_state, evaluate,
@@ -433,7 +887,8 @@ def alpha_beta_ordered(state, expanded_state, evaluate, remaining_depth,
     :type expanded_state: dict(byte, char)
     :param evaluate: a function taking a state and an expanded state and
         returning a heuristic estimate of the state's utility for the current
-        player
+        player; if it has a true 'uses_window' attribute, it is also given
+        alpha and beta at the leaves, and may return a bound outside them
     :type evaluate: (array of bytes, dict(byte, char)) => numeric
     :param remaining_depth: how many more plies to visit recursively (i.e. what
         is the (maximum) remaining depth of the minimax recursive call tree);
@@ -451,6 +906,7 @@ def alpha_beta_ordered(state, expanded_state, evaluate, remaining_depth,
     :rtype: (numeric, (byte, byte))
     """
     global _table
+    global _tablebases
     global num_term
     global num_leafs
     global num_usable_hits
@@ -462,8 +918,11 @@ def alpha_beta_ordered(state, expanded_state, evaluate, remaining_depth,
     global num_move_ordering_beta_cutoff
     global num_alpha_cutoff
     global num_beta_cutoff
+    global num_king_races
+    global num_endgame_hits
+    global num_tablebase_hits
     hash_string = hash_state(state)
-    value = _table.get(hash_string)
+    value = _table.get(hash_string, depth=remaining_depth)
     if value is not None and value[DEPTH_INDEX] >= remaining_depth:
         num_usable_hits += 1
         flags = value[FLAGS_INDEX]
@@ -481,17 +940,40 @@ def alpha_beta_ordered(state, expanded_state, evaluate, remaining_depth,
             num_usable_hits_pruning += 1
             return score, value[MOVE_INDEX]
     is_term, utility = is_terminal_ordered(state, expanded_state)
+    tablebase_utility = king_race_moves = endgame = None
+    if not is_term:
+        if _tablebases is not None:
+            tablebase_utility = probe_tablebases(_tablebases, state)
+        if tablebase_utility is None:
+            king_race_moves = get_unstoppable_king_moves(state)
+            if king_race_moves is None:
+                endgame = _probe_endgame(state, expanded_state, alpha, beta)
     if is_term:
         num_term += 1
         best_move = None
+    elif tablebase_utility is not None:
+        num_tablebase_hits += 1
+        utility = tablebase_utility
+        best_move = None
+        if remaining_depth > 0:
+            best_move = get_tablebase_move(_tablebases, state, expanded_state)
+    elif king_race_moves is not None:
+        num_king_races += 1
+        utility = _get_king_race_utility(state, king_race_moves)
+        best_move = _get_king_race_move(state, expanded_state,
+                                        all_valid_moves_ordered)
+    elif endgame is not None:
+        num_endgame_hits += 1
+        utility, best_move = endgame
     elif remaining_depth == 0:
         num_leafs += 1
         best_move = None
-        if is_piece_threatened(state, expanded_state) or \
-                can_king_win(state, expanded_state):
+        if not get_threat_map(state, expanded_state).is_quiet():
             utility = \
                 quiescence_search_alpha_beta_ordered(state, expanded_state,
                                                      evaluate, alpha, beta)
+        elif getattr(evaluate, 'uses_window', False):
+            utility = evaluate(state, expanded_state, alpha, beta)
         else:
             utility = evaluate(state, expanded_state)
     else:
@@ -502,8 +984,7 @@ def alpha_beta_ordered(state, expanded_state, evaluate, remaining_depth,
         if value is not None:
             stored_move = best_move = value[MOVE_INDEX]
             stored_state = copy.deepcopy(state)
-            stored_expanded_state = \
-                create_expanded_state_representation(stored_state)
+            stored_expanded_state = expanded_state.copy()
             move_piece(stored_state, stored_expanded_state, best_move[0],
                        best_move[1])
             utility = alpha_beta_ordered(stored_state, stored_expanded_state,
@@ -608,8 +1089,7 @@ def quiescence_search(state, expanded_state, evaluate):
         is_term, utility = is_terminal(new_state, new_expanded_state)
         if is_term:
             utilities.append(utility) 
-        elif is_piece_threatened(new_state, new_expanded_state) or \
-                can_king_win(new_state, new_expanded_state):
+        elif not get_threat_map(new_state, new_expanded_state).is_quiet():
             utility = quiescence_search(new_state, new_expanded_state,
                                         evaluate)
             utilities.append(utility)
@@ -644,8 +1124,7 @@ def quiescence_search_ordered(state, expanded_state, evaluate):
         is_term, utility = is_terminal_ordered(new_state, new_expanded_state)
         if is_term:
             utilities.append(utility)
-        elif is_piece_threatened(new_state, new_expanded_state) or \
-                can_king_win(new_state, new_expanded_state):
+        elif not get_threat_map(new_state, new_expanded_state).is_quiet():
             utility = quiescence_search_ordered(new_state, new_expanded_state,
                                                 evaluate)
             utilities.append(utility)
@@ -680,7 +1159,24 @@ def quiescence_search_alpha_beta(state, expanded_state, evaluate, alpha, beta):
         'evaluate' alone can do
     :rtype: numeric
     """
+    global _tablebases
+    global num_king_races
+    global num_endgame_hits
+    global num_tablebase_hits
     import sys
+    if _tablebases is not None:
+        utility = probe_tablebases(_tablebases, state)
+        if utility is not None:
+            num_tablebase_hits += 1
+            return utility
+    king_race_moves = get_unstoppable_king_moves(state)
+    if king_race_moves is not None:
+        num_king_races += 1
+        return _get_king_race_utility(state, king_race_moves)
+    endgame = _probe_endgame(state, expanded_state, alpha, beta)
+    if endgame is not None:
+        num_endgame_hits += 1
+        return endgame[0]
     is_max = player_turn(state) == KING_PLAYER
     _successors = successors_capture_only(state, expanded_state)
     utility = -sys.maxsize if is_max else sys.maxsize
@@ -701,11 +1197,10 @@ def quiescence_search_alpha_beta(state, expanded_state, evaluate, alpha, beta):
                     return alpha  # Return fail-hard 'alpha' value.
                 else:
                     beta = min(beta, utility)
-        elif is_piece_threatened(new_state, new_expanded_state) or \
-                can_king_win(new_state, new_expanded_state):
-            utility = quiescence_search_alpha_beta(new_state,
-                                                   new_expanded_state,
-                                                   evaluate, alpha, beta)
+        elif not get_threat_map(new_state, new_expanded_state).is_quiet():
+            new_util = quiescence_search_alpha_beta(new_state,
+                                                    new_expanded_state,
+                                                    evaluate, alpha, beta)
             if is_max:
                 if utility < new_util:
                     utility = new_util
@@ -721,7 +1216,7 @@ def quiescence_search_alpha_beta(state, expanded_state, evaluate, alpha, beta):
                 else:
                     beta = min(beta, utility)
         else:
-            utility = evaluate(new_state, new_expanded_state)
+            new_util = evaluate(new_state, new_expanded_state)
             if is_max:
                 if utility < new_util:
                     utility = new_util
@@ -761,7 +1256,24 @@ def quiescence_search_alpha_beta_ordered(state, expanded_state, evaluate,
         'evaluate' alone can do
     :rtype: numeric
     """
+    global _tablebases
+    global num_king_races
+    global num_endgame_hits
+    global num_tablebase_hits
     import sys
+    if _tablebases is not None:
+        utility = probe_tablebases(_tablebases, state)
+        if utility is not None:
+            num_tablebase_hits += 1
+            return utility
+    king_race_moves = get_unstoppable_king_moves(state)
+    if king_race_moves is not None:
+        num_king_races += 1
+        return _get_king_race_utility(state, king_race_moves)
+    endgame = _probe_endgame(state, expanded_state, alpha, beta)
+    if endgame is not None:
+        num_endgame_hits += 1
+        return endgame[0]
     is_max = player_turn(state) == KING_PLAYER
     _successors = successors_capture_only_ordered(state, expanded_state)
     utility = -sys.maxsize if is_max else sys.maxsize
@@ -782,9 +1294,8 @@ def quiescence_search_alpha_beta_ordered(state, expanded_state, evaluate,
                     return alpha  # Return fail-hard 'alpha' value.
                 else:
                     beta = min(beta, utility)
-        elif is_piece_threatened(new_state, new_expanded_state) or \
-                can_king_win(new_state, new_expanded_state):
-            utility = \
+        elif not get_threat_map(new_state, new_expanded_state).is_quiet():
+            new_util = \
                 quiescence_search_alpha_beta_ordered(new_state,
                                                      new_expanded_state,
                                                      evaluate, alpha, beta)
@@ -803,7 +1314,7 @@ def quiescence_search_alpha_beta_ordered(state, expanded_state, evaluate,
                 else:
                     beta = min(beta, utility)
         else:
-            utility = evaluate(new_state, new_expanded_state)
+            new_util = evaluate(new_state, new_expanded_state)
             if is_max:
                 if utility < new_util:
                     utility = new_util
@@ -821,3 +1332,237 @@ def quiescence_search_alpha_beta_ordered(state, expanded_state, evaluate,
     if len(_successors) == 0:
         return evaluate(state, expanded_state)
     return utility
+
+
+"""
+The indices of the fields of a node of the tree of Monte Carlo tree search:
+its number of visits, the sum of the outcomes of its playouts for the king
+player (1 for a win, 0.5 for a draw, and 0 for a loss), its children as a
+list of [<move>, <key>] pairs in random order (None until it is first
+selected, and a key of None until the child is first tried), whether it is
+the king player's turn, and its outcome if it is terminal, or None.
+"""
+VISITS = 0
+OUTCOMES = 1
+CHILDREN = 2
+IS_KING_TURN = 3
+TERMINAL_OUTCOME = 4
+
+
+def _new_mcts_node(state, expanded_state):
+    """
+    Returns a new node of the tree of Monte Carlo tree search for the given
+    state.
+    """
+    is_term, utility = is_terminal(state, expanded_state)
+    terminal_outcome = None
+    if is_term:
+        terminal_outcome = 1 if utility == KING_WIN else \
+            0 if utility == DRAGON_WIN else 0.5
+    return [0, 0, None, player_turn(state) == KING_PLAYER, terminal_outcome]
+
+
+def _keep_subtree(root_key):
+    """
+    Drops the nodes of the tree of Monte Carlo tree search that cannot be
+    reached from the node with the given key, keeping the subtree of the new
+    root between moves.
+    """
+    global _mcts_tree
+    if root_key not in _mcts_tree:
+        _mcts_tree = {}
+        return
+    subtree = {root_key: _mcts_tree[root_key]}
+    frontier = [root_key]
+    while frontier:
+        children = _mcts_tree[frontier.pop()][CHILDREN]
+        if children is None:
+            continue
+        for _, key in children:
+            if key is not None and key not in subtree:
+                subtree[key] = _mcts_tree[key]
+                frontier.append(key)
+    _mcts_tree = subtree
+
+
+def _playout(state, expanded_state, evaluate):
+    """
+    Plays the game on from the given state, which it modifies, and returns
+    its outcome for the king player. With the 'random' policy, both players
+    play random moves until the end of the game, and a game longer than
+    MAX_PLAYOUT_PLIES is a draw. With the 'light' policy, the king reaches
+    the first rank whenever he can, and otherwise the moves are random, and
+    after LIGHT_PLAYOUT_PLIES the outcome is estimated from the given
+    evaluation function, through the logistic function.
+    """
+    light = _mcts_playout_policy == 'light'
+    max_plies = LIGHT_PLAYOUT_PLIES if light else MAX_PLAYOUT_PLIES
+    for _ in range(max_plies):
+        is_term, utility = is_terminal(state, expanded_state)
+        if is_term:
+            return 1 if utility == KING_WIN else \
+                0 if utility == DRAGON_WIN else 0.5
+        moves = all_valid_moves(state, expanded_state)
+        move = None
+        if light and player_turn(state) == KING_PLAYER:
+            king_tile_idx = get_king_tile_index(state)
+            for from_tile_idx, to_tile_idx in moves:
+                if from_tile_idx == king_tile_idx and \
+                        to_tile_idx % BOARD_NUM_RANKS == 0:
+                    move = from_tile_idx, to_tile_idx
+                    break
+        if move is None:
+            move = _mcts_random.choice(moves)
+        move_piece(state, expanded_state, *move)
+    if not light:
+        return 0.5
+    is_term, utility = is_terminal(state, expanded_state)
+    if is_term:
+        return 1 if utility == KING_WIN else \
+            0 if utility == DRAGON_WIN else 0.5
+    score = evaluate(state, expanded_state) / PLAYOUT_SCORE_SCALE
+    return 1 / (1 + math.exp(-max(-50, min(50, score))))
+
+
+def _mcts_iteration(root_key, state, expanded_state, evaluate):
+    """
+    Runs one iteration of Monte Carlo tree search from the root with the
+    given key and the given state: selects a path with UCT, adds the first
+    untried child on the path to the tree, runs a playout from it, and adds
+    the outcome to the nodes of the path. A child already on the path is a
+    repetition, from which the playout starts instead.
+    """
+    state = state[:]
+    expanded_state = expanded_state.copy()
+    path = [root_key]
+    path_keys = {root_key}
+    node = _mcts_tree[root_key]
+    while True:
+        if node[TERMINAL_OUTCOME] is not None:
+            outcome = node[TERMINAL_OUTCOME]
+            break
+        if node[CHILDREN] is None:
+            node[CHILDREN] = [[move, None] for move in
+                              all_valid_moves(state, expanded_state)]
+            _mcts_random.shuffle(node[CHILDREN])
+
+        # Try the first untried child, if any, or else select one by UCT.
+        child = None
+        for candidate in node[CHILDREN]:
+            if candidate[1] is None:
+                child = candidate
+                break
+        if child is None:
+            log_visits = math.log(node[VISITS])
+            best_uct = None
+            for candidate in node[CHILDREN]:
+                child_node = _mcts_tree[candidate[1]]
+                if child_node[VISITS] == 0:
+                    child = candidate
+                    break
+                mean = child_node[OUTCOMES] / child_node[VISITS]
+                if not node[IS_KING_TURN]:
+                    mean = 1 - mean
+                uct = mean + _mcts_exploration * \
+                    math.sqrt(log_visits / child_node[VISITS])
+                if best_uct is None or uct > best_uct:
+                    best_uct = uct
+                    child = candidate
+        move_piece(state, expanded_state, *child[0])
+        if child[1] is None:
+            child[1] = hash_state_int(state)
+            if child[1] not in _mcts_tree:
+                _mcts_tree[child[1]] = _new_mcts_node(state, expanded_state)
+        if child[1] in path_keys:
+            outcome = _playout(state, expanded_state, evaluate)
+            break
+        path.append(child[1])
+        path_keys.add(child[1])
+        node = _mcts_tree[child[1]]
+        if node[VISITS] == 0:
+            outcome = node[TERMINAL_OUTCOME]
+            if outcome is None:
+                outcome = _playout(state, expanded_state, evaluate)
+            break
+    for key in path:
+        node = _mcts_tree[key]
+        node[VISITS] += 1
+        node[OUTCOMES] += outcome
+
+
+def monte_carlo_tree_search(state, expanded_state, evaluate, remaining_depth):
+    """
+    Performs Monte Carlo tree search with UCT selection from the given state,
+    within the budget set by init_monte_carlo_tree_search(), and returns the
+    move of the most visited child of the root, with the mean outcome of its
+    playouts for the king player scaled to [-1, 1] as its utility, or a move
+    that wins right away, with a utility of 1 or -1. The tree
+    is kept between searches: the subtree of the new root is reused, and the
+    rest of the tree is dropped. A transposition shares its node, so that
+    the tree is a DAG.
+
+    The remaining depth is ignored, and each call runs the whole budget, so
+    this function has the attribute 'ignores_depth', for which
+    iterative_deepening_search() calls it only once per move.
+
+    :param state: a compact state representation
+    :type state: array of bytes
+    :param expanded_state: the expanded representation of the state
+    :type expanded_state: dict(byte, char)
+    :param evaluate: a function taking a state and an expanded state and
+        returning a heuristic estimate of the state's utility for the current
+        player, used by the 'light' playout policy
+    :type evaluate: (array of bytes, dict(byte, char)) => numeric
+    :param remaining_depth: ignored
+    :type remaining_depth: int
+    :return: a (<utility>, <move>) pair
+    :rtype: (numeric, (byte, byte))
+    """
+    global _mcts_tree
+    global _mcts_root_key
+    global num_playouts
+    global playout_seconds
+    start = time.perf_counter()
+    root_key = hash_state_int(state)
+    if root_key != _mcts_root_key:
+        _keep_subtree(root_key)
+        _mcts_root_key = root_key
+    if root_key not in _mcts_tree:
+        _mcts_tree[root_key] = _new_mcts_node(state, expanded_state)
+    root = _mcts_tree[root_key]
+    if root[TERMINAL_OUTCOME] is not None:
+        return 2 * root[TERMINAL_OUTCOME] - 1, None
+
+    playouts = 0
+    while len(_mcts_tree) < _mcts_max_nodes:
+        if _mcts_seconds is None:
+            if playouts >= _mcts_playouts:
+                break
+        elif time.perf_counter() - start >= _mcts_seconds:
+            break
+        _mcts_iteration(root_key, state, expanded_state, evaluate)
+        playouts += 1
+    num_playouts += playouts
+    playout_seconds += time.perf_counter() - start
+
+    # Play a winning move right away, or else the most visited move.
+    win = 1 if root[IS_KING_TURN] else 0
+    best_visits = -1
+    best_utility = 0
+    best_move = None
+    for move, key in root[CHILDREN] or ():
+        if key is None:
+            continue
+        child_node = _mcts_tree[key]
+        if child_node[TERMINAL_OUTCOME] == win:
+            return 2 * win - 1, move
+        if child_node[VISITS] > best_visits:
+            best_visits = child_node[VISITS]
+            best_utility = 2 * child_node[OUTCOMES] / child_node[VISITS] - 1
+            best_move = move
+    if best_move is None:
+        best_move = all_valid_moves(state, expanded_state)[0]
+    return best_utility, best_move
+
+
+monte_carlo_tree_search.ignores_depth = True
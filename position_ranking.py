@@ -0,0 +1,250 @@
+from state import *
+
+"""
+Perfect hashing of positions: rank_position() maps each position with a
+given material signature, the pair (<number-of-live-guards>,
+<number-of-live-dragons>), to an index in a contiguous range starting at 0,
+and unrank_position() maps the index back to the position, so that
+per-position data can be stored in flat arrays instead of dicts keyed by
+hash_state().
+
+The index of a position is made of the tile of the king, the set of tiles of
+the guards among the 24 other tiles, and the set of tiles of the dragons
+among the tiles left, each set ranked in the combinatorial number system
+(see rank_combination()). The positions where it is the dragon player's
+turn come first, and then the positions where it is the king player's turn,
+so that each side to move also has a contiguous range of indices.
+
+Every index is that of a position, which may however be terminal, or not
+reachable in a game.
+"""
+
+NUMBER_OF_TILES = BOARD_NUM_RANKS * BOARD_NUM_FILES
+
+"""
+The binomial coefficients: BINOMIALS[n][k] is the number of ways of choosing
+k of n tiles, for 0 <= n, k <= NUMBER_OF_TILES.
+"""
+BINOMIALS = []
+for _n in range(NUMBER_OF_TILES + 1):
+    BINOMIALS.append(tuple(
+        1 if _k == 0 else 0 if _n == 0 else
+        BINOMIALS[_n - 1][_k - 1] + BINOMIALS[_n - 1][_k]
+        for _k in range(NUMBER_OF_TILES + 1)))
+BINOMIALS = tuple(BINOMIALS)
+
+
+def rank_combination(elements):
+    """
+    Returns the rank of the given set of distinct non-negative integers among
+    the sets of the same size, in the combinatorial number system: the sum of
+    BINOMIALS[c][i + 1] over the i-th smallest element c. The sets of k
+    elements less than n have the ranks 0 to BINOMIALS[n][k] - 1.
+
+    :param elements: distinct non-negative integers, in increasing order
+    :type elements: list(int)
+    :return: the rank of the set
+    :rtype: int
+    """
+    rank = 0
+    for i, element in enumerate(elements):
+        rank += BINOMIALS[element][i + 1]
+    return rank
+
+
+def unrank_combination(rank, size):
+    """
+    Returns the set of the given size with the given rank (see
+    rank_combination()).
+
+    :param rank: the rank of the set
+    :type rank: int
+    :param size: the number of elements of the set
+    :type size: int
+    :return: the elements of the set, in increasing order
+    :rtype: list(int)
+    """
+    elements = []
+    element = NUMBER_OF_TILES
+    for i in range(size, 0, -1):
+        # The largest element is the largest c with BINOMIALS[c][i] <= rank.
+        element -= 1
+        while BINOMIALS[element][i] > rank:
+            element -= 1
+        elements.append(element)
+        rank -= BINOMIALS[element][i]
+    elements.reverse()
+    return elements
+
+
+def _check_material(number_of_guards, number_of_dragons):
+    """
+    Raises a ValueError if no state holds the given numbers of live guards
+    and dragons, which share the STATE_SIZE - 1 bytes after the king.
+    """
+    if number_of_guards < 0 or number_of_dragons < 0 or \
+            number_of_guards + number_of_dragons > STATE_SIZE - 1:
+        raise ValueError("impossible material: {0} guards and {1} "
+                         "dragons".format(number_of_guards, number_of_dragons))
+
+
+def get_number_of_positions_per_turn(number_of_guards, number_of_dragons):
+    """
+    Returns the number of positions with the given material where it is a
+    given player's turn. Raises a ValueError if the material is impossible.
+
+    :param number_of_guards: the number of live guards
+    :type number_of_guards: int
+    :param number_of_dragons: the number of live dragons
+    :type number_of_dragons: int
+    :return: the number of positions for each side to move
+    :rtype: int
+    """
+    _check_material(number_of_guards, number_of_dragons)
+    return NUMBER_OF_TILES * \
+        BINOMIALS[NUMBER_OF_TILES - 1][number_of_guards] * \
+        BINOMIALS[NUMBER_OF_TILES - 1 - number_of_guards][number_of_dragons]
+
+
+def get_number_of_positions(number_of_guards, number_of_dragons):
+    """
+    Returns the number of positions with the given material, the size of the
+    range of their indices. Raises a ValueError if the material is
+    impossible.
+
+    :param number_of_guards: the number of live guards
+    :type number_of_guards: int
+    :param number_of_dragons: the number of live dragons
+    :type number_of_dragons: int
+    :return: the number of positions
+    :rtype: int
+    """
+    return 2 * get_number_of_positions_per_turn(number_of_guards,
+                                                number_of_dragons)
+
+
+def rank_position(state):
+    """
+    Returns the ((<number-of-guards>, <number-of-dragons>), <index>) pair of
+    the given state: its material signature, and the index of its position
+    among the positions with that material.
+
+    :param state: a compact state representation
+    :type state: array of bytes
+    :return: the material signature and the index of the state
+    :rtype: ((int, int), int)
+    """
+    king_tile_idx = get_king_tile_index(state)
+    guards = []
+    dragons = []
+    for i in range(1, STATE_SIZE):
+        num = state[i]
+        if num >= DRAGON_BASE:
+            dragons.append(num - DRAGON_BASE)
+        elif num != DEAD:
+            guards.append(num)
+    guards.sort()
+    dragons.sort()
+
+    # Renumber the tiles of the guards without the tile of the king, and
+    # those of the dragons without the tiles of the king and of the guards.
+    occupied = 1 << king_tile_idx
+    for i, tile_idx in enumerate(guards):
+        occupied |= 1 << tile_idx
+        guards[i] = tile_idx - (tile_idx > king_tile_idx)
+    for i, tile_idx in enumerate(dragons):
+        below = occupied & ((1 << tile_idx) - 1)
+        dragons[i] = tile_idx - bin(below).count('1')
+
+    number_of_guards = len(guards)
+    number_of_dragons = len(dragons)
+    guard_sets = BINOMIALS[NUMBER_OF_TILES - 1][number_of_guards]
+    dragon_sets = BINOMIALS[NUMBER_OF_TILES - 1 - number_of_guards][
+        number_of_dragons]
+    index = (king_tile_idx * guard_sets + rank_combination(guards)) * \
+        dragon_sets + rank_combination(dragons)
+    if player_turn(state) == KING_PLAYER:
+        index += get_number_of_positions_per_turn(number_of_guards,
+                                                  number_of_dragons)
+    return (number_of_guards, number_of_dragons), index
+
+
+def unrank_position(number_of_guards, number_of_dragons, index):
+    """
+    Returns the state of the position with the given material and index (see
+    rank_position()). Raises a ValueError if the material is impossible, or
+    if the index is not in the range of its indices.
+
+    :param number_of_guards: the number of live guards
+    :type number_of_guards: int
+    :param number_of_dragons: the number of live dragons
+    :type number_of_dragons: int
+    :param index: the index of the position
+    :type index: int
+    :return: the state of the position
+    :rtype: array of bytes
+    """
+    number_of_positions_per_turn = get_number_of_positions_per_turn(
+        number_of_guards, number_of_dragons)
+    if not 0 <= index < 2 * number_of_positions_per_turn:
+        raise ValueError("index out of range: " + str(index))
+    turn, index = divmod(index, number_of_positions_per_turn)
+    index, dragons_rank = divmod(
+        index,
+        BINOMIALS[NUMBER_OF_TILES - 1 - number_of_guards][number_of_dragons])
+    king_tile_idx, guards_rank = divmod(
+        index, BINOMIALS[NUMBER_OF_TILES - 1][number_of_guards])
+
+    # Map the renumbered tiles back to the free tiles, in increasing order.
+    free_tiles = [tile_idx for tile_idx in range(NUMBER_OF_TILES)
+                  if tile_idx != king_tile_idx]
+    guards = [free_tiles[i]
+              for i in unrank_combination(guards_rank, number_of_guards)]
+    for tile_idx in reversed(guards):
+        free_tiles.remove(tile_idx)
+    dragons = [free_tiles[i]
+               for i in unrank_combination(dragons_rank, number_of_dragons)]
+
+    positions = [king_tile_idx] + guards + \
+        [tile_idx + DRAGON_BASE for tile_idx in dragons]
+    positions += [DEAD] * (STATE_SIZE - len(positions))
+    return create_state_from(KING_PLAYER if turn else DRAGON_PLAYER,
+                             positions)
+
+
+def _test():
+    """
+    Checks that unrank_position() is the inverse of rank_position() over all
+    the positions with up to two guards and one dragon, and on the positions
+    of random games.
+    """
+    import random
+    for number_of_guards in range(3):
+        for number_of_dragons in range(2):
+            for index in range(get_number_of_positions(number_of_guards,
+                                                       number_of_dragons)):
+                state = unrank_position(number_of_guards, number_of_dragons,
+                                        index)
+                assert rank_position(state) == \
+                    ((number_of_guards, number_of_dragons), index), index
+    rng = random.Random(1)
+    number_of_states = 0
+    for _ in range(100):
+        state = get_default_game_start()
+        expanded_state = create_expanded_state_representation(state)
+        while not is_terminal(state, expanded_state)[0]:
+            material, index = rank_position(state)
+            assert 0 <= index < get_number_of_positions(*material)
+            new_state = unrank_position(*material, index)
+            assert new_state[0] & INDEX_AND_TURN_MASK == \
+                state[0] & INDEX_AND_TURN_MASK, state
+            assert sorted(new_state[1:]) == sorted(state[1:]), state
+            number_of_states += 1
+            state, expanded_state, _ = rng.choice(
+                successors(state, expanded_state))
+    print("rank_position() and unrank_position() OK on", number_of_states,
+          "states")
+
+
+if __name__ == "__main__":
+    _test()
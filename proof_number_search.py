@@ -0,0 +1,467 @@
+from state import *
+from array import array
+import argparse
+import itertools
+import time
+
+"""
+Proof-number search: a best-first solver that proves or disproves that a
+player, the prover, can force a win from a position.
+
+Each node of the search holds a proof number, the least number of leaves
+that must be proven for the node to be proven, and a disproof number, the
+least number of leaves that must be disproven for it to be disproven. A
+terminal leaf is proven if it is a win for the prover and disproven
+otherwise (see is_terminal()), and every other leaf starts at (1, 1). A node
+where it is the prover's turn (an OR node) has the least proof number and
+the sum of the disproof numbers of its children, and the other nodes (AND
+nodes) the sum of the proof numbers and the least disproof number. Each
+iteration expands the most-proving leaf, reached from the root by going to
+the child with the least proof number at OR nodes and the least disproof
+number at AND nodes, and updates the numbers of the nodes on the way back.
+
+The nodes are kept in a dict keyed by hash_state_int(), so that the search
+tree is a DAG where transpositions share their node. The game graph also has
+cycles: a child that is already on the path from the root is a repetition,
+counted as disproven, since the prover cannot win by going around a cycle
+forever. A proof never depends on a repetition, so proven wins are sound;
+a disproof may depend on the path it was found along (the graph-history
+interaction problem), so a disproof only means that no forced win was found,
+unless no repetition was cut off during the search (see NO_WIN_FOUND).
+
+With PN², each leaf expanded in the first-level DAG is first searched by a
+second-level search with its own, bounded DAG, thrown away afterwards, whose
+numbers initialize the children of the leaf. The first-level DAG then grows
+much slower than with plain proof-number search for the same effort.
+"""
+
+INFINITY = sys.maxsize
+DEFAULT_MAX_NODES = 2 ** 20
+DEFAULT_SECOND_LEVEL_NODES = 0
+DEFAULT_MOVE_MAX_NODES = 2 ** 14
+
+"""
+The result of proof_number_search() when the win is disproven, but the
+disproof may depend on a repetition, and of solve() when the wins of both
+players are disproven but one of the disproofs may: no forced win was found,
+which does not prove a draw.
+"""
+NO_WIN_FOUND = 'no-win-found'
+
+"""
+The indices of the fields of a node: its numbers, its state as bytes, its
+children as a list of (<move>, <key>) pairs (None until it is expanded),
+whether it is an OR node, and its rank in the order in which the nodes were
+solved (None until then, and 0 for the nodes solved without a first-level
+subtree).
+"""
+PROOF = 0
+DISPROOF = 1
+STATE = 2
+CHILDREN = 3
+IS_OR = 4
+SOLVED_AT = 5
+
+"""
+The ranks of the solved nodes.
+"""
+_solve_order = itertools.count(1)
+
+
+def _new_node(state, expanded_state, prover):
+    """
+    Returns a new leaf for the given state: proven or disproven if the state
+    is terminal, and (1, 1) otherwise.
+    """
+    is_or = player_turn(state) == prover
+    is_term, utility = is_terminal(state, expanded_state)
+    if not is_term:
+        return [1, 1, state.tobytes(), None, is_or, None]
+    prover_win = KING_WIN if prover == KING_PLAYER else DRAGON_WIN
+    if utility == prover_win:
+        return [0, INFINITY, state.tobytes(), [], is_or, 0]
+    return [INFINITY, 0, state.tobytes(), [], is_or, 0]
+
+
+def _get_numbers(nodes, node, path_keys):
+    """
+    Returns the (<proof>, <disproof>, <child-key>, <is-cut-off>) tuple of the
+    given expanded node, computed from its children, where the children on
+    the path from the root (the given keys) are repetitions, <child-key> is
+    the key of the child to go to towards the most-proving leaf, and
+    <is-cut-off> is True iff a child is a repetition.
+    """
+    best_key = None
+    is_cut_off = False
+    if node[IS_OR]:
+        proof = INFINITY
+        disproof = 0
+        for _, key in node[CHILDREN]:
+            if key in path_keys:
+                is_cut_off = True
+                continue
+            child = nodes[key]
+            if child[PROOF] < proof:
+                proof = child[PROOF]
+                best_key = key
+            disproof += child[DISPROOF]
+        return proof, min(disproof, INFINITY), best_key, is_cut_off
+    proof = 0
+    disproof = INFINITY
+    for _, key in node[CHILDREN]:
+        if key in path_keys:
+            return INFINITY, 0, None, True
+        child = nodes[key]
+        if child[DISPROOF] < disproof:
+            disproof = child[DISPROOF]
+            best_key = key
+        proof += child[PROOF]
+    return min(proof, INFINITY), disproof, best_key, False
+
+
+def _expand(nodes, key, prover, second_level_nodes):
+    """
+    Creates the children of the leaf with the given key that are not in the
+    DAG yet, and links the leaf to all its children. With a positive number
+    of second-level nodes, the new children get the numbers found by a
+    second-level search from the leaf. Returns True iff that search cut off a
+    repetition.
+    """
+    node = nodes[key]
+    state = array('B', node[STATE])
+    expanded_state = create_expanded_state_representation(state)
+    children = []
+    new_keys = []
+    for new_state, new_expanded_state, move in successors(state,
+                                                          expanded_state):
+        new_key = hash_state_int(new_state)
+        if new_key not in nodes:
+            nodes[new_key] = _new_node(new_state, new_expanded_state, prover)
+            new_keys.append(new_key)
+        children.append((move, new_key))
+    node[CHILDREN] = children
+    if second_level_nodes > 0 and new_keys:
+        second_level = {key: _new_node(state, expanded_state, prover)}
+        _, is_cut_off = _search(second_level, key, prover,
+                                second_level_nodes, 0)
+        for new_key in new_keys:
+            child = second_level.get(new_key)
+            if child is not None and nodes[new_key][SOLVED_AT] is None:
+                nodes[new_key][PROOF] = child[PROOF]
+                nodes[new_key][DISPROOF] = child[DISPROOF]
+                if child[PROOF] == 0 or child[DISPROOF] == 0:
+                    nodes[new_key][SOLVED_AT] = 0
+        return is_cut_off
+    return False
+
+
+def _search(nodes, root_key, prover, max_nodes, second_level_nodes):
+    """
+    Runs proof-number search in the given DAG from the node with the given
+    key until the root is solved, or the DAG has at least the given number
+    of nodes. Returns the (<number-of-iterations>, <is-cut-off>) pair, where
+    <is-cut-off> is True iff a repetition was cut off, so that the numbers
+    may depend on the paths they were computed along.
+    """
+    root = nodes[root_key]
+    iteration = 0
+    is_cut_off = False
+    while root[PROOF] != 0 and root[DISPROOF] != 0 and \
+            len(nodes) < max_nodes:
+        iteration += 1
+
+        # Go down to the most-proving leaf, or to a node that turns out to be
+        # solved when its children on the path are repetitions.
+        path = [root_key]
+        path_keys = {root_key}
+        key = root_key
+        while True:
+            node = nodes[key]
+            if node[CHILDREN] is None:
+                if second_level_nodes > 0:
+                    is_cut_off |= _expand(nodes, key, prover,
+                                          min(len(nodes), second_level_nodes))
+                else:
+                    _expand(nodes, key, prover, 0)
+                break
+            proof, disproof, key, _ = _get_numbers(nodes, node, path_keys)
+            if proof == 0 or disproof == 0:
+                break
+            path.append(key)
+            path_keys.add(key)
+
+        # Update the numbers on the way back to the root.
+        for depth in range(len(path) - 1, -1, -1):
+            path_keys.discard(path[depth])
+            node = nodes[path[depth]]
+            if node[SOLVED_AT] is not None:
+                continue
+            node[PROOF], node[DISPROOF], _, is_node_cut_off = \
+                _get_numbers(nodes, node, path_keys)
+            is_cut_off |= is_node_cut_off
+            if node[PROOF] == 0 or node[DISPROOF] == 0:
+                node[SOLVED_AT] = next(_solve_order)
+    return iteration, is_cut_off
+
+
+def _get_line(nodes, key, prover, max_nodes):
+    """
+    Returns the moves from the proven node with the given key to a win of the
+    prover: at OR nodes, the child proven first, and at AND nodes, the child
+    proven last, each proven before its parent. The line of a node proven by
+    a second-level search is searched again.
+    """
+    line = []
+    node = nodes[key]
+    if node[CHILDREN] is None:
+        state = array('B', node[STATE])
+        _, line, _ = proof_number_search(
+            state, create_expanded_state_representation(state), prover,
+            max_nodes)
+        return line
+    while node[CHILDREN]:
+        candidates = [(nodes[child_key][SOLVED_AT], move, child_key)
+                      for move, child_key in node[CHILDREN]
+                      if nodes[child_key][PROOF] == 0]
+        if node[IS_OR]:
+            _, move, key = min(candidates)
+        else:
+            _, move, key = max(candidates)
+        line.append(move)
+        node = nodes[key]
+        if node[CHILDREN] is None:
+            return line + _get_line(nodes, key, prover, max_nodes)
+    return line
+
+
+def proof_number_search(state, expanded_state, prover,
+                        max_nodes=DEFAULT_MAX_NODES,
+                        second_level_nodes=DEFAULT_SECOND_LEVEL_NODES):
+    """
+    Searches whether the given player can force a win from the given state,
+    and returns a (<result>, <line>, <number-of-nodes>) tuple, where
+    <result> is True if the win is proven, False if it is disproven without
+    cutting off any repetition, NO_WIN_FOUND if it is disproven otherwise,
+    and None if the DAG reached the given number of nodes first, and <line>
+    is a winning line if the win is proven, and an empty list otherwise.
+
+    :param state: a compact state representation
+    :type state: array of bytes
+    :param expanded_state: the expanded representation of the state
+    :type expanded_state: dict(byte, char)
+    :param prover: the player whose win to prove, KING_PLAYER or
+        DRAGON_PLAYER
+    :type prover: byte
+    :param max_nodes: the memory cap, as a number of nodes of the
+        (first-level) DAG; defaults to DEFAULT_MAX_NODES
+    :type max_nodes: int
+    :param second_level_nodes: the maximum number of nodes of each
+        second-level search of PN², or 0 for plain proof-number search;
+        defaults to DEFAULT_SECOND_LEVEL_NODES
+    :type second_level_nodes: int
+    :return: the result, a winning line, and the number of nodes
+    :rtype: (bool or string, list((byte, byte)), int)
+    """
+    root_key = hash_state_int(state)
+    nodes = {root_key: _new_node(state, expanded_state, prover)}
+    _, is_cut_off = _search(nodes, root_key, prover, max_nodes,
+                            second_level_nodes)
+    root = nodes[root_key]
+    if root[PROOF] == 0:
+        return True, _get_line(nodes, root_key, prover, max_nodes), \
+            len(nodes)
+    if root[DISPROOF] == 0:
+        return (NO_WIN_FOUND if is_cut_off else False), [], len(nodes)
+    return None, [], len(nodes)
+
+
+def solve(state, expanded_state, max_nodes=DEFAULT_MAX_NODES,
+          second_level_nodes=DEFAULT_SECOND_LEVEL_NODES):
+    """
+    Returns a (<utility>, <line>) pair for the given state: KING_WIN or
+    DRAGON_WIN and a winning line if the win of the player is proven, DRAW
+    and an empty line if the wins of both players are disproven without
+    cutting off any repetition, NO_WIN_FOUND and an empty line if they are
+    both disproven otherwise, or None and an empty line if a search reaches
+    the given number of nodes first. The player to move is searched first.
+
+    :param state: a compact state representation
+    :type state: array of bytes
+    :param expanded_state: the expanded representation of the state
+    :type expanded_state: dict(byte, char)
+    :param max_nodes: the memory cap of each search, as a number of nodes of
+        the (first-level) DAG; defaults to DEFAULT_MAX_NODES
+    :type max_nodes: int
+    :param second_level_nodes: the maximum number of nodes of each
+        second-level search of PN², or 0 for plain proof-number search;
+        defaults to DEFAULT_SECOND_LEVEL_NODES
+    :type second_level_nodes: int
+    :return: the result and a winning line
+    :rtype: (numeric or string, list((byte, byte)))
+    """
+    is_term, utility = is_terminal(state, expanded_state)
+    if is_term:
+        return utility, []
+    player = player_turn(state)
+    other_player = DRAGON_PLAYER if player == KING_PLAYER else KING_PLAYER
+    results = []
+    for prover in (player, other_player):
+        result, line, _ = proof_number_search(state, expanded_state, prover,
+                                              max_nodes, second_level_nodes)
+        if result is True:
+            return (KING_WIN if prover == KING_PLAYER else DRAGON_WIN), line
+        results.append(result)
+    if None in results:
+        return None, []
+    if NO_WIN_FOUND in results:
+        return NO_WIN_FOUND, []
+    return DRAW, []
+
+
+def make_proof_number_search(search, max_nodes=DEFAULT_MOVE_MAX_NODES,
+                             second_level_nodes=DEFAULT_SECOND_LEVEL_NODES):
+    """
+    Returns a search function that first tries to prove a win for the player
+    to move with proof-number search, returning the first move of the
+    winning line, and otherwise falls back to the given search function. The
+    results of the root states are remembered, so that iterative deepening
+    only searches each root once.
+
+    :param search: a search function taking a state, an expanded state, an
+        evaluation function, a remaining depth, and returning a
+        (<utility>, <move>) pair
+    :type search: (array of bytes,
+                   dict(byte, char),
+                   (array of bytes, dict(byte, char)) => numeric,
+                   int) => (numeric, (byte, byte))
+    :param max_nodes: the memory cap of each proof-number search; defaults
+        to DEFAULT_MOVE_MAX_NODES
+    :type max_nodes: int
+    :param second_level_nodes: the maximum number of nodes of each
+        second-level search of PN², or 0 for plain proof-number search;
+        defaults to DEFAULT_SECOND_LEVEL_NODES
+    :type second_level_nodes: int
+    :return: the search function
+    :rtype: (array of bytes,
+             dict(byte, char),
+             (array of bytes, dict(byte, char)) => numeric,
+             int) => (numeric, (byte, byte))
+    """
+    proven = {}
+
+    def proof_number_then_search(state, expanded_state, evaluate,
+                                 remaining_depth):
+        key = hash_state_int(state)
+        if key not in proven:
+            prover = player_turn(state)
+            result, line, _ = proof_number_search(
+                state, expanded_state, prover, max_nodes, second_level_nodes)
+            proven[key] = None
+            if result is True:
+                proven[key] = (KING_WIN if prover == KING_PLAYER
+                               else DRAGON_WIN), line[0]
+        if proven[key] is not None:
+            return proven[key]
+        return search(state, expanded_state, evaluate, remaining_depth)
+
+    return proof_number_then_search
+
+
+def get_game_positions(number_of_games, depth, plies_from_end, seed=0):
+    """
+    Returns positions from games of alpha-beta with split_weight_eval()
+    against itself, as in the games recorded in data.csv: in each game that
+    ends with a win, the position the given number of plies before the end.
+    The first two plies of each game are random, so that the games differ,
+    and games longer than 200 plies are dropped.
+
+    :param number_of_games: the number of games to play
+    :type number_of_games: int
+    :param depth: the depth limit of the search
+    :type depth: int
+    :param plies_from_end: how many plies before the end of each game to take
+        its position
+    :type plies_from_end: int
+    :param seed: the seed of the random opening moves; defaults to 0
+    :type seed: int
+    :return: the positions
+    :rtype: list(array of bytes)
+    """
+    import random
+    from evaluations import split_weight_eval
+    from minimax import init_table, alpha_beta
+    from TranspositionTable import TranspositionTable
+    rng = random.Random(seed)
+    positions = []
+    for _ in range(number_of_games):
+        init_table(2 ** 16, TranspositionTable.replace_overall_oldest)
+        state = get_default_game_start()
+        expanded_state = create_expanded_state_representation(state)
+        history = []
+        while not is_terminal(state, expanded_state)[0] and \
+                len(history) < 200:
+            history.append(state[:])
+            if len(history) <= 2:
+                move = rng.choice(all_valid_moves(state, expanded_state))
+            else:
+                _, move = alpha_beta(state, expanded_state, split_weight_eval,
+                                     depth)
+            move_piece(state, expanded_state, *move)
+        if is_terminal(state, expanded_state)[1] != DRAW and \
+                len(history) >= plies_from_end:
+            positions.append(history[-plies_from_end])
+    return positions
+
+
+def benchmark(positions, max_nodes, second_level_nodes):
+    """
+    Solves each of the given positions with plain proof-number search and
+    with PN², and prints the result, the length of the winning line, and the
+    time of each, as CSV.
+
+    :param positions: the positions to solve
+    :type positions: list(array of bytes)
+    :param max_nodes: the memory cap of each search
+    :type max_nodes: int
+    :param second_level_nodes: the maximum number of nodes of each
+        second-level search of PN²
+    :type second_level_nodes: int
+    """
+    print("position,algorithm,result,line_length,seconds")
+    for i, state in enumerate(positions):
+        for algorithm, second_level in (('pn', 0),
+                                        ('pn2', second_level_nodes)):
+            expanded_state = create_expanded_state_representation(state)
+            start = time.perf_counter()
+            utility, line = solve(state, expanded_state, max_nodes,
+                                  second_level)
+            seconds = time.perf_counter() - start
+            result = {KING_WIN: 'king', DRAGON_WIN: 'dragon', DRAW: 'draw',
+                      NO_WIN_FOUND: NO_WIN_FOUND, None: 'unknown'}[utility]
+            print(i, algorithm, result, len(line), round(seconds, 3),
+                  sep=',')
+
+
+if __name__ == "__main__":
+    _parser = argparse.ArgumentParser(
+        description="Benchmark proof-number search and PN² on positions near "
+                    "the end of alpha-beta games.")
+    _parser.add_argument("-g", "--games", type=int, default=10,
+                         help="the number of games to take positions from")
+    _parser.add_argument("-d", "--depth", type=int, default=3,
+                         help="the depth of the alpha-beta games")
+    _parser.add_argument("-p", "--plies-from-end", type=int, default=12,
+                         help="how many plies before the end of each game to"
+                              " take its position")
+    _parser.add_argument("-n", "--max-nodes", type=int, default=10000,
+                         help="the memory cap of each search, in nodes")
+    _parser.add_argument("-s", "--second-level-nodes", type=int,
+                         default=256,
+                         help="the maximum number of nodes of each "
+                              "second-level search of PN²")
+    _parser.add_argument("--seed", type=int, default=0,
+                         help="the seed of the random opening moves")
+    _args = _parser.parse_args()
+    benchmark(get_game_positions(_args.games, _args.depth,
+                                 _args.plies_from_end, _args.seed),
+              _args.max_nodes, _args.second_level_nodes)
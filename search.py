@@ -6,7 +6,10 @@ def iterative_deepening_search(state, expanded_state, evaluate, search,
                                max_depth):
     """
     Performs iterative-deepening search using the given search algorithm,
-    returning the best result of the search algorithm.
+    returning the best result of the search algorithm. A search algorithm
+    with a true 'ignores_depth' attribute (such as monte_carlo_tree_search(),
+    which runs its whole budget on each call) is only called once, with the
+    maximum depth, and its result is returned as is.
 
     :param state: the root state of the search
     :type state: array of bytes
@@ -28,6 +31,8 @@ def iterative_deepening_search(state, expanded_state, evaluate, search,
     :return: a (<utility>, <move>) pair
     :rtype: (numeric, (byte, byte))
     """
+    if getattr(search, 'ignores_depth', False):
+        return search(state, expanded_state, evaluate, max_depth)
     player = player_turn(state)
     if player == KING_PLAYER:
         best_utility = -sys.maxsize
@@ -71,6 +71,28 @@ DEFAULT_INITIAL_STATE = array('B', [DEFAULT_KING_PLUS_META_STATE_BYTE,
 _ord_a = ord('A')
 _ord_1 = ord('1')
 
+"""
+The type of the expanded states created by
+create_expanded_state_representation(), or None for plain dicts (see
+set_expanded_state_type()).
+"""
+_expanded_state_type = None
+
+
+def set_expanded_state_type(expanded_state_type):
+    """
+    Sets the type of the expanded states created from now on by
+    create_expanded_state_representation(). The type must be a dict subclass
+    that can be created from a plain expanded state, and whose copy() returns
+    an expanded state of the same type, since successors are created by
+    copying the expanded state of their parent. None restores plain dicts.
+
+    :param expanded_state_type: a dict subclass, or None
+    :type expanded_state_type: type
+    """
+    global _expanded_state_type
+    _expanded_state_type = expanded_state_type
+
 
 def get_default_game_start():
     """
@@ -124,6 +146,8 @@ def create_expanded_state_representation(state):
             num -= DRAGON_BASE
         if num != DEAD:
             representation[num] = 'D' if is_living_dragon else 'G'
+    if _expanded_state_type is not None:
+        return _expanded_state_type(representation)
     return representation
 
 
@@ -1329,7 +1353,7 @@ def successors_ordered(state, expanded_state):
     for from_tile_idx, to_tile_idx in all_valid_moves_ordered(state,
                                                               expanded_state):
         new_state = copy.deepcopy(state)
-        new_expanded_state = create_expanded_state_representation(new_state)
+        new_expanded_state = expanded_state.copy()
         move_piece(new_state, new_expanded_state, from_tile_idx, to_tile_idx)
         all_successors.append((new_state, new_expanded_state,
                                (from_tile_idx, to_tile_idx)))
@@ -1615,7 +1639,7 @@ def successors(state, expanded_state):
     all_successors = []
     for from_tile_idx, to_tile_idx in all_valid_moves(state, expanded_state):
         new_state = copy.deepcopy(state)
-        new_expanded_state = create_expanded_state_representation(new_state)
+        new_expanded_state = expanded_state.copy()
         move_piece(new_state, new_expanded_state, from_tile_idx, to_tile_idx)
         all_successors.append((new_state, new_expanded_state,
                                (from_tile_idx, to_tile_idx)))
@@ -1663,8 +1687,11 @@ def all_capture_moves(state, expanded_state):
             dragon_moves = \
                 _all_valid_moves_for_dragon(expanded_state, idx - DRAGON_BASE)
             for from_tile_idx, to_tile_idx in dragon_moves:
-                expanded_state[from_tile_idx] = EMPTY
-                expanded_state[to_tile_idx] = DRAGON
+                # Try the move in place, and undo it below. The writes bypass
+                # the bookkeeping of expanded states that track their changes
+                # (see set_expanded_state_type()), since nothing changes.
+                dict.__setitem__(expanded_state, from_tile_idx, EMPTY)
+                dict.__setitem__(expanded_state, to_tile_idx, DRAGON)
                 for tile_idx in get_orthogonal_tiles_around(to_tile_idx):
                     if expanded_state[tile_idx] == GUARD:
                         if _is_guard_surrounded(expanded_state, tile_idx):
@@ -1672,8 +1699,8 @@ def all_capture_moves(state, expanded_state):
                     elif expanded_state[tile_idx] == KING:
                         if _is_king_captured(state, expanded_state, tile_idx):
                             all_moves.append((from_tile_idx, to_tile_idx))
-                expanded_state[from_tile_idx] = DRAGON
-                expanded_state[to_tile_idx] = EMPTY
+                dict.__setitem__(expanded_state, from_tile_idx, DRAGON)
+                dict.__setitem__(expanded_state, to_tile_idx, EMPTY)
     return all_moves
 
 
@@ -1744,7 +1771,7 @@ def successors_capture_only(state, expanded_state):
     all_successors = []
     for from_tile_idx, to_tile_idx in all_capture_moves(state, expanded_state):
         new_state = copy.deepcopy(state)
-        new_expanded_state = create_expanded_state_representation(new_state)
+        new_expanded_state = expanded_state.copy()
         move_piece(new_state, new_expanded_state, from_tile_idx, to_tile_idx)
         all_successors.append((new_state, new_expanded_state,
                                (from_tile_idx, to_tile_idx)))
@@ -1769,7 +1796,7 @@ def successors_capture_only_ordered(state, expanded_state):
     for from_tile_idx, to_tile_idx in all_capture_moves_ordered(state,
                                                                 expanded_state):
         new_state = copy.deepcopy(state)
-        new_expanded_state = create_expanded_state_representation(new_state)
+        new_expanded_state = expanded_state.copy()
         move_piece(new_state, new_expanded_state, from_tile_idx, to_tile_idx)
         all_successors.append((new_state, new_expanded_state,
                                (from_tile_idx, to_tile_idx)))
@@ -1788,3 +1815,74 @@ def hash_state(state):
     return '.'.join('{:x}'.format(b) if i > 0
                     else '{:x}'.format(int(b) & INDEX_AND_TURN_MASK)
                     for i, b in enumerate(state))
+
+
+def _piece_code(b):
+    """
+    Returns a 6-bit code (0-50) for the given byte of a compact state, other
+    than the first: guard tile indices and DEAD keep their value, and dragon
+    tile indices are packed right after DEAD.
+
+    :param b: a byte of a compact state representation, other than the first
+    :type b: byte
+    :return: a 6-bit code for the given byte
+    :rtype: int
+    """
+    if b > DEAD:
+        return b - DRAGON_BASE + DEAD + 1
+    return b
+
+
+def hash_state_int(state):
+    """
+    Returns an integer hash of the given state. Like hash_state(), the hash
+    ignores the win bits of the state, and it is unique for every state: the
+    tile index of the king and the player's turn take the lowest 6 bits, and
+    each of the remaining bytes takes the next 6 bits, for 54 bits in total.
+    No valid state has a hash of 0.
+
+    :param state: a compact state representation
+    :type state: array of bytes
+    :return: an integer hash of the given state
+    :rtype: int
+    """
+    key = (int(state[0]) & INDEX_AND_TURN_MASK) >> 2
+    for i in range(1, STATE_SIZE):
+        key |= _piece_code(state[i]) << (6 * i)
+    return key
+
+
+def hash_string_to_int(hash_string):
+    """
+    Returns the integer hash of the state with the given hash string, which is
+    the same as hash_state_int() of the state itself.
+
+    :param hash_string: a hash string returned by hash_state()
+    :type hash_string: string
+    :return: the integer hash of the corresponding state
+    :rtype: int
+    """
+    parts = hash_string.split('.')
+    key = int(parts[0], 16) >> 2
+    for i in range(1, STATE_SIZE):
+        key |= _piece_code(int(parts[i], 16)) << (6 * i)
+    return key
+
+
+def int_to_hash_string(key):
+    """
+    Returns the hash string of the state with the given integer hash, which is
+    the same as hash_state() of the state itself.
+
+    :param key: an integer hash returned by hash_state_int()
+    :type key: int
+    :return: the hash string of the corresponding state
+    :rtype: string
+    """
+    parts = ['{:x}'.format((key & 0b111111) << 2)]
+    for i in range(1, STATE_SIZE):
+        code = (key >> (6 * i)) & 0b111111
+        if code > DEAD:
+            code += DRAGON_BASE - DEAD - 1
+        parts.append('{:x}'.format(code))
+    return '.'.join(parts)
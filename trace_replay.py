@@ -0,0 +1,106 @@
+from TranspositionTable import *
+import argparse
+
+"""
+Replays an access trace recorded by TranspositionTable.start_trace() (for
+example with 'python Main.py -t --trace <file>') against any replacement
+policy and table size, without running a search, and reports how well the
+table would have done.
+
+A lookup is a hit if the table holds an entry for its key, and a usable hit if
+that entry is also at least as deep as the remaining depth of the lookup. The
+replayed entries only keep the depth and the flags of the real entries, which
+is all the replacement policies look at.
+"""
+
+
+def read_trace(filename):
+    """
+    Returns the list of (<operation>, <key>, <depth>, <exact-alpha-or-beta>)
+    records in the access trace file with the given name.
+
+    :param filename: the name of the trace file
+    :type filename: string
+    :return: the records of the trace
+    :rtype: list((int, int, int, int))
+    """
+    with open(filename, 'rb') as infile:
+        data = infile.read()
+    data = data[:len(data) - len(data) % TRACE_RECORD_SIZE]
+    return list(struct.iter_unpack(TRACE_RECORD_FORMAT, data))
+
+
+def replay(trace, max_size, replacement_policy):
+    """
+    Replays the given trace against a new TranspositionTable with the given
+    maximum size and replacement policy, and returns a dict of the results:
+    the number of lookups, hits, and usable hits, the hit rate and usable-hit
+    rate, and the number of attempted mutations, replaced, and rejected
+    entries.
+
+    :param trace: the records of a trace, as returned by read_trace()
+    :type trace: list((int, int, int, int))
+    :param max_size: the maximum number of entries in the table
+    :type max_size: integral
+    :param replacement_policy: the replacement policy of the table
+    :type replacement_policy: (TranspositionTable, X, Y) => None
+    :return: the results of the replay
+    :rtype: dict(string, numeric)
+    """
+    table = TranspositionTable(max_size, replacement_policy)
+    get = table.get
+    put = table.__setitem__
+    lookups = hits = usable_hits = 0
+    for operation, key, depth, flags in trace:
+        if operation == TRACE_SET:
+            put(key, (depth, 0, None, flags))
+        else:
+            lookups += 1
+            value = get(key)
+            if value is not None:
+                hits += 1
+                if depth == TRACE_NO_DEPTH or value[DEPTH_INDEX] >= depth:
+                    usable_hits += 1
+    counters = table.get_counters()
+    return {
+        'policy': replacement_policy.__name__,
+        'size': max_size,
+        'lookups': lookups,
+        'hits': hits,
+        'usable-hits': usable_hits,
+        'hit-rate': hits / lookups if lookups else 0,
+        'usable-hit-rate': usable_hits / lookups if lookups else 0,
+        'mutations': counters[0],
+        'replaced': counters[1],
+        'rejected': counters[2]
+    }
+
+
+if __name__ == "__main__":
+    from Main import defaults
+
+    _parser = argparse.ArgumentParser(
+        description="Replay a transposition table access trace against "
+                    "replacement policies and table sizes.")
+    _parser.add_argument("trace_file", help="the trace to replay")
+    _parser.add_argument("-r", "--replace", nargs='+',
+                         default=list(defaults['replace'].keys()),
+                         choices=defaults['replace'].keys(),
+                         help="the replacement policies to replay; defaults "
+                              "to all of them")
+    _parser.add_argument("-s", "--table-size", nargs='+', type=int,
+                         default=[defaults['table-size']],
+                         help="the table sizes to replay")
+    _args = _parser.parse_args()
+
+    _trace = read_trace(_args.trace_file)
+    print("replacement_policy,table_max_size,lookups,hits,usable_hits,"
+          "hit_rate,usable_hit_rate,mutations,replaced,rejected")
+    for _name in _args.replace:
+        for _size in _args.table_size:
+            _results = replay(_trace, _size, defaults['replace'][_name])
+            print(_name, _size, _results['lookups'], _results['hits'],
+                  _results['usable-hits'], round(_results['hit-rate'], 4),
+                  round(_results['usable-hit-rate'], 4),
+                  _results['mutations'], _results['replaced'],
+                  _results['rejected'], sep=',')
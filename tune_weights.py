@@ -0,0 +1,413 @@
+from batch_moves import *
+from batch_minimax import get_batch_evaluation
+from compiled_evaluations import compile_evaluation, COMPILED_EVALUATIONS
+from array import array
+import argparse
+import json
+import random
+
+"""
+Tunes the weights of the features of extract_features() (see FEATURES) on
+positions labelled with the outcome of the game they were played in.
+
+The pipeline has three steps:
+1. self_play_positions() streams the positions of self-play games, each with
+   the outcome of its game (1 if the king player won, -1 if the dragon player
+   won, 0 for a draw). The games are played many at a time, each ply of all
+   of them expanded and evaluated in one batch (see batch_moves.py).
+2. export_dataset() extracts the features of the positions in batches (see
+   batch_features()) into a memory-mapped .npy file, one row per position
+   holding its features followed by its outcome.
+3. fit_least_squares() and fit_logistic() fit the weights on the dataset, a
+   chunk of rows at a time, so that the dataset does not need to fit in
+   memory.
+
+The weights are saved to a JSON file by save_weights(), and load_weights()
+reads them back for compile_evaluation() (see 'python Main.py --weights').
+"""
+
+"""
+The number of points of score that stand for a whole outcome: least-squares
+fits score / SCORE_SCALE to the outcome, and the logistic (Texel) fit takes
+sigmoid(score / SCORE_SCALE) as the probability that the king player wins.
+The default is the weight of a guard in split_weight_eval().
+"""
+SCORE_SCALE = 20000
+DEFAULT_BATCH_SIZE = 4096
+DEFAULT_CHUNK_SIZE = 2 ** 18
+MAX_GAME_PLIES = 200
+DEFAULT_EXPLORATION = 0.1
+DEFAULT_RANDOM_OPENING_PLIES = 4
+DEFAULT_NUMBER_OF_GAMES = 64
+OUTCOME_COLUMN = len(FEATURES)
+
+
+def self_play_positions(seed=0, evaluate=None,
+                        exploration=DEFAULT_EXPLORATION,
+                        random_opening_plies=DEFAULT_RANDOM_OPENING_PLIES,
+                        max_game_plies=MAX_GAME_PLIES,
+                        number_of_games=DEFAULT_NUMBER_OF_GAMES):
+    """
+    Yields (<state>, <outcome>) pairs forever: the non-terminal positions of
+    self-play games, in order, each with the outcome of its game (1 if the
+    king player won, -1 if the dragon player won, 0 for a draw, or if the
+    game lasted more than the given number of plies).
+
+    Each player plays the successor with the best score for them, or a random
+    successor with the given probability, and the first few plies of each
+    game are random.
+
+    The given number of games are played at once, in lockstep: the positions
+    of all the games in progress are expanded in one batch (see
+    batch_successors()), and their successors are evaluated in one batch
+    (see get_batch_evaluation()). The positions of a game are yielded when it
+    ends, and a new game starts in its place. With a single game, the games
+    are the same as when the successors are expanded one position at a time.
+
+    :param seed: the seed of the random moves; defaults to 0
+    :type seed: hashable
+    :param evaluate: the evaluation function of the players; defaults to the
+        compiled 'split' evaluation (see COMPILED_EVALUATIONS)
+    :type evaluate: (array of bytes, dict(byte, char)) => numeric
+    :param exploration: the probability of a random move; defaults to
+        DEFAULT_EXPLORATION
+    :type exploration: float
+    :param random_opening_plies: the number of random plies at the start of
+        each game; defaults to DEFAULT_RANDOM_OPENING_PLIES
+    :type random_opening_plies: int
+    :param max_game_plies: the number of plies after which a game is a draw;
+        defaults to MAX_GAME_PLIES
+    :type max_game_plies: int
+    :param number_of_games: the number of games played at once; defaults to
+        DEFAULT_NUMBER_OF_GAMES
+    :type number_of_games: int
+    :return: a generator of (<state>, <outcome>) pairs
+    :rtype: generator((array of bytes, int))
+    """
+    if evaluate is None:
+        evaluate = COMPILED_EVALUATIONS['split']
+    batch_evaluate = get_batch_evaluation(evaluate)
+    rng = random.Random(seed)
+    game_start = states_to_array([get_default_game_start()])[0]
+    states = np.tile(game_start, (number_of_games, 1))
+    plies = [0] * number_of_games
+    histories = [[] for _ in range(number_of_games)]
+    while True:
+        # End the games that are over, and start new ones in their place.
+        terminal, utilities = batch_is_terminal(states)
+        for i in range(number_of_games):
+            if plies[i] < max_game_plies and not terminal[i]:
+                continue
+            outcome = 0
+            if plies[i] < max_game_plies:
+                outcome = int(np.sign(utilities[i]))
+            for position in histories[i]:
+                yield position, outcome
+            histories[i] = []
+            plies[i] = 0
+            states[i] = game_start
+        for i, row in enumerate(states):
+            histories[i].append(array('B', row.tobytes()))
+
+        # Score every successor for the player to move, and find the first
+        # successor with the best score of each position.
+        parents, _, children = batch_successors(states)
+        offsets = np.searchsorted(parents, np.arange(number_of_games))
+        counts = np.diff(np.append(offsets, parents.shape[0]))
+        terminal, scores = batch_is_terminal(children)
+        if not terminal.all():
+            scores[~terminal] = batch_evaluate(children[~terminal])
+        signs = np.where(states[:, 0] & TURN_MASK, 1, -1)
+        scores *= signs[parents]
+        is_best = scores == np.maximum.reduceat(scores, offsets)[parents]
+        best = np.minimum.reduceat(
+            np.where(is_best, np.arange(parents.shape[0]), parents.shape[0]),
+            offsets)
+
+        for i in range(number_of_games):
+            if plies[i] < random_opening_plies or \
+                    rng.random() < exploration:
+                best[i] = offsets[i] + rng.randrange(counts[i])
+            plies[i] += 1
+        states = children[best]
+
+
+def export_dataset(filename, number_of_positions, positions=None,
+                   batch_size=DEFAULT_BATCH_SIZE):
+    """
+    Writes the features and outcomes of the given number of positions to a
+    memory-mapped .npy file with the given name, as an int32 array of shape
+    (number_of_positions, len(FEATURES) + 1) whose last column
+    (OUTCOME_COLUMN) holds the outcomes. The features are extracted a batch
+    of positions at a time.
+
+    :param filename: the name of the file to create (or overwrite)
+    :type filename: string
+    :param number_of_positions: the number of positions to write
+    :type number_of_positions: int
+    :param positions: an iterable of at least number_of_positions
+        (<state>, <outcome>) pairs; defaults to self_play_positions()
+    :type positions: iterable((array of bytes, int))
+    :param batch_size: the number of positions per batch; defaults to
+        DEFAULT_BATCH_SIZE
+    :type batch_size: int
+    :return: the dataset
+    :rtype: numpy.memmap
+    """
+    if positions is None:
+        positions = self_play_positions()
+    dataset = np.lib.format.open_memmap(
+        filename, mode='w+', dtype=np.int32,
+        shape=(number_of_positions, len(FEATURES) + 1))
+    positions = iter(positions)
+    for start in range(0, number_of_positions, batch_size):
+        batch = [next(positions) for _ in
+                 range(min(batch_size, number_of_positions - start))]
+        states = states_to_array(state for state, _ in batch)
+        end = start + len(batch)
+        dataset[start:end, :OUTCOME_COLUMN] = batch_features(states)
+        dataset[start:end, OUTCOME_COLUMN] = [outcome for _, outcome in batch]
+    dataset.flush()
+    return dataset
+
+
+def load_dataset(filename):
+    """
+    Returns the dataset in the .npy file with the given name, memory-mapped
+    read-only (see export_dataset()).
+
+    :param filename: the name of the dataset file
+    :type filename: string
+    :return: the dataset
+    :rtype: numpy.memmap
+    """
+    return np.load(filename, mmap_mode='r')
+
+
+def _chunks(dataset, chunk_size):
+    """
+    Yields the (<features>, <outcomes>) float64 arrays of the consecutive
+    chunks of the given dataset.
+    """
+    for start in range(0, dataset.shape[0], chunk_size):
+        chunk = np.asarray(dataset[start:start + chunk_size], dtype=np.float64)
+        yield chunk[:, :OUTCOME_COLUMN], chunk[:, OUTCOME_COLUMN]
+
+
+def _to_weights(vector):
+    """
+    Returns the weight of each feature, by name, for the given weight vector,
+    rounded to the nearest integer.
+    """
+    return {feature: int(round(weight))
+            for feature, weight in zip(FEATURES, vector)}
+
+
+def fit_least_squares(dataset, scale=SCORE_SCALE,
+                      chunk_size=DEFAULT_CHUNK_SIZE):
+    """
+    Returns the weights whose score, divided by the given scale, best fits
+    the outcomes of the given dataset in the least-squares sense. The normal
+    equations are summed a chunk of rows at a time.
+
+    :param dataset: a dataset (see export_dataset())
+    :type dataset: numpy.ndarray
+    :param scale: the score of a whole outcome; defaults to SCORE_SCALE
+    :type scale: numeric
+    :param chunk_size: the number of rows per chunk; defaults to
+        DEFAULT_CHUNK_SIZE
+    :type chunk_size: int
+    :return: the weight of each feature, by name
+    :rtype: dict(string, int)
+    """
+    gram = np.zeros((len(FEATURES), len(FEATURES)))
+    moments = np.zeros(len(FEATURES))
+    for features, outcomes in _chunks(dataset, chunk_size):
+        gram += features.T @ features
+        moments += features.T @ outcomes
+    # lstsq() also copes with features that are constant zero in the data.
+    vector = np.linalg.lstsq(gram, moments, rcond=None)[0]
+    return _to_weights(vector * scale)
+
+
+def fit_logistic(dataset, scale=SCORE_SCALE, iterations=20,
+                 chunk_size=DEFAULT_CHUNK_SIZE):
+    """
+    Returns the weights that minimize the cross-entropy between
+    sigmoid(score / scale) and the result of the king player, 1, 0.5 or 0,
+    over the given dataset (Texel tuning). The fit runs the given number of
+    Newton steps, each summing the gradient and the Hessian a chunk of rows
+    at a time.
+
+    :param dataset: a dataset (see export_dataset())
+    :type dataset: numpy.ndarray
+    :param scale: the score at which the king player wins with probability
+        sigmoid(1); defaults to SCORE_SCALE
+    :type scale: numeric
+    :param iterations: the number of Newton steps; defaults to 20
+    :type iterations: int
+    :param chunk_size: the number of rows per chunk; defaults to
+        DEFAULT_CHUNK_SIZE
+    :type chunk_size: int
+    :return: the weight of each feature, by name
+    :rtype: dict(string, int)
+    """
+    vector = np.zeros(len(FEATURES))
+    for _ in range(iterations):
+        gradient = np.zeros(len(FEATURES))
+        hessian = np.zeros((len(FEATURES), len(FEATURES)))
+        for features, outcomes in _chunks(dataset, chunk_size):
+            probabilities = 1 / (1 + np.exp(-(features @ vector)))
+            gradient += features.T @ (probabilities - (outcomes + 1) / 2)
+            hessian += (features.T * (probabilities * (1 - probabilities))) \
+                @ features
+        step = np.linalg.lstsq(hessian, gradient, rcond=None)[0]
+        vector -= step
+        if np.abs(step).max() <= 1e-9 * max(1, np.abs(vector).max()):
+            break
+    return _to_weights(vector * scale)
+
+
+def get_losses(dataset, weights, scale=SCORE_SCALE,
+               chunk_size=DEFAULT_CHUNK_SIZE):
+    """
+    Returns the (<mean-squared-error>, <cross-entropy>) pair of the given
+    weights over the given dataset: the mean squared error between
+    score / scale and the outcome, and the mean cross-entropy of the
+    logistic fit (see fit_least_squares() and fit_logistic()).
+
+    :param dataset: a dataset (see export_dataset())
+    :type dataset: numpy.ndarray
+    :param weights: the weight of each feature, by name
+    :type weights: dict(string, numeric)
+    :param scale: the score of a whole outcome; defaults to SCORE_SCALE
+    :type scale: numeric
+    :param chunk_size: the number of rows per chunk; defaults to
+        DEFAULT_CHUNK_SIZE
+    :type chunk_size: int
+    :return: the losses of the weights
+    :rtype: (float, float)
+    """
+    vector = np.array([weights.get(feature, 0) for feature in FEATURES],
+                      dtype=np.float64) / scale
+    squared_error = cross_entropy = 0.0
+    for features, outcomes in _chunks(dataset, chunk_size):
+        scores = features @ vector
+        squared_error += ((scores - outcomes) ** 2).sum()
+        # log(1 + exp(-x)) is np.logaddexp(0, -x), which does not overflow.
+        results = (outcomes + 1) / 2
+        cross_entropy += (results * np.logaddexp(0, -scores) +
+                          (1 - results) * np.logaddexp(0, scores)).sum()
+    number_of_positions = max(1, dataset.shape[0])
+    return squared_error / number_of_positions, \
+        cross_entropy / number_of_positions
+
+
+def save_weights(filename, weights):
+    """
+    Saves the given weights to a JSON file with the given name.
+
+    :param filename: the name of the file to create (or overwrite)
+    :type filename: string
+    :param weights: the weight of each feature, by name
+    :type weights: dict(string, numeric)
+    """
+    with open(filename, 'w') as outfile:
+        json.dump({feature: weights.get(feature, 0) for feature in FEATURES},
+                  outfile, indent=2)
+
+
+def load_weights(filename):
+    """
+    Returns the weights in the JSON file with the given name (see
+    save_weights()), raising a ValueError if it names an unknown feature.
+
+    :param filename: the name of the weights file
+    :type filename: string
+    :return: the weight of each feature, by name
+    :rtype: dict(string, numeric)
+    """
+    with open(filename) as infile:
+        weights = json.load(infile)
+    for feature in weights:
+        if feature not in FEATURES:
+            raise ValueError("unknown feature: " + repr(feature))
+    return weights
+
+
+def load_evaluation(filename):
+    """
+    Returns the evaluation function compiled from the weights in the JSON
+    file with the given name (see compile_evaluation()).
+
+    :param filename: the name of the weights file
+    :type filename: string
+    :return: the evaluation function
+    :rtype: (array of bytes, dict(byte, char)) => numeric
+    """
+    return compile_evaluation(load_weights(filename), 'tuned_eval')
+
+
+if __name__ == "__main__":
+    import time
+
+    _parser = argparse.ArgumentParser(
+        description="Export a dataset of self-play positions, or tune the "
+                    "feature weights on one.")
+    _subparsers = _parser.add_subparsers(dest='command', required=True)
+    _export_parser = _subparsers.add_parser(
+        'export', help="export the features of self-play positions")
+    _export_parser.add_argument("dataset_file", help="the .npy file to write")
+    _export_parser.add_argument("-n", "--positions", type=int,
+                                default=100000,
+                                help="the number of positions to export")
+    _export_parser.add_argument("--seed", type=int, default=0,
+                                help="the seed of the self-play games")
+    _export_parser.add_argument("-x", "--exploration", type=float,
+                                default=DEFAULT_EXPLORATION,
+                                help="the probability of a random move")
+    _export_parser.add_argument("-g", "--games", type=int,
+                                default=DEFAULT_NUMBER_OF_GAMES,
+                                help="the number of games played at once")
+    _fit_parser = _subparsers.add_parser(
+        'fit', help="fit the feature weights on a dataset")
+    _fit_parser.add_argument("dataset_file", help="the .npy file to read")
+    _fit_parser.add_argument("weights_file", help="the JSON file to write")
+    _fit_parser.add_argument("--method", default='logistic',
+                             choices=('logistic', 'least-squares'),
+                             help="the fitting method")
+    _fit_parser.add_argument("--scale", type=float, default=SCORE_SCALE,
+                             help="the score of a whole outcome")
+    _args = _parser.parse_args()
+
+    _start = time.perf_counter()
+    if _args.command == 'export':
+        _dataset = export_dataset(
+            _args.dataset_file, _args.positions,
+            self_play_positions(_args.seed, exploration=_args.exploration,
+                                number_of_games=_args.games))
+        _outcomes = _dataset[:, OUTCOME_COLUMN]
+        print("Exported", _dataset.shape[0], "positions in",
+              round(time.perf_counter() - _start, 1), "s:",
+              int((_outcomes > 0).sum()), "king wins,",
+              int((_outcomes < 0).sum()), "dragon wins,",
+              int((_outcomes == 0).sum()), "draws")
+    else:
+        _dataset = load_dataset(_args.dataset_file)
+        if _args.method == 'logistic':
+            _weights = fit_logistic(_dataset, _args.scale)
+        else:
+            _weights = fit_least_squares(_dataset, _args.scale)
+        save_weights(_args.weights_file, _weights)
+        print("Fitted", _dataset.shape[0], "positions in",
+              round(time.perf_counter() - _start, 1), "s")
+        print("feature,current_weight,tuned_weight")
+        for _feature, _current in zip(FEATURES, NET_FEATURE_WEIGHTS):
+            print(_feature, _current, _weights[_feature], sep=',')
+        print("weights,mean_squared_error,cross_entropy")
+        for _name, _candidate in (
+                ('current', dict(zip(FEATURES, NET_FEATURE_WEIGHTS))),
+                ('tuned', _weights)):
+            print(_name, *(round(loss, 4) for loss in
+                           get_losses(_dataset, _candidate, _args.scale)),
+                  sep=',')